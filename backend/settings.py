@@ -14,6 +14,7 @@ from datetime import timedelta
 from pathlib import Path
 
 import os
+import tempfile
 import dj_database_url
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -63,7 +64,8 @@ REST_FRAMEWORK = {
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
         
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # Trusts the token's claims instead of loading the user; see base/authentication.py.
+        'rest_framework_simplejwt.authentication.JWTStatelessUserAuthentication',
     ),
 
     'DEFAULT_RENDERER_CLASSES': [
@@ -102,7 +104,7 @@ SIMPLE_JWT = {
 
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
-    'TOKEN_USER_CLASS': 'rest_framework_simplejwt.models.TokenUser',
+    'TOKEN_USER_CLASS': 'base.authentication.ShopTokenUser',
 
     'JTI_CLAIM': 'jti',
 
@@ -153,9 +155,96 @@ WSGI_APPLICATION = 'backend.wsgi.application'
     }
 }'''
 
+# Connections are kept open for DB_CONN_MAX_AGE seconds (0 closes them after
+# every request) and pinged at the start of each request before reuse. Behind
+# PgBouncer in transaction mode set DB_PGBOUNCER=1: server-side cursors do not
+# survive across pooled transactions.
 DATABASES = {
-    'default': dj_database_url.parse(os.environ.get('DATABASE_URL'))
+    'default': dj_database_url.parse(
+        os.environ.get('DATABASE_URL'),
+        conn_max_age=int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        conn_health_checks=os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1',
+    )
 }
+if os.environ.get('DB_CONNECT_TIMEOUT') and DATABASES['default']['ENGINE'].endswith('postgresql'):
+    DATABASES['default'].setdefault('OPTIONS', {})['connect_timeout'] = int(os.environ['DB_CONNECT_TIMEOUT'])
+if os.environ.get('DB_PGBOUNCER') == '1':
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+# Async views (served by backend/asgi.py) run independent queries concurrently
+# on a pool of this many threads per process. Each thread holds its own
+# persistent connection, so budget that many extra connections per process.
+# Set to 0 to run them one at a time.
+ASYNC_CONCURRENT_QUERIES = int(os.environ.get('ASYNC_CONCURRENT_QUERIES', 3))
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Defaults to a per-process memory cache for development. Storefront
+# invalidation only reaches the process that made the write, so production must
+# point CACHE_BACKEND/CACHE_LOCATION at a shared backend (e.g.
+# django_redis.cache.RedisCache); `manage.py check --deploy` fails otherwise.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'jamly'),
+    }
+}
+
+STOREFRONT_CACHE_TIMEOUT = int(os.environ.get('STOREFRONT_CACHE_TIMEOUT', 60 * 15))
+
+# Background jobs (base/jobs.py) run in `manage.py run_workers`. Uploads wait
+# in JOB_STAGING_ROOT until a worker stores them; with several hosts, it must
+# be a shared volume. A worker renews its hold on a running job every
+# JOB_HEARTBEAT seconds; a job not renewed for JOB_TIMEOUT seconds is taken
+# to have lost its worker and is retried, however long it has been running.
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_HEARTBEAT = int(os.environ.get('JOB_HEARTBEAT', 30))
+JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', 60 * 2))
+JOB_RETRY_DELAY = int(os.environ.get('JOB_RETRY_DELAY', 30))
+JOB_STAGING_ROOT = os.environ.get('JOB_STAGING_ROOT', os.path.join(BASE_DIR, 'staging'))
+
+# Primary keys are time-ordered Snowflake ids (see base/ids.py). Each process
+# minting them needs its own worker id (0-31), which it locks in
+# ID_WORKER_LOCK_DIR: ID_WORKER_ID if set, else the first free one in
+# ID_WORKER_IDS. Locks only see one host, so give each host sharing the
+# database its own ID_WORKER_IDS range.
+ID_GENERATOR = os.environ.get('ID_GENERATOR', 'base.ids.snowflake')
+ID_WORKER_ID = int(os.environ['ID_WORKER_ID']) if os.environ.get('ID_WORKER_ID') else None
+ID_WORKER_IDS = os.environ.get('ID_WORKER_IDS', '0-31')
+ID_WORKER_LOCK_DIR = os.environ.get('ID_WORKER_LOCK_DIR', os.path.join(tempfile.gettempdir(), 'jamly-id-workers'))
+
+# The few token-authenticated paths that need the User row reuse it for this long.
+AUTH_USER_CACHE_SECONDS = int(os.environ.get('AUTH_USER_CACHE_SECONDS', 60))
+AUTH_USER_CACHE_SIZE = int(os.environ.get('AUTH_USER_CACHE_SIZE', 1024))
+
+# Password hashing (base/hashers.py). PASSWORD_HASHER picks the algorithm for
+# new passwords: pbkdf2, argon2 (needs argon2-cffi) or scrypt. The others stay
+# listed so existing hashes still verify; like hashes made at an old cost,
+# they are replaced on the user's next login. Lower the costs where logins
+# must be cheap, e.g. in tests.
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2')
+PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 260000))
+PASSWORD_ARGON2_TIME_COST = int(os.environ.get('PASSWORD_ARGON2_TIME_COST', 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.environ.get('PASSWORD_ARGON2_MEMORY_COST', 102400))
+PASSWORD_ARGON2_PARALLELISM = int(os.environ.get('PASSWORD_ARGON2_PARALLELISM', 8))
+PASSWORD_SCRYPT_WORK_FACTOR = int(os.environ.get('PASSWORD_SCRYPT_WORK_FACTOR', 2 ** 14))
+_PASSWORD_HASHERS = {
+    'pbkdf2': 'base.hashers.PBKDF2PasswordHasher',
+    'argon2': 'base.hashers.Argon2PasswordHasher',
+    'scrypt': 'base.hashers.ScryptPasswordHasher',
+}
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    hasher for name, hasher in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+]
+
+# Password resets email a link to PASSWORD_RESET_URL, where the app asks for
+# the new password and posts it with the uid and token to
+# user/password-reset/confirm/. Links last PASSWORD_RESET_TIMEOUT seconds.
+PASSWORD_RESET_URL = os.environ.get('PASSWORD_RESET_URL', 'http://localhost:3000/reset-password/{uid}/{token}/')
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'webmaster@localhost')
 
 
 # Password validation
@@ -42,3 +42,7 @@ admin.site.register(ProductOption, OptionAdmin)
 admin.site.register(ProductVariant)
 admin.site.register(Order)
 admin.site.register(OrderItem)
+admin.site.register(ShopDailySales)
+admin.site.register(CatalogImport)
+admin.site.register(CustomerImport)
+admin.site.register(Job)
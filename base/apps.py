@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class BaseConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'base'
+
+    def ready(self):
+        # catalog and importers register their background tasks.
+        from . import catalog, checks, db, importers, signals  # noqa: F401
@@ -0,0 +1,146 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import send_mail
+from django.utils.encoding import force_bytes
+from django.utils.functional import cached_property
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import Customer, Shop, User
+
+
+# Authenticated API requests are served from the access token's claims, so
+# checking who is calling costs no query. Claims are fixed when the token is
+# issued. Refreshing re-reads the user and mints new claims (see
+# ShopTokenRefreshSerializer), so a change to them (a deactivated account, a
+# new shop) takes effect within ACCESS_TOKEN_LIFETIME.
+
+def owned_shop(user):
+    """
+    The shop `user` owns, or None. Looked up at most once per instance;
+    a shop created with owner=user is already known.
+    """
+    relation = User._meta.get_field('shop')
+    if not relation.is_cached(user):
+        relation.set_cached_value(user, Shop.objects.filter(owner_id=user.id).first())
+    return relation.get_cached_value(user)
+
+
+class ShopRefreshToken(RefreshToken):
+    """
+    A refresh token carrying the claims the API needs about its user. Access
+    tokens made from it copy them; a refresh mints a new one from the user.
+    """
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        shop = owned_shop(user)
+        token['shop_id'] = shop.id if shop else None
+        token['is_shop_owner'] = user.is_shop_owner
+        token['is_customer'] = isinstance(user, Customer) or Customer.objects.filter(user_ptr_id=user.id).exists()
+        token['is_staff'] = user.is_staff
+        token['is_superuser'] = user.is_superuser
+        return token
+
+
+def issue_tokens(user):
+    """
+    Mints the refresh/access pair for a login, sign-up or refresh, once. Returns
+    them encoded, keyed 'refresh' and 'access'.
+    """
+    refresh = ShopRefreshToken.for_user(user)
+    return {'refresh': str(refresh), 'access': str(refresh.access_token)}
+
+
+def send_password_reset(user):
+    """
+    Emails `user` a link to choose a new password. The token stops working
+    once the password changes, or after PASSWORD_RESET_TIMEOUT.
+    """
+    url = settings.PASSWORD_RESET_URL.format(
+        uid=urlsafe_base64_encode(force_bytes(user.pk)), token=default_token_generator.make_token(user),
+    )
+    send_mail('Choose your password', f'Choose a password for {user.email} here:\n\n{url}\n', None, [user.email])
+
+
+def password_reset_user(uid, token):
+    """
+    The user a reset link was sent to, or None if the link is not valid.
+    """
+    try:
+        user = User.objects.get(pk=int(urlsafe_base64_decode(uid)))
+    except (TypeError, ValueError, OverflowError, User.DoesNotExist):
+        return None
+    return user if default_token_generator.check_token(user, token) else None
+
+
+_users = {}
+_users_lock = threading.Lock()
+
+
+def cached_user(user_id):
+    """
+    The User row for `user_id`, reused within this process for
+    AUTH_USER_CACHE_SECONDS. For the few paths that need more than the
+    token's claims; treat it as read-only.
+    """
+    now = time.monotonic()
+    with _users_lock:
+        hit = _users.get(user_id)
+    if hit is not None and hit[0] > now:
+        return hit[1]
+
+    user = User.objects.get(id=user_id)
+    with _users_lock:
+        if len(_users) >= settings.AUTH_USER_CACHE_SIZE:
+            for key in [key for key, (expires, _) in _users.items() if expires <= now] or list(_users):
+                del _users[key]
+        _users[user_id] = (now + settings.AUTH_USER_CACHE_SECONDS, user)
+    return user
+
+
+class ShopTokenUser(TokenUser):
+    """
+    The request.user of token-authenticated requests. Claims missing from
+    tokens issued before they were added are read from the cached row.
+    """
+    def claim(self, name, default):
+        if name in self.token:
+            return self.token[name]
+        return default(self.user)
+
+    @cached_property
+    def user(self):
+        return cached_user(self.id)
+
+    @cached_property
+    def shop_id(self):
+        return self.claim('shop_id', lambda user: Shop.objects.filter(owner_id=user.id).values_list('id', flat=True).first())
+
+    @cached_property
+    def is_shop_owner(self):
+        return self.claim('is_shop_owner', lambda user: user.is_shop_owner)
+
+    @cached_property
+    def is_customer(self):
+        return self.claim('is_customer', lambda user: Customer.objects.filter(user_ptr_id=user.id).exists())
+
+    @cached_property
+    def email(self):
+        return self.user.email
+
+
+def shop_id_of(user):
+    """
+    The id of the shop `user` owns, or None. Free for token users; other
+    users (sessions, tests) cost a query.
+    """
+    if isinstance(user, ShopTokenUser):
+        return user.shop_id
+    if not user.is_authenticated:
+        return None
+    return Shop.objects.filter(owner_id=user.pk).values_list('id', flat=True).first()
@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+STOREFRONT_KEY = 'storefront:{}'
+STOREFRONT_VALIDATORS_KEY = 'storefront-validators:{}'
+STOREFRONT_HITS_KEY = 'storefront:hits'
+STOREFRONT_MISSES_KEY = 'storefront:misses'
+
+
+def _count(key):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr(); losing one tick is fine.
+        pass
+
+
+def get_storefront(domain_name):
+    """
+    Returns the cached storefront JSON for a shop domain, or None.
+    """
+    content = cache.get(STOREFRONT_KEY.format(domain_name))
+    _count(STOREFRONT_MISSES_KEY if content is None else STOREFRONT_HITS_KEY)
+    return content
+
+
+def set_storefront(domain_name, content):
+    cache.set(STOREFRONT_KEY.format(domain_name), content, settings.STOREFRONT_CACHE_TIMEOUT)
+
+
+def get_storefront_validators(domain_name):
+    """
+    Returns the cached catalog state behind the storefront ETag and
+    Last-Modified headers, or None.
+    """
+    return cache.get(STOREFRONT_VALIDATORS_KEY.format(domain_name))
+
+
+def set_storefront_validators(domain_name, validators):
+    cache.set(STOREFRONT_VALIDATORS_KEY.format(domain_name), validators, settings.STOREFRONT_CACHE_TIMEOUT)
+
+
+def invalidate_storefront(domain_name):
+    """
+    Drops the cached storefront and its validators for a shop domain. The
+    keys are deleted again once the current transaction commits so a read
+    racing the write cannot put stale data back.
+    """
+    if not domain_name:
+        return
+    keys = [STOREFRONT_KEY.format(domain_name), STOREFRONT_VALIDATORS_KEY.format(domain_name)]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_storefront_for_shop(shop_id):
+    """
+    Same as invalidate_storefront, for callers that only know the shop id
+    (or a one-row subquery yielding it).
+    """
+    from .models import Shop
+
+    domain_name = Shop.objects.filter(id=shop_id).values_list('myjamly_domain', flat=True).first()
+    invalidate_storefront(domain_name)
+
+
+def storefront_cache_stats():
+    hits = cache.get(STOREFRONT_HITS_KEY, 0)
+    misses = cache.get(STOREFRONT_MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else None,
+    }
@@ -0,0 +1,320 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+from .ids import new_id
+from .images import content_hash
+from .jobs import enqueue, task
+from .models import OptionValue, Product, ProductImage, ProductOption, ProductVariant
+
+
+VariantValue = ProductVariant.values.through
+
+
+def parse_json_list(data):
+    """
+    Multipart requests carry nested lists as JSON strings, either as a whole
+    or item by item; returns a plain list of dicts either way.
+    """
+    if isinstance(data, str):
+        data = json.loads(data)
+    return [json.loads(item) if isinstance(item, str) else item for item in data]
+
+
+def build_options(product, options_data):
+    """
+    Builds unsaved options and values for a product. Returns both lists.
+    """
+    options, values = [], []
+    for option_data in options_data:
+        option_data = dict(option_data)
+        option_data.pop('product', None)
+        # Ids are assigned here; one sent for a row that matched nothing is not reused.
+        option_data.pop('id', None)
+        values_data = option_data.pop('values', [])
+        # bulk_create bypasses save(), which is where ids are assigned.
+        option = ProductOption(id=new_id(), product=product, **option_data)
+        options.append(option)
+        for value_data in parse_json_list(values_data):
+            values.append(OptionValue(id=new_id(), option=option, name=value_data['name']))
+    return options, values
+
+
+def create_options(product, options_data):
+    """
+    Creates a product's options and their values with one INSERT per table.
+    Returns the created values.
+    """
+    options, values = build_options(product, options_data)
+    ProductOption.objects.bulk_create(options)
+    OptionValue.objects.bulk_create(values)
+    return values
+
+
+def values_by_name(values):
+    by_name = {}
+    for value in values:
+        by_name.setdefault(value.name, value)
+    return by_name
+
+
+def build_variants(product, variants_data, values):
+    """
+    Builds unsaved variants for a product and their links to `values`,
+    matched by name. Returns both lists.
+    """
+    by_name = values_by_name(values)
+    variants, links = [], []
+    for variant_data in variants_data:
+        variant_data = dict(variant_data)
+        variant_data.pop('product', None)
+        variant_data.pop('id', None)
+        values_data = parse_json_list(variant_data.pop('values', []))
+        variant = ProductVariant(id=new_id(), product=product, **variant_data)
+        variants.append(variant)
+        for value_data in values_data:
+            value = by_name.get(value_data.get('name'))
+            if value is None:
+                raise ValidationError({'variants': [f"Unknown option value {value_data.get('name')!r}."]})
+            links.append(VariantValue(productvariant_id=variant.id, optionvalue_id=value.id))
+    return variants, links
+
+
+def create_variants(product, variants_data, values=None):
+    """
+    Creates a product's variants and links them to their option values with
+    one INSERT per table. Values are matched by name against `values`, or
+    against the product's stored values when not given.
+    """
+    if values is None:
+        values = OptionValue.objects.filter(option__product=product)
+    variants, links = build_variants(product, variants_data, values)
+    ProductVariant.objects.bulk_create(variants)
+    VariantValue.objects.bulk_create(links)
+    return variants
+
+
+def _matcher(existing, field):
+    # Incoming rows match stored ones by id when they carry one, else by
+    # name. Returns the matcher and the stored rows left unmatched so far.
+    # An id that is not one of `existing`, or was already matched, is
+    # rejected under `field`.
+    by_id = {row.id: row for row in existing}
+    by_name = {}
+    for row in existing:
+        by_name.setdefault(row.name, row)
+
+    def match(data):
+        if data.get('id') not in (None, ''):
+            try:
+                row = by_id.get(int(data['id']))
+            except (TypeError, ValueError):
+                row = None
+            if row is None:
+                raise ValidationError({field: [f"{data['id']} is not one of this product's {field}."]})
+        else:
+            row = by_name.get(data.get('name'))
+        if row is not None:
+            by_id.pop(row.id, None)
+            if by_name.get(row.name) is row:
+                del by_name[row.name]
+        return row
+
+    return match, by_id
+
+
+def sync_collections(product, collections):
+    """
+    Adds and removes only the collection memberships that changed.
+    """
+    current = set(product.collections.values_list('id', flat=True))
+    wanted = {int(getattr(collection, 'pk', collection)) for collection in collections}
+    if current - wanted:
+        product.collections.remove(*(current - wanted))
+    if wanted - current:
+        product.collections.add(*(wanted - current))
+    return current != wanted
+
+
+def sync_images(product, retained_ids):
+    """
+    Deletes the images not listed in `retained_ids`; all are kept when it is
+    None. New uploads go through stage_product_images.
+    """
+    if retained_ids is None:
+        return False
+    deleted, _ = product.images.exclude(id__in=retained_ids).delete()
+    return bool(deleted)
+
+
+def staging_storage():
+    return FileSystemStorage(location=settings.JOB_STAGING_ROOT)
+
+
+def stage_product_images(product, uploads):
+    """
+    Parks uploads on local disk and queues a job per file to store it, make
+    its renditions and create the ProductImage, so the request returns
+    without waiting on any of that. Returns the jobs.
+    """
+    jobs = []
+    seen = set(product.images.exclude(content_hash=None).values_list('content_hash', flat=True))
+    for upload in uploads:
+        digest = content_hash(upload)
+        if digest in seen:
+            # The product already shows these bytes.
+            continue
+        seen.add(digest)
+        staged = staging_storage().save(os.path.join(str(product.id), os.path.basename(upload.name)), upload)
+        jobs.append(enqueue('store_product_image', shop_id=product.shop_id, product_id=product.id,
+                            staged=staged, filename=os.path.basename(upload.name), content_hash=digest))
+    return jobs
+
+
+def match_uploaded_images(product, uploads):
+    """
+    Splits uploaded files into the ids of the product's images with the
+    same bytes, which are kept as they are, and the uploads that are new.
+    """
+    existing = dict(product.images.exclude(content_hash=None).values_list('content_hash', 'id'))
+    retained_ids, new_uploads = [], []
+    for upload in uploads:
+        image_id = existing.get(content_hash(upload))
+        if image_id is None:
+            new_uploads.append(upload)
+        elif image_id not in retained_ids:
+            retained_ids.append(image_id)
+    return retained_ids, new_uploads
+
+
+@task('store_product_image')
+def store_product_image(product_id, staged, filename, content_hash=None):
+    storage = staging_storage()
+    if not storage.exists(staged):
+        # Already stored by an earlier attempt.
+        return None
+    if not Product.objects.filter(id=product_id).exists():
+        storage.delete(staged)
+        return None
+    if content_hash:
+        existing = ProductImage.objects.filter(product_id=product_id, content_hash=content_hash).first()
+        if existing is not None:
+            storage.delete(staged)
+            return {'image_id': existing.id}
+    with storage.open(staged) as upload:
+        image = ProductImage.objects.create(product_id=product_id, image=File(upload, name=filename))
+    storage.delete(staged)
+    return {'image_id': image.id}
+
+
+def sync_options(product, options_data):
+    """
+    Reconciles a product's options and values with `options_data`, issuing
+    only the inserts, updates and deletes needed. Returns whether anything
+    changed, and the product's values afterwards.
+    """
+    match_option, stale_options = _matcher(list(product.options.prefetch_related('values')), 'options')
+    renamed_options, renamed_values, stale_values = [], [], []
+    new_options, new_values, kept_values = [], [], []
+
+    for option_data in options_data:
+        option = match_option(option_data)
+        if option is None:
+            new_options.append(option_data)
+            continue
+        if option_data.get('name') not in (None, option.name):
+            option.name = option_data['name']
+            renamed_options.append(option)
+
+        if 'values' not in option_data:
+            kept_values += option.values.all()
+            continue
+        match_value, unmatched_values = _matcher(list(option.values.all()), 'values')
+        for value_data in parse_json_list(option_data.get('values', [])):
+            value = match_value(value_data)
+            if value is None:
+                new_values.append(OptionValue(id=new_id(), option=option, name=value_data['name']))
+                continue
+            if value_data.get('name') not in (None, value.name):
+                value.name = value_data['name']
+                renamed_values.append(value)
+            kept_values.append(value)
+        stale_values += unmatched_values.values()
+
+    if stale_options:
+        ProductOption.objects.filter(id__in=list(stale_options)).delete()
+    if stale_values:
+        OptionValue.objects.filter(id__in=[value.id for value in stale_values]).delete()
+    if renamed_options:
+        ProductOption.objects.bulk_update(renamed_options, ['name'])
+    if renamed_values:
+        OptionValue.objects.bulk_update(renamed_values, ['name'])
+    OptionValue.objects.bulk_create(new_values)
+    created_values = create_options(product, new_options) if new_options else []
+
+    changed = any([stale_options, stale_values, renamed_options, renamed_values, new_values, new_options])
+    return changed, kept_values + new_values + created_values
+
+
+VARIANT_FIELDS = ('name', 'sku', 'price', 'inventory')
+
+
+def sync_variants(product, variants_data, values=None):
+    """
+    Reconciles a product's variants, and the option values each is linked
+    to, with `variants_data`. Editing one variant's price is one UPDATE.
+    Returns whether anything changed.
+    """
+    if values is None:
+        values = OptionValue.objects.filter(option__product=product)
+    by_name = values_by_name(values)
+
+    match_variant, stale_variants = _matcher(list(product.variants.prefetch_related('values')), 'variants')
+    updated, updated_fields, new_variants = [], set(), []
+    unlink, link = Q(), []
+
+    for variant_data in variants_data:
+        variant = match_variant(variant_data)
+        if variant is None:
+            new_variants.append(variant_data)
+            continue
+
+        changed_fields = set()
+        for field in VARIANT_FIELDS:
+            if field in variant_data:
+                value = ProductVariant._meta.get_field(field).to_python(variant_data[field])
+                if value != getattr(variant, field):
+                    setattr(variant, field, value)
+                    changed_fields.add(field)
+        if changed_fields:
+            updated.append(variant)
+            updated_fields |= changed_fields
+
+        if 'values' in variant_data:
+            current = {value.id for value in variant.values.all()}
+            wanted = set()
+            for value_data in parse_json_list(variant_data['values']):
+                value = by_name.get(value_data.get('name'))
+                if value is None:
+                    raise ValidationError({'variants': [f"Unknown option value {value_data.get('name')!r}."]})
+                wanted.add(value.id)
+            if current - wanted:
+                unlink |= Q(productvariant_id=variant.id, optionvalue_id__in=current - wanted)
+            link += [VariantValue(productvariant_id=variant.id, optionvalue_id=pk) for pk in wanted - current]
+
+    if stale_variants:
+        ProductVariant.objects.filter(id__in=list(stale_variants)).delete()
+    if updated:
+        ProductVariant.objects.bulk_update(updated, sorted(updated_fields))
+    if unlink:
+        VariantValue.objects.filter(unlink).delete()
+    VariantValue.objects.bulk_create(link)
+    if new_variants:
+        create_variants(product, new_variants, values)
+
+    return any([stale_variants, updated, unlink, link, new_variants])
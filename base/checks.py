@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Storefront invalidation (base/caching.py) deletes keys in the process that
+    made the write, so every web and run_workers process must share one cache.
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if backend in PROCESS_LOCAL_CACHES:
+        return [Error(
+            f'{backend} keeps a separate cache in each process, so storefront '
+            'invalidations would not reach other workers.',
+            hint='Set CACHE_BACKEND/CACHE_LOCATION to a shared cache such as '
+                 'django_redis.cache.RedisCache or memcached.',
+            id='base.E001',
+        )]
+    return []
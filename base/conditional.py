@@ -0,0 +1,205 @@
+import hashlib
+from functools import wraps
+
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
+
+from .caching import get_storefront_validators, set_storefront_validators
+from .db import database_sync_to_async
+from .models import Collection, Product, Shop
+
+
+def _lookup_filter(lookup):
+    # Mirrors the id-or-handle lookup of the detail views.
+    try:
+        return {'id': int(lookup)}
+    except ValueError:
+        return {'handle': lookup}
+
+
+def _digest(request, state):
+    # The browsable API and JSON renderers produce different bodies for the
+    # same data, so the negotiated media type is part of the tag.
+    accept = request.META.get('HTTP_ACCEPT', '')
+    return hashlib.md5(repr((state, accept)).encode()).hexdigest()
+
+
+def _summary(queryset):
+    # Any edit bumps a timestamp and any delete changes the count, so the
+    # pair changes whenever a serialized listing would.
+    return queryset.aggregate(updated_at=Max('updated_at'), count=Count('id'))
+
+
+def catalog_state(shop_id):
+    """
+    Summarises a shop's products and collections as (latest update, row
+    count) pairs.
+    """
+    return {
+        'products': _summary(Product.objects.filter(shop_id=shop_id)),
+        'collections': _summary(Collection.objects.filter(shop_id=shop_id)),
+    }
+
+
+def _cached_state(request, key, compute):
+    # condition() asks for the ETag and Last-Modified separately; compute once.
+    states = request.__dict__.setdefault('_conditional_states', {})
+    if key not in states:
+        states[key] = compute()
+    return states[key]
+
+
+def _latest(*timestamps):
+    timestamps = [t for t in timestamps if t is not None]
+    return max(timestamps) if timestamps else None
+
+
+##########Product##########
+def _product_list_state(request, shop_id):
+    return _cached_state(request, ('products', shop_id), lambda: _summary(Product.objects.filter(shop_id=shop_id)))
+
+
+def product_list_etag(request, shop_id, **kwargs):
+    return _digest(request, (request.get_full_path(), _product_list_state(request, shop_id)))
+
+
+def product_list_last_modified(request, shop_id, **kwargs):
+    return _product_list_state(request, shop_id)['updated_at']
+
+
+def _product_state(request, shop_id, lookup):
+    return _cached_state(request, ('product', lookup), lambda: (
+        Product.objects.filter(shop_id=shop_id, **_lookup_filter(lookup)).values('id', 'updated_at').first()))
+
+
+def product_etag(request, shop_id, lookup, **kwargs):
+    state = _product_state(request, shop_id, lookup)
+    if state is not None:
+        return _digest(request, state)
+
+
+def product_last_modified(request, shop_id, lookup, **kwargs):
+    state = _product_state(request, shop_id, lookup)
+    if state is not None:
+        return state['updated_at']
+
+
+##########Collection##########
+def collection_list_etag(request, shop_id, **kwargs):
+    # Collections embed their products, so product edits count too.
+    state = _cached_state(request, ('catalog', shop_id), lambda: catalog_state(shop_id))
+    return _digest(request, (request.get_full_path(), state))
+
+
+def collection_list_last_modified(request, shop_id, **kwargs):
+    state = _cached_state(request, ('catalog', shop_id), lambda: catalog_state(shop_id))
+    return _latest(state['products']['updated_at'], state['collections']['updated_at'])
+
+
+##########StoreFront##########
+def _storefront_state(request, domain_name):
+    def compute():
+        validators = get_storefront_validators(domain_name)
+        if validators is None:
+            shop = Shop.objects.filter(myjamly_domain=domain_name).values('id', 'updated_at').first()
+            if shop is None:
+                return None
+            validators = dict(catalog_state(shop['id']), shop=shop)
+            set_storefront_validators(domain_name, validators)
+        return validators
+    return _cached_state(request, ('storefront', domain_name), compute)
+
+
+def storefront_etag(request, domain_name):
+    state = _storefront_state(request, domain_name)
+    if state is not None:
+        return _digest(request, state)
+
+
+def storefront_last_modified(request, domain_name):
+    state = _storefront_state(request, domain_name)
+    if state is not None:
+        return _latest(state['shop']['updated_at'], state['products']['updated_at'],
+                       state['collections']['updated_at'])
+
+
+def _storefront_product_state(request, domain_name, handle):
+    return _cached_state(request, ('storefront-product', domain_name, handle), lambda: (
+        Product.objects.filter(shop__myjamly_domain=domain_name, handle=handle).values('id', 'updated_at').first()))
+
+
+def storefront_product_etag(request, domain_name, handle):
+    state = _storefront_product_state(request, domain_name, handle)
+    if state is not None:
+        return _digest(request, state)
+
+
+def storefront_product_last_modified(request, domain_name, handle):
+    state = _storefront_product_state(request, domain_name, handle)
+    if state is not None:
+        return state['updated_at']
+
+
+def _storefront_collection_state(request, domain_name, handle):
+    def compute():
+        collection = (Collection.objects.filter(shop__myjamly_domain=domain_name, handle=handle)
+                      .values('id', 'updated_at').first())
+        if collection is None:
+            return None
+        return dict(collection, products=_summary(Product.objects.filter(collections=collection['id'])))
+    return _cached_state(request, ('storefront-collection', domain_name, handle), compute)
+
+
+def storefront_collection_etag(request, domain_name, handle):
+    state = _storefront_collection_state(request, domain_name, handle)
+    if state is not None:
+        return _digest(request, state)
+
+
+def storefront_collection_last_modified(request, domain_name, handle):
+    state = _storefront_collection_state(request, domain_name, handle)
+    if state is not None:
+        return _latest(state['updated_at'], state['products']['updated_at'])
+
+
+def async_condition(etag_func=None, last_modified_func=None):
+    """
+    condition() for async views. The validator functions are ordinary sync
+    functions and run off the event loop.
+    """
+    def validators(request, args, kwargs):
+        etag = etag_func(request, *args, **kwargs) if etag_func else None
+        last_modified = last_modified_func(request, *args, **kwargs) if last_modified_func else None
+        if last_modified and not timezone.is_aware(last_modified):
+            last_modified = timezone.make_aware(last_modified, timezone.utc)
+        return (quote_etag(etag) if etag is not None else None,
+                int(last_modified.timestamp()) if last_modified else None)
+
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            etag, last_modified = await database_sync_to_async(validators)(request, args, kwargs)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                if last_modified and not response.has_header('Last-Modified'):
+                    response['Last-Modified'] = http_date(last_modified)
+                if etag:
+                    response.headers.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
+
+
+product_list_condition = condition(etag_func=product_list_etag, last_modified_func=product_list_last_modified)
+product_condition = condition(etag_func=product_etag, last_modified_func=product_last_modified)
+collection_list_condition = condition(etag_func=collection_list_etag, last_modified_func=collection_list_last_modified)
+storefront_condition = async_condition(etag_func=storefront_etag, last_modified_func=storefront_last_modified)
+storefront_product_condition = async_condition(etag_func=storefront_product_etag,
+                                               last_modified_func=storefront_product_last_modified)
+storefront_collection_condition = async_condition(etag_func=storefront_collection_etag,
+                                                  last_modified_func=storefront_collection_last_modified)
@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import close_old_connections, connections
+
+
+def check_connections(**kwargs):
+    """
+    Closes persistent connections that no longer answer, so a request never
+    starts on a socket the server or a pooler has already dropped. Mirrors
+    the CONN_HEALTH_CHECKS database setting that Django 4.1 added.
+    """
+    for conn in connections.all():
+        if conn.connection is None or conn.in_atomic_block or not conn.settings_dict.get('CONN_HEALTH_CHECKS'):
+            continue
+        if not conn.is_usable():
+            conn.close()
+
+
+if django.VERSION < (4, 1):
+    request_started.connect(check_connections, dispatch_uid='base.db.check_connections')
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def query_executor():
+    """
+    The pool async views run their queries on. Each thread keeps its own
+    persistent connection, so the pool is capped at ASYNC_CONCURRENT_QUERIES
+    threads and the connections a process holds with it.
+    """
+    global _executor
+    size = int(settings.ASYNC_CONCURRENT_QUERIES)
+    with _executor_lock:
+        if _executor is None or _executor._max_workers != size:
+            _executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='db-query')
+        return _executor
+
+
+def database_sync_to_async(func):
+    """
+    Wraps ORM work for async views. With ASYNC_CONCURRENT_QUERIES above 0,
+    calls run on the query_executor() pool, so awaiting several at once runs
+    their queries concurrently, and a thread's connection is aged out like a
+    request's. At 0, calls share Django's single sync thread, which is what
+    tests inside a transaction need.
+    """
+    if not getattr(settings, 'ASYNC_CONCURRENT_QUERIES', 0):
+        return sync_to_async(func)
+
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(run, thread_sensitive=False, executor=query_executor())
@@ -0,0 +1,176 @@
+import csv
+import json
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch, prefetch_related_objects
+
+from .importers import CSV_OPTION_COLUMNS
+from .models import Collection, Order, OrderItem, Product, ProductOption, ProductVariant
+
+
+EXPORT_CHUNK_SIZE = 500
+
+PRODUCT_COLUMNS = ['handle', 'name', 'description', 'price', 'status', 'collections'] + [
+    f'option{i}_{part}' for i in range(1, CSV_OPTION_COLUMNS + 1) for part in ('name', 'value')
+] + ['variant_name', 'sku', 'variant_price', 'inventory']
+
+ORDER_COLUMNS = ['order_id', 'created_at', 'status', 'fulfilled', 'customer_id', 'customer_email', 'total_price',
+                 'product_id', 'product_name', 'variant_id', 'variant_name', 'quantity', 'price']
+
+
+def chunked(queryset, prefetches, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Streams a queryset with a server-side cursor and prefetches relations one
+    chunk at a time, so memory stays bounded by the chunk size.
+    """
+    rows = queryset.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        prefetch_related_objects(chunk, *prefetches)
+        yield from chunk
+
+
+#####PRODUCTS#####
+PRODUCT_PREFETCHES = [
+    Prefetch('options', queryset=ProductOption.objects.order_by('created_at', 'id').prefetch_related('values')),
+    Prefetch('variants', queryset=ProductVariant.objects.prefetch_related('values')),
+    Prefetch('collections', queryset=Collection.objects.only('id', 'handle').order_by('handle')),
+]
+
+
+def export_products(shop_id):
+    return chunked(Product.objects.filter(shop_id=shop_id).order_by('id'), PRODUCT_PREFETCHES)
+
+
+def variant_values(product, variant):
+    # Listed in option order, matching how the CSV layout pairs them.
+    position = {option.id: i for i, option in enumerate(product.options.all())}
+    return sorted(variant.values.all(), key=lambda value: position.get(value.option_id, len(position)))
+
+
+def product_record(product):
+    # Shaped like the catalog import JSONL, so exports can be re-imported.
+    return {
+        'handle': product.handle,
+        'name': product.name,
+        'description': product.description,
+        'price': product.price,
+        'status': product.status,
+        'collections': [collection.handle for collection in product.collections.all()],
+        'options': [
+            {'name': option.name, 'values': [{'name': value.name} for value in option.values.all()]}
+            for option in product.options.all()
+        ],
+        'variants': [
+            {
+                'name': variant.name, 'sku': variant.sku, 'price': variant.price, 'inventory': variant.inventory,
+                'values': [{'name': value.name} for value in variant_values(product, variant)],
+            }
+            for variant in product.variants.all()
+        ],
+    }
+
+
+def product_rows(product):
+    # One row per variant, in the catalog import CSV layout.
+    options = list(product.options.all())[:CSV_OPTION_COLUMNS]
+    base = {
+        'handle': product.handle,
+        'name': product.name,
+        'description': product.description,
+        'price': product.price,
+        'status': product.status,
+        'collections': ';'.join(collection.handle or '' for collection in product.collections.all()),
+    }
+    for i, option in enumerate(options, start=1):
+        base[f'option{i}_name'] = option.name
+
+    variants = list(product.variants.all())
+    if not variants:
+        yield base
+    for variant in variants:
+        row = dict(base, variant_name=variant.name, sku=variant.sku, variant_price=variant.price,
+                   inventory=variant.inventory)
+        variant_values = {value.option_id: value.name for value in variant.values.all()}
+        for i, option in enumerate(options, start=1):
+            row[f'option{i}_value'] = variant_values.get(option.id)
+        yield row
+
+
+#####ORDERS#####
+ORDER_PREFETCHES = [
+    Prefetch('items', queryset=OrderItem.objects.select_related('product', 'variant')),
+]
+
+
+def export_orders(shop_id):
+    return chunked(Order.objects.filter(shop_id=shop_id).select_related('customer').order_by('id'), ORDER_PREFETCHES)
+
+
+def order_record(order):
+    return {
+        'id': order.id,
+        'created_at': order.created_at,
+        'status': order.status,
+        'fulfilled': order.fulfilled,
+        'customer_id': order.customer_id,
+        'customer_email': order.customer.email,
+        'total_price': order.total_price,
+        'items': [
+            {
+                'product_id': item.product_id, 'product_name': item.product.name,
+                'variant_id': item.variant_id, 'variant_name': item.variant.name if item.variant else None,
+                'quantity': item.quantity, 'price': item.price,
+            }
+            for item in order.items.all()
+        ],
+    }
+
+
+def order_rows(order):
+    record = order_record(order)
+    items = record.pop('items')
+    record['order_id'] = record.pop('id')
+    if not items:
+        yield record
+    for item in items:
+        yield dict(record, **item)
+
+
+#####FORMATS#####
+class Echo:
+    """
+    File-like object that hands back what is written, for csv.writer.
+    """
+
+    def write(self, value):
+        return value
+
+
+def as_csv(records, columns, to_rows):
+    writer = csv.DictWriter(Echo(), fieldnames=columns, extrasaction='ignore')
+    yield writer.writeheader()
+    for record in records:
+        for row in to_rows(record):
+            yield writer.writerow(row)
+
+
+def as_jsonl(records, to_record):
+    for record in records:
+        yield json.dumps(to_record(record), cls=DjangoJSONEncoder) + '\n'
+
+
+EXPORTS = {
+    'products': (export_products, PRODUCT_COLUMNS, product_rows, product_record),
+    'orders': (export_orders, ORDER_COLUMNS, order_rows, order_record),
+}
+
+
+def stream_export(kind, shop_id, file_format):
+    records, columns, to_rows, to_record = EXPORTS[kind]
+    if file_format == 'csv':
+        return as_csv(records(shop_id), columns, to_rows)
+    return as_jsonl(records(shop_id), to_record)
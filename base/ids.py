@@ -0,0 +1,146 @@
+import fcntl
+import os
+import threading
+import time
+from random import randint
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+
+# 2024-01-01T00:00:00Z in milliseconds.
+EPOCH_MS = 1704067200000
+
+# Ids stay within 53 bits so they survive JSON parsing in JavaScript clients:
+# 41 bits of milliseconds (~69 years), 5 bits of worker, 7 bits of sequence.
+WORKER_BITS = 5
+SEQUENCE_BITS = 7
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+def parse_worker_ids(value):
+    """
+    Parses an ID_WORKER_IDS range such as '0-31' or '16-23'.
+    """
+    first, _, last = str(value).partition('-')
+    first, last = int(first), int(last or first)
+    if not 0 <= first <= last <= MAX_WORKER:
+        raise ImproperlyConfigured(f'ID_WORKER_IDS must be a range within 0-{MAX_WORKER}, not {value!r}.')
+    return range(first, last + 1)
+
+
+def lock_worker_id(worker_id, lock_dir):
+    """
+    Takes an exclusive lock on `worker_id` for this process; returns the
+    open file holding it, or None if another process has it. The kernel
+    drops the lock when the process exits, however it exits.
+    """
+    os.makedirs(lock_dir, exist_ok=True)
+    fd = os.open(os.path.join(lock_dir, f'worker-{worker_id}.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class SnowflakeGenerator:
+    """
+    Time-ordered ids: milliseconds since EPOCH_MS, then a worker number, then
+    a per-process sequence. Ids from one process never repeat and always
+    increase, so inserts land at the right edge of the primary key index.
+
+    Two processes minting under one worker number can mint the same id, so
+    each process locks its number on first use, after any fork: the one in
+    ID_WORKER_ID, or else the first free one in ID_WORKER_IDS. Locks are per
+    host; hosts sharing a database need disjoint ranges. A worker_id given
+    to the constructor is used as is.
+    """
+
+    def __init__(self, worker_id=None, worker_ids=None, lock_dir=None):
+        if worker_id is not None and not 0 <= worker_id <= MAX_WORKER:
+            raise ImproperlyConfigured(f'Worker ids run from 0 to {MAX_WORKER}, not {worker_id}.')
+        self.worker_id = worker_id
+        self.worker_ids = worker_ids
+        self.lock_dir = lock_dir
+        self.lock = threading.Lock()
+        self.lock_fd = None
+        self.pid = None
+        self.last_ms = -1
+        self.sequence = 0
+
+    def _worker(self):
+        if self.worker_id is not None:
+            return self.worker_id
+        if self.lock_fd is not None:
+            # Inherited from the parent, whose number it holds.
+            os.close(self.lock_fd)
+            self.lock_fd = None
+        lock_dir = self.lock_dir or settings.ID_WORKER_LOCK_DIR
+        fixed = settings.ID_WORKER_ID if self.worker_ids is None else None
+        if fixed is not None:
+            if not 0 <= fixed <= MAX_WORKER:
+                raise ImproperlyConfigured(f'ID_WORKER_ID must be between 0 and {MAX_WORKER}, not {fixed}.')
+            candidates = [fixed]
+        else:
+            candidates = self.worker_ids or parse_worker_ids(settings.ID_WORKER_IDS)
+        for worker_id in candidates:
+            self.lock_fd = lock_worker_id(worker_id, lock_dir)
+            if self.lock_fd is not None:
+                return worker_id
+        if fixed is not None:
+            raise ImproperlyConfigured(f'ID_WORKER_ID {fixed} is in use by another process on this host.')
+        raise ImproperlyConfigured(f'All worker ids in {candidates} are in use on this host; widen ID_WORKER_IDS.')
+
+    def __call__(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                # Forked workers must not share the parent's worker and sequence.
+                self.pid = os.getpid()
+                self.worker = self._worker()
+                self.last_ms, self.sequence = -1, 0
+
+            now = int(time.time() * 1000) - EPOCH_MS
+            if now < self.last_ms:
+                # The clock stepped back; keep counting from the last timestamp.
+                now = self.last_ms
+            if now == self.last_ms:
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if self.sequence == 0:
+                    while now <= self.last_ms:
+                        now = int(time.time() * 1000) - EPOCH_MS
+            else:
+                self.sequence = 0
+            self.last_ms = now
+            return (now << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker << SEQUENCE_BITS) | self.sequence
+
+
+def random_id(n=10):
+    """
+    The original scheme: a random n-digit number. Kept for benchmarking.
+    """
+    return randint(10**(n - 1), (10**n) - 1)
+
+
+snowflake = SnowflakeGenerator()
+_generator = None
+
+
+def new_id():
+    """
+    Returns a new primary key from the callable named by ID_GENERATOR.
+    """
+    global _generator
+    if _generator is None:
+        _generator = import_string(getattr(settings, 'ID_GENERATOR', 'base.ids.snowflake'))
+    return _generator()
+
+
+def id_timestamp(pk):
+    """
+    Returns the creation time, in epoch milliseconds, encoded in a Snowflake id.
+    """
+    return (pk >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS
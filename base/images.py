@@ -0,0 +1,159 @@
+import hashlib
+import io
+import os
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+
+# Longest edge in pixels. Smaller originals are never upscaled.
+RENDITION_SIZES = {
+    'thumb': 200,
+    'medium': 600,
+    'large': 1200,
+}
+
+RENDITION_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# EXIF tag telling viewers how to turn the pixels upright.
+ORIENTATION = 0x0112
+
+
+def content_hash(file):
+    """
+    SHA-256 of a file's bytes, read in chunks. Leaves the file at the start.
+    """
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks() if hasattr(file, 'chunks') else iter(lambda: file.read(1 << 16), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def render(image, size, image_format):
+    """
+    Returns the bytes of `image` scaled to fit `size` and encoded as
+    `image_format`. Nothing but pixels is carried over, so EXIF, GPS and
+    other metadata are dropped.
+    """
+    pil_format, options = RENDITION_FORMATS[image_format]
+    rendition = image.copy()
+    rendition.thumbnail((size, size), Image.Resampling.LANCZOS)
+    if pil_format == 'JPEG' and rendition.mode != 'RGB':
+        background = Image.new('RGB', rendition.size, (255, 255, 255))
+        background.paste(rendition, mask=rendition.getchannel('A') if 'A' in rendition.getbands() else None)
+        rendition = background
+    output = io.BytesIO()
+    rendition.save(output, pil_format, **options)
+    return output.getvalue()
+
+
+def strip_metadata(file):
+    """
+    Returns the image in `file` re-encoded in its own format without EXIF,
+    GPS, XMP or comments, turned upright first since the orientation tag
+    goes too. Returns None when Pillow cannot read it.
+    """
+    file.seek(0)
+    try:
+        image = Image.open(file)
+        pil_format = image.format
+        options = {'icc_profile': image.info['icc_profile']} if image.info.get('icc_profile') else {}
+        if getattr(image, 'is_animated', False):
+            options['save_all'] = True
+        elif image.getexif().get(ORIENTATION, 1) != 1:
+            image = ImageOps.exif_transpose(image)
+            if pil_format == 'JPEG':
+                options['quality'] = 95
+        elif pil_format == 'JPEG':
+            # Untouched pixels keep the upload's own quantization.
+            options['quality'] = 'keep'
+        output = io.BytesIO()
+        image.save(output, pil_format, **options)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return None
+    finally:
+        file.seek(0)
+    return ContentFile(output.getvalue())
+
+
+def generate_renditions(field_file):
+    """
+    Writes every size and format of a stored image next to it under
+    renditions/. Returns the stored names keyed by size and format, plus the
+    source name they were made from.
+    """
+    storage = field_file.storage
+    directory, filename = os.path.split(field_file.name)
+    stem = os.path.splitext(filename)[0]
+    renditions = {'source': field_file.name}
+
+    with field_file.open('rb') as source:
+        image = Image.open(source)
+        # Honour the camera's orientation before the EXIF that carries it is dropped.
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+    for size_name, size in RENDITION_SIZES.items():
+        renditions[size_name] = {}
+        for image_format in RENDITION_FORMATS:
+            name = os.path.join('renditions', directory, f'{stem}-{size_name}.{image_format}')
+            renditions[size_name][image_format] = storage.save(name, ContentFile(render(image, size, image_format)))
+    return renditions
+
+
+def delete_renditions(storage, renditions):
+    for size_name in RENDITION_SIZES:
+        for name in (renditions or {}).get(size_name, {}).values():
+            storage.delete(name)
+
+
+def renditions_shared(instance, renditions_field, renditions):
+    """
+    Whether other rows point at the same stored renditions, as product
+    images with the same content do.
+    """
+    if not renditions or not renditions.get('source'):
+        return False
+    others = type(instance).objects.filter(**{f'{renditions_field}__source': renditions['source']})
+    return others.exclude(pk=instance.pk).exists()
+
+
+def refresh_renditions(instance, field_name, renditions_field, save_kwargs):
+    """
+    Called from a model's save() before it writes: regenerates the
+    renditions of `field_name` when its file is new or has changed, and
+    adds the renditions column to update_fields when those are given.
+    """
+    update_fields = save_kwargs.get('update_fields')
+    if update_fields is not None and field_name not in update_fields:
+        return
+
+    field_file = getattr(instance, field_name)
+    current = getattr(instance, renditions_field) or {}
+    if not field_file:
+        renditions = {}
+    elif field_file._committed and current.get('source') == field_file.name:
+        return
+    else:
+        if not field_file._committed:
+            # Store the upload now, as FileField.pre_save would, so renditions
+            # can be made from it; the original is served too, so it loses its
+            # metadata first.
+            field_file.save(field_file.name, strip_metadata(field_file.file) or field_file.file, save=False)
+        try:
+            renditions = generate_renditions(field_file)
+        except (OSError, SyntaxError, Image.DecompressionBombError):
+            # Not an image Pillow can read; keep serving the original.
+            renditions = {'source': field_file.name}
+
+    if renditions != current:
+        if not renditions_shared(instance, renditions_field, current):
+            delete_renditions(field_file.storage, current)
+        setattr(instance, renditions_field, renditions)
+        if update_fields is not None:
+            save_kwargs['update_fields'] = list(update_fields) + [renditions_field]
@@ -0,0 +1,478 @@
+import csv
+import io
+import json
+import time
+
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+from rest_framework.exceptions import ValidationError
+
+from .caching import invalidate_storefront_for_shop
+from .catalog import VariantValue, build_options, build_variants
+from .ids import new_id
+from .jobs import enqueue, task
+from .models import CatalogImport, Collection, Customer, CustomerAddress, CustomerImport, OptionValue, Product, ProductOption, ProductVariant, User
+
+
+CSV_OPTION_COLUMNS = 3
+MAX_REPORTED_ERRORS = 1000
+ADDRESS_COLUMNS = ('street_address', 'city', 'state', 'country', 'zip_code')
+TRUE_VALUES = ('1', 't', 'true', 'y', 'yes')
+FALSE_VALUES = ('0', 'f', 'false', 'n', 'no')
+
+ProductCollection = Product.collections.through
+ShopMembership = User.shops.through
+
+
+#####READERS#####
+# Readers turn a file into (line, rows, product data, error) records, one
+# product at a time, without reading the whole file.
+def _blank_to_none(row):
+    return {key: (value.strip() or None) if isinstance(value, str) else value for key, value in row.items()}
+
+
+def _csv_product(rows):
+    first = rows[0]
+    options = []
+    for i in range(1, CSV_OPTION_COLUMNS + 1):
+        name = first.get(f'option{i}_name')
+        if name:
+            values = []
+            for row in rows:
+                value = row.get(f'option{i}_value')
+                if value and value not in values:
+                    values.append(value)
+            options.append({'name': name, 'values': [{'name': value} for value in values]})
+
+    variants = []
+    for row in rows:
+        values = [row.get(f'option{i + 1}_value') for i in range(len(options))]
+        values = [value for value in values if value]
+        if not (values or row.get('sku') or row.get('variant_price')):
+            continue
+        variants.append({
+            'name': row.get('variant_name') or ' / '.join(values) or first['name'],
+            'sku': row.get('sku'),
+            'price': row.get('variant_price') or first.get('price') or 0,
+            'inventory': row.get('inventory') or 0,
+            'values': [{'name': value} for value in values],
+        })
+
+    return {
+        'handle': first.get('handle'),
+        'name': first.get('name'),
+        'description': first.get('description'),
+        'price': first.get('price'),
+        'status': first.get('status'),
+        'collections': [c.strip() for c in (first.get('collections') or '').split(';') if c.strip()],
+        'options': options,
+        'variants': variants,
+    }
+
+
+def _csv_handle(row):
+    # The handle the product will get, as build_product derives it.
+    return row.get('handle') or slugify(row.get('name') or '')
+
+
+def read_csv(stream):
+    """
+    One row per variant; consecutive rows sharing a handle (or, without one,
+    a name) make one product. Product columns are read from the first row of
+    each group.
+    """
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    rows, line = [], None
+    for row in reader:
+        row = _blank_to_none(row)
+        if rows and _csv_handle(row) != _csv_handle(rows[0]):
+            yield line, len(rows), _csv_product(rows), None
+            rows = []
+        if not rows:
+            line = reader.line_num
+        rows.append(row)
+    if rows:
+        yield line, len(rows), _csv_product(rows), None
+
+
+def read_jsonl(stream):
+    """
+    One product per line, shaped like the product create payload.
+    """
+    for line, raw in enumerate(io.TextIOWrapper(stream, encoding='utf-8-sig'), start=1):
+        if not raw.strip():
+            continue
+        try:
+            data = json.loads(raw)
+            if not isinstance(data, dict):
+                raise ValueError('expected a JSON object')
+        except ValueError as e:
+            yield line, 1, None, f'Invalid JSON: {e}'
+        else:
+            yield line, 1, data, None
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+def read_customer_csv(stream):
+    """
+    One row per customer: email, first_name, last_name, accepts_marketing,
+    password_hash and the address columns.
+    """
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    for row in reader:
+        yield reader.line_num, 1, _blank_to_none(row), None
+
+
+def _parse_bool(value):
+    if value is None or value.lower() in FALSE_VALUES:
+        return False
+    if value.lower() in TRUE_VALUES:
+        return True
+    raise ValueError(f'{value!r} is not yes or no.')
+
+
+def _error_message(error):
+    if isinstance(error, DjangoValidationError):
+        if hasattr(error, 'error_dict'):
+            return '; '.join(f'{field}: {" ".join(messages)}' for field, messages in error.message_dict.items())
+        return ' '.join(error.messages)
+    if isinstance(error, ValidationError):
+        return json.dumps(error.detail)
+    return str(error)
+
+
+#####WRITER#####
+class BatchImporter:
+    """
+    Feeds the records of a reader to `write_batch` `batch_size` at a time
+    and keeps the stats. Subclasses validate each batch in memory and then
+    insert it with one bulk statement per table, inside its own
+    transaction; bad records are reported by line and skipped.
+    """
+    counters = ()
+
+    def __init__(self, shop, batch_size=500, progress=None):
+        self.shop = shop
+        self.batch_size = batch_size
+        self.progress = progress
+        self.stats = {'rows': 0, **{counter: 0 for counter in self.counters}, 'error_count': 0, 'errors': []}
+
+    def error(self, line, message):
+        self.stats['error_count'] += 1
+        if len(self.stats['errors']) < MAX_REPORTED_ERRORS:
+            self.stats['errors'].append({'line': line, 'error': message})
+
+    def run(self, records):
+        started = time.monotonic()
+        batch = []
+        for line, rows, data, error in records:
+            self.stats['rows'] += rows
+            if error:
+                self.error(line, error)
+                continue
+            batch.append((line, data))
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch)
+                batch = []
+        if batch:
+            self.write_batch(batch)
+
+        elapsed = time.monotonic() - started
+        self.stats['seconds'] = round(elapsed, 3)
+        self.stats['rows_per_second'] = round(self.stats['rows'] / elapsed, 1) if elapsed else None
+        self.finish()
+        return self.stats
+
+    def write_batch(self, batch):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+
+class CatalogImporter(BatchImporter):
+    """
+    Writes products, with their options, variants and collections.
+    """
+    counters = ('products_created', 'variants_created')
+
+    def __init__(self, shop, batch_size=500, progress=None):
+        super().__init__(shop, batch_size, progress)
+        self.handles = set(Product.objects.filter(shop=shop).values_list('handle', flat=True))
+        self.collections = dict(Collection.objects.filter(shop=shop).values_list('handle', 'id'))
+
+    def finish(self):
+        if self.stats['products_created']:
+            invalidate_storefront_for_shop(self.shop.id)
+
+    def build_product(self, data):
+        handle = data.get('handle') or slugify(data.get('name') or '')
+        if not handle:
+            raise ValueError('A handle or name is required.')
+        if handle in self.handles:
+            raise ValueError(f'A product with handle {handle!r} already exists.')
+
+        product = Product(
+            id=new_id(), shop=self.shop, name=data.get('name'), handle=handle,
+            description=data.get('description'), price=data.get('price'),
+            status=data.get('status') or 'PUBLISHED',
+        )
+        product.clean_fields(exclude=['id', 'shop', 'thumbnail'])
+
+        options, values = build_options(product, data.get('options') or [])
+        for row in options + values:
+            row.clean_fields(exclude=['id', 'product', 'option'])
+        variants, links = build_variants(product, data.get('variants') or [], values)
+        for variant in variants:
+            variant.clean_fields(exclude=['id', 'product'])
+
+        collections = [handle.strip() for handle in data.get('collections') or []]
+        return product, options, values, variants, links, collections
+
+    def write_batch(self, batch):
+        products, options, values, variants, links = [], [], [], [], []
+        new_collections, memberships, lines = {}, [], []
+        for line, data in batch:
+            try:
+                product, *rows, collection_handles = self.build_product(data)
+            except (DjangoValidationError, ValidationError, KeyError, TypeError, ValueError) as e:
+                self.error(line, _error_message(e))
+                continue
+            self.handles.add(product.handle)
+            products.append(product)
+            lines.append(line)
+            for target, built in zip((options, values, variants, links), rows):
+                target += built
+            for handle in collection_handles:
+                if handle not in self.collections and handle not in new_collections:
+                    new_collections[handle] = Collection(id=new_id(), shop=self.shop, name=handle, handle=handle)
+                collection_id = self.collections.get(handle) or new_collections[handle].id
+                memberships.append(ProductCollection(product_id=product.id, collection_id=collection_id))
+
+        try:
+            with transaction.atomic():
+                Collection.objects.bulk_create(new_collections.values())
+                Product.objects.bulk_create(products)
+                ProductOption.objects.bulk_create(options)
+                OptionValue.objects.bulk_create(values)
+                ProductVariant.objects.bulk_create(variants)
+                VariantValue.objects.bulk_create(links)
+                ProductCollection.objects.bulk_create(memberships)
+        except DatabaseError as e:
+            for line in lines:
+                self.error(line, f'Batch failed: {e}')
+            self.handles -= {product.handle for product in products}
+        else:
+            self.collections.update({handle: c.id for handle, c in new_collections.items()})
+            self.stats['products_created'] += len(products)
+            self.stats['variants_created'] += len(variants)
+
+        if self.progress:
+            self.progress(self.stats)
+
+
+def import_catalog(shop, stream, format, batch_size=500, progress=None):
+    return CatalogImporter(shop, batch_size, progress).run(READERS[format](stream))
+
+
+def insert_child_rows(model, objs):
+    """
+    Inserts the rows of a multi-table inherited model's own table, which
+    bulk_create refuses to do, as few multi-row INSERTs. The parent rows
+    must already be written.
+    """
+    fields = model._meta.local_concrete_fields
+    quote = connection.ops.quote_name
+    placeholders = '(%s)' % ', '.join(['%s'] * len(fields))
+    size = connection.ops.bulk_batch_size(fields, objs) or len(objs)
+    with connection.cursor() as cursor:
+        for start in range(0, len(objs), size):
+            chunk = objs[start:start + size]
+            cursor.execute(
+                'INSERT INTO %s (%s) VALUES %s' % (
+                    quote(model._meta.db_table),
+                    ', '.join(quote(field.column) for field in fields),
+                    ', '.join([placeholders] * len(chunk)),
+                ),
+                [field.get_db_prep_save(getattr(obj, field.attname), connection) for obj in chunk for field in fields],
+            )
+
+
+class CustomerImporter(BatchImporter):
+    """
+    Writes customers, their address and their membership of the shop.
+    `password_hash` must be in a format one of PASSWORD_HASHERS can check
+    (add e.g. BCryptSHA256PasswordHasher for a platform using bcrypt) and
+    is upgraded on first login; customers without one get an unusable
+    password and are marked password_reset_required, and choose one through
+    the password reset. A row whose email already has an account is
+    reported, not linked: only its holder can agree to join the shop.
+    """
+    counters = ('customers_created', 'addresses_created')
+
+    def __init__(self, shop, batch_size=500, progress=None):
+        super().__init__(shop, batch_size, progress)
+        self.emails = set()
+
+    def build_customer(self, data):
+        email = User.objects.normalize_email(data.get('email') or '')
+        if not email:
+            raise ValueError('An email is required.')
+        if email in self.emails:
+            raise ValueError(f'{email} appears earlier in the file.')
+
+        password = data.get('password_hash')
+        if password:
+            try:
+                identify_hasher(password)
+            except ValueError:
+                raise ValueError('password_hash is not a hash this site can check; leave it blank to require a reset.')
+        user = User(
+            id=new_id(), email=email, first_name=data.get('first_name') or '', last_name=data.get('last_name') or '',
+            accepts_marketing=_parse_bool(data.get('accepts_marketing')),
+            # An unusable password costs no hashing and can never match.
+            password=password or make_password(None), password_reset_required=not password,
+        )
+        user.clean_fields(exclude=['id', 'password', 'default_address'])
+        customer = Customer(id=user.id, user_ptr_id=user.id, customer_id=new_id())
+
+        address = None
+        if any(data.get(column) for column in ADDRESS_COLUMNS):
+            address = CustomerAddress(id=new_id(), customer_id=customer.customer_id,
+                                      **{column: data.get(column) or '' for column in ADDRESS_COLUMNS})
+            address.clean_fields(exclude=['id', 'customer'])
+            user.default_address_id = address.id
+        return user, customer, address
+
+    def write_batch(self, batch):
+        built, lines = [], []
+        for line, data in batch:
+            try:
+                user, customer, address = self.build_customer(data)
+            except (DjangoValidationError, KeyError, TypeError, ValueError) as e:
+                self.error(line, _error_message(e))
+                continue
+            self.emails.add(user.email)
+            built.append((line, user, customer, address))
+
+        existing = set(User.objects.filter(email__in=[user.email for _, user, _, _ in built]).values_list('email', flat=True))
+        users, customers, addresses, memberships = [], [], [], []
+        for line, user, customer, address in built:
+            if user.email in existing:
+                self.error(line, f'{user.email} already has an account.')
+                continue
+            users.append(user)
+            customers.append(customer)
+            memberships.append(ShopMembership(user_id=user.id, shop_id=self.shop.id))
+            if address is not None:
+                addresses.append(address)
+            lines.append(line)
+
+        # Users point at their default address and addresses at their
+        # customer. Where foreign keys are checked per statement rather than
+        # at commit, users go in without it and get it once addresses exist.
+        defaults = {}
+        if not connection.features.can_defer_constraint_checks:
+            for user in users:
+                if user.default_address_id:
+                    defaults[user] = user.default_address_id
+                    user.default_address_id = None
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+                insert_child_rows(Customer, customers)
+                CustomerAddress.objects.bulk_create(addresses)
+                if defaults:
+                    for user, address_id in defaults.items():
+                        user.default_address_id = address_id
+                    User.objects.bulk_update(defaults, ['default_address'])
+                ShopMembership.objects.bulk_create(memberships)
+        except DatabaseError as e:
+            for line in lines:
+                self.error(line, f'Batch failed: {e}')
+            self.emails -= {user.email for _, user, _, _ in built}
+        else:
+            self.stats['customers_created'] += len(users)
+            self.stats['addresses_created'] += len(addresses)
+
+        if self.progress:
+            self.progress(self.stats)
+
+
+def import_customers(shop, stream, batch_size=500, progress=None):
+    return CustomerImporter(shop, batch_size, progress).run(read_customer_csv(stream))
+
+
+#####BACKGROUND IMPORTS#####
+@task('catalog_import')
+def run_catalog_import(import_id):
+    """
+    Processes a stored CatalogImport and records its outcome on the row.
+    """
+    catalog_import = CatalogImport.objects.select_related('shop').get(id=import_id)
+    catalog_import.status = 'RUNNING'
+    catalog_import.save(update_fields=['status'])
+    try:
+        with catalog_import.file.open('rb') as stream:
+            stats = import_catalog(catalog_import.shop, stream, catalog_import.format)
+    except Exception as e:
+        catalog_import.status = 'FAILED'
+        catalog_import.errors = [{'line': None, 'error': str(e)}]
+        catalog_import.error_count = 1
+    else:
+        catalog_import.status = 'DONE'
+        for field in ('rows', 'products_created', 'variants_created', 'error_count', 'errors', 'rows_per_second'):
+            setattr(catalog_import, field, stats[field])
+    catalog_import.finished_at = timezone.now()
+    catalog_import.save()
+    return {'status': catalog_import.status}
+
+
+def start_catalog_import(catalog_import):
+    """
+    Queues the import for the background workers.
+    """
+    # The import records its own failures; retrying would import twice.
+    return enqueue('catalog_import', shop_id=catalog_import.shop_id, max_attempts=1, import_id=catalog_import.id)
+
+
+@task('customer_import')
+def run_customer_import(import_id):
+    """
+    Processes a stored CustomerImport, records its outcome on the row and
+    deletes the uploaded file.
+    """
+    customer_import = CustomerImport.objects.select_related('shop').get(id=import_id)
+    customer_import.status = 'RUNNING'
+    customer_import.save(update_fields=['status'])
+    try:
+        with customer_import.file.open('rb') as stream:
+            stats = import_customers(customer_import.shop, stream)
+    except Exception as e:
+        customer_import.status = 'FAILED'
+        customer_import.errors = [{'line': None, 'error': str(e)}]
+        customer_import.error_count = 1
+    else:
+        customer_import.status = 'DONE'
+        for field in ('rows', 'customers_created', 'addresses_created',
+                      'error_count', 'errors', 'rows_per_second'):
+            setattr(customer_import, field, stats[field])
+    customer_import.file.delete(save=False)
+    customer_import.finished_at = timezone.now()
+    customer_import.save()
+    return {'status': customer_import.status}
+
+
+def start_customer_import(customer_import):
+    """
+    Queues the import for the background workers.
+    """
+    return enqueue('customer_import', shop_id=customer_import.shop_id, max_attempts=1, import_id=customer_import.id)
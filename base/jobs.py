@@ -0,0 +1,147 @@
+import os
+import socket
+import threading
+import traceback
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+
+TASKS = {}
+
+
+def task(kind):
+    """
+    Registers a handler for jobs of `kind`. Handlers take the job's payload
+    as keyword arguments; whatever JSON they return is stored as the result.
+    """
+    def register(func):
+        TASKS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, shop_id=None, run_at=None, max_attempts=3, **payload):
+    """
+    Queues a job. Workers only see it once the surrounding transaction, if
+    any, commits.
+    """
+    if kind not in TASKS:
+        raise ValueError(f'No task registered for {kind!r}.')
+    return Job.objects.create(
+        kind=kind, shop_id=shop_id, payload=payload, max_attempts=max_attempts,
+        run_at=run_at or timezone.now(),
+    )
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def requeue_stale():
+    """
+    Hands jobs whose worker stopped renewing its hold on them back to the
+    queue, or marks them FAILED if that was their last attempt; the lost
+    run was counted when it was claimed. Returns how many were requeued.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=settings.JOB_TIMEOUT)
+    stale = Job.objects.filter(status='RUNNING').filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at=None, started_at__lt=cutoff)
+    )
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status='FAILED', locked_by=None, finished_at=now, error='The worker running this job stopped responding.',
+    )
+    return stale.update(status='PENDING', locked_by=None)
+
+
+def claim(worker=None):
+    """
+    Takes the oldest due job for this worker, or returns None. The claim is
+    a conditional UPDATE, so two workers never run one job; where the
+    database can, rows other workers are claiming are skipped rather than
+    waited on.
+    """
+    worker = worker or worker_name()
+    now = timezone.now()
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    with transaction.atomic() if skip_locked else nullcontext():
+        due = Job.objects.filter(status='PENDING', run_at__lte=now).order_by('run_at', 'id')
+        if skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        for job_id in due.values_list('id', flat=True)[:10]:
+            # The attempt is counted now, so one that takes its worker down still counts.
+            claimed = Job.objects.filter(id=job_id, status='PENDING').update(
+                status='RUNNING', locked_by=worker, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1,
+            )
+            if claimed:
+                return Job.objects.get(id=job_id)
+    return None
+
+
+def heartbeat(job, stop):
+    """
+    Renews the claimed job's heartbeat every JOB_HEARTBEAT seconds until
+    `stop` is set. Runs in its own thread, on its own connection.
+    """
+    try:
+        while not stop.wait(settings.JOB_HEARTBEAT):
+            Job.objects.filter(id=job.id, status='RUNNING', locked_by=job.locked_by).update(heartbeat_at=timezone.now())
+    finally:
+        connection.close()
+
+
+def run(job):
+    """
+    Runs a claimed job, renewing its heartbeat meanwhile. Failures are
+    retried with a growing delay until max_attempts, then the job is marked
+    FAILED. The outcome is only recorded while this worker still holds the
+    job.
+    """
+    stop = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(job, stop), daemon=True)
+    beat.start()
+    try:
+        result = TASKS[job.kind](**job.payload)
+    except Exception:
+        job.error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = 'PENDING'
+            job.run_at = timezone.now() + timedelta(seconds=settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1))
+        else:
+            job.status = 'FAILED'
+            job.finished_at = timezone.now()
+    else:
+        job.status = 'DONE'
+        job.result = result
+        job.error = None
+        job.finished_at = timezone.now()
+    finally:
+        stop.set()
+        beat.join()
+    worker, job.locked_by = job.locked_by, None
+    Job.objects.filter(id=job.id, status='RUNNING', locked_by=worker).update(
+        **{field: getattr(job, field) for field in ('status', 'result', 'error', 'run_at', 'locked_by', 'finished_at')}
+    )
+    return job
+
+
+def run_pending(limit=None):
+    """
+    Runs due jobs in this process until the queue is empty, or `limit` jobs
+    have run. Returns how many ran.
+    """
+    ran = 0
+    while limit is None or ran < limit:
+        job = claim()
+        if job is None:
+            break
+        run(job)
+        ran += 1
+    return ran
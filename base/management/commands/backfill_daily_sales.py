@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+from base.ids import new_id
+from base.models import Order, OrderItem, ShopDailySales
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the ShopDailySales rollup from existing orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', type=int, action='append', dest='shops',
+                            help='Only rebuild this shop (may be repeated).')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, shops=None, batch_size=1000, **options):
+        orders = Order.objects.exclude(status='CANCELLED')
+        items = OrderItem.objects.exclude(order__status='CANCELLED')
+        rollups = ShopDailySales.objects.all()
+        if shops:
+            orders = orders.filter(shop_id__in=shops)
+            items = items.filter(order__shop_id__in=shops)
+            rollups = rollups.filter(shop_id__in=shops)
+
+        days = {}
+        for row in (orders.annotate(date=TruncDate('created_at'))
+                    .values('shop_id', 'date')
+                    .annotate(order_count=Count('id'), gross_revenue=Sum('total_price'))
+                    .order_by()):
+            days[row['shop_id'], row['date']] = ShopDailySales(
+                shop_id=row['shop_id'], date=row['date'],
+                order_count=row['order_count'], gross_revenue=row['gross_revenue'],
+            )
+        for row in (items.annotate(date=TruncDate('order__created_at'))
+                    .values('order__shop_id', 'date')
+                    .annotate(units=Sum('quantity'))
+                    .order_by()):
+            day = days.get((row['order__shop_id'], row['date']))
+            if day is not None:
+                day.units = row['units']
+
+        rows = list(days.values())
+        for row in rows:
+            # bulk_create bypasses save(), which is where ids are assigned.
+            row.id = new_id()
+
+        with transaction.atomic():
+            deleted, _ = rollups.delete()
+            ShopDailySales.objects.bulk_create(rows, batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Replaced {deleted} rollup rows with {len(rows)} rows from {sum(r.order_count for r in rows)} orders.'
+        ))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from base.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = 'Recomputes stored line totals and order subtotals and item counts from the order lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', type=int, action='append', dest='shops',
+                            help='Only recompute this shop (may be repeated).')
+
+    def handle(self, *args, shops=None, **options):
+        orders = Order.objects.all()
+        items = OrderItem.objects.all()
+        if shops:
+            orders = orders.filter(shop_id__in=shops)
+            items = items.filter(order__shop_id__in=shops)
+
+        lines = (OrderItem.objects.filter(order=OuterRef('pk')).order_by()
+                 .values('order').annotate(total=Sum('line_total'), units=Sum('quantity')))
+        with transaction.atomic():
+            item_rows = items.update(line_total=ExpressionWrapper(
+                F('quantity') * F('price'), output_field=DecimalField(max_digits=10, decimal_places=2),
+            ))
+            order_rows = orders.update(
+                subtotal=Coalesce(Subquery(lines.values('total')), Value(0), output_field=DecimalField()),
+                item_count=Coalesce(Subquery(lines.values('units')), Value(0), output_field=IntegerField()),
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Recomputed {item_rows} lines on {order_rows} orders.'))
@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+import uuid
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+from django.db.models import Sum
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from base.models import Customer, OrderItem, Product, ProductVariant, Shop, User
+
+
+class Command(BaseCommand):
+    help = ('Load-tests checkout: concurrent clients order the same variant through the '
+            'place_order endpoint; throughput, latency, deadlocks and oversold units are '
+            'appended to a JSON file. Run it against a throwaway database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=50)
+        parser.add_argument('--orders', type=int, default=4, help='Orders each client places.')
+        parser.add_argument('--quantity', type=int, default=1, help='Units per order.')
+        parser.add_argument('--stock', type=int, default=100, help='Starting inventory of the hot variant.')
+        parser.add_argument('--url', help='Base URL of a running server; by default requests are made in-process.')
+        parser.add_argument('--output', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'checkout.json'))
+        parser.add_argument('--keep', action='store_true', help='Leave the benchmark shop and its orders in place.')
+
+    def handle(self, *args, clients, orders, quantity, stock, url=None, output=None, keep=False, **options):
+        shop, variant, customers = self.setup(clients, stock)
+        # Failed requests are counted below; their tracebacks would drown the summary.
+        request_logger = logging.getLogger('django.request')
+        log_level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        try:
+            results = [[] for _ in range(clients)]
+            start = threading.Barrier(clients + 1)
+            threads = [
+                threading.Thread(target=self.client, args=(start, results[i], url, customer, shop, variant, orders, quantity))
+                for i, customer in enumerate(customers)
+            ]
+            for thread in threads:
+                thread.start()
+            start.wait()
+            started = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            variant.refresh_from_db()
+            sold = OrderItem.objects.filter(variant=variant).aggregate(units=Sum('quantity'))['units'] or 0
+            run = self.summarise([result for client in results for result in client], elapsed)
+            run.update({
+                'sold': sold,
+                'oversold': max(sold - stock, 0),
+                # Units sold plus units left must add up to the starting stock.
+                'inventory_drift': stock - sold - variant.inventory,
+            })
+        finally:
+            request_logger.setLevel(log_level)
+            if not keep:
+                shop.delete()
+                User.objects.filter(id__in=[shop.owner_id] + [customer.id for customer in customers]).delete()
+
+        record = {
+            'commit': git_commit(),
+            'recorded_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'target': url or 'in-process',
+            'clients': clients, 'orders_per_client': orders, 'quantity': quantity, 'stock': stock,
+            **run,
+        }
+        self.append(output, record)
+        self.stdout.write(
+            f"{run['placed']} placed, {run['rejected']} rejected, {run['errors']} errors "
+            f"({run['deadlocks']} deadlocks) in {elapsed:.2f}s: {run['orders_per_second']:.1f} orders/s, "
+            f"p50 {run['p50_ms']:.1f}ms, p99 {run['p99_ms']:.1f}ms, oversold {run['oversold']}"
+        )
+        self.stdout.write(f'Results appended to {output}')
+
+    def setup(self, clients, stock):
+        tag = uuid.uuid4().hex[:8]
+        owner = User.objects.create_user(email=f'bench-{tag}@example.com', password=uuid.uuid4().hex, is_shop_owner=True)
+        shop = Shop.objects.create(name=f'bench-{tag}', myjamly_domain=f'bench-{tag}', owner=owner)
+        product = Product.objects.create(shop=shop, name='Hot item', handle='hot-item', price=10)
+        variant = ProductVariant.objects.create(product=product, name='Hot item', sku=f'HOT-{tag}', price=10, inventory=stock)
+        customers = [Customer.objects.create(email=f'bench-{tag}-{i}@example.com') for i in range(clients)]
+        return shop, variant, customers
+
+    def client(self, start, results, url, customer, shop, variant, orders, quantity):
+        body = json.dumps({'shop': shop.id, 'items': [{'variant': variant.id, 'quantity': quantity}]})
+        path = reverse('place_order', args=[customer.pk])
+        client = None if url else Client(raise_request_exception=False)
+        try:
+            start.wait()
+            for _ in range(orders):
+                started = time.perf_counter()
+                if client is not None:
+                    status, error = self.post_in_process(client, path, body)
+                else:
+                    status, error = post(url.rstrip('/') + path, body)
+                results.append(((time.perf_counter() - started) * 1000, status, error))
+        finally:
+            connection.close()
+
+    def post_in_process(self, client, path, body):
+        try:
+            response = client.post(path, body, content_type='application/json')
+        except DatabaseError as exc:
+            return 500, str(exc)
+        error = None
+        if response.status_code >= 500 and response.exc_info:
+            error = str(response.exc_info[1])
+        return response.status_code, error
+
+    def summarise(self, results, elapsed):
+        latencies = sorted(latency for latency, _, _ in results)
+        errors = [error or '' for _, status, error in results if status >= 500]
+        placed = sum(1 for _, status, _ in results if status == 201)
+        return {
+            'requests': len(results),
+            'placed': placed,
+            'rejected': sum(1 for _, status, _ in results if 400 <= status < 500),
+            'errors': len(errors),
+            'deadlocks': sum(1 for error in errors if 'deadlock' in error.lower()),
+            'lock_timeouts': sum(1 for error in errors if 'locked' in error.lower() or 'lock timeout' in error.lower()),
+            'seconds': round(elapsed, 3),
+            'orders_per_second': round(placed / elapsed, 2) if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 50),
+            'p99_ms': percentile(latencies, 99),
+        }
+
+    def append(self, output, record):
+        runs = []
+        if os.path.exists(output):
+            with open(output) as f:
+                runs = json.load(f)
+        runs.append(record)
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(runs, f, indent=2)
+            f.write('\n')
+
+
+def post(url, body):
+    request = Request(url, data=body.encode(), headers={'Content-Type': 'application/json'}, method='POST')
+    try:
+        with urlopen(request) as response:
+            return response.status, None
+    except HTTPError as exc:
+        return exc.code, exc.read().decode(errors='replace') if exc.code >= 500 else None
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    return round(values[min(len(values) - 1, int(len(values) * pct / 100))], 3)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,46 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connection
+
+from base.models import Shop
+
+
+MODES = {
+    'new connection per request': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False},
+    'persistent': {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': False},
+    'persistent + health checks': {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': True},
+}
+
+
+class Command(BaseCommand):
+    help = ('Measures per-request database latency with and without connection reuse, '
+            'replaying the request_started/request_finished cycle around one small query.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+
+    def handle(self, *args, requests=500, **options):
+        original = {key: connection.settings_dict.get(key) for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+        try:
+            for name, settings in MODES.items():
+                connection.close()
+                connection.settings_dict.update(settings)
+                timings = [self.request() for _ in range(requests)]
+                timings.sort()
+                self.stdout.write(
+                    f'{name:>28}: mean {statistics.mean(timings):.2f}ms, '
+                    f'p50 {timings[len(timings) // 2]:.2f}ms, p95 {timings[int(len(timings) * 0.95)]:.2f}ms'
+                )
+        finally:
+            connection.close()
+            connection.settings_dict.update(original)
+
+    def request(self):
+        started = time.perf_counter()
+        request_started.send(sender=self.__class__)
+        Shop.objects.exists()
+        request_finished.send(sender=self.__class__)
+        return (time.perf_counter() - started) * 1000
@@ -0,0 +1,73 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, connection, transaction
+
+from base.ids import SnowflakeGenerator, random_id
+
+
+SCHEMES = {
+    'random': lambda: random_id,
+    'snowflake': SnowflakeGenerator,
+}
+
+
+class Command(BaseCommand):
+    help = ('Compares insert throughput and primary key index size for random '
+            '10-digit ids and Snowflake ids, using scratch tables.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200000)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, rows=200000, batch_size=1000, **options):
+        for name, scheme in SCHEMES.items():
+            table = f'benchmark_ids_{name}'
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP TABLE IF EXISTS {table}')
+                cursor.execute(f'CREATE TABLE {table} (id bigint NOT NULL PRIMARY KEY, payload varchar(32) NOT NULL)')
+            try:
+                seconds, collisions = self.insert(table, scheme(), rows, batch_size)
+                size = self.index_size(table)
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute(f'DROP TABLE {table}')
+
+            self.stdout.write(
+                f'{name:>10}: {rows} rows in {seconds:.2f}s ({rows / seconds:.0f} rows/s), '
+                f'{collisions} colliding batches retried, '
+                f"index {'n/a' if size is None else f'{size / 1024:.0f} KiB'}"
+            )
+
+    def insert(self, table, generate, rows, batch_size):
+        sql = f'INSERT INTO {table} (id, payload) VALUES (%s, %s)'
+        collisions = 0
+        started = time.monotonic()
+        with connection.cursor() as cursor:
+            for start in range(0, rows, batch_size):
+                count = min(batch_size, rows - start)
+                while True:
+                    try:
+                        with transaction.atomic():
+                            cursor.executemany(sql, [(generate(), 'x' * 32) for _ in range(count)])
+                        break
+                    except IntegrityError:
+                        collisions += 1
+        return time.monotonic() - started, collisions
+
+    def index_size(self, table):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    'SELECT pg_relation_size(indexrelid) FROM pg_index '
+                    'WHERE indrelid = %s::regclass AND indisprimary', [table],
+                )
+                return cursor.fetchone()[0]
+            if connection.vendor == 'sqlite':
+                try:
+                    cursor.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = %s', [f'sqlite_autoindex_{table}_1'])
+                except Exception:
+                    # dbstat is an optional compile-time extension.
+                    return None
+                return cursor.fetchone()[0]
+        return None
@@ -0,0 +1,70 @@
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from base.models import Shop, User
+
+
+FAST_HASHER = 'django.contrib.auth.hashers.MD5PasswordHasher'
+
+
+class Command(BaseCommand):
+    help = ('Measures logins and shop-owner sign-ups per second, and queries per login, through '
+            'the API. Each figure is for one process serving one request at a time, which is '
+            'what a sync gunicorn worker does; size the worker count from it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=200)
+        parser.add_argument('--signups', type=int, default=20)
+        parser.add_argument('--hasher', choices=['pbkdf2', 'argon2', 'scrypt', 'md5'],
+                            help='Hash with this instead of PASSWORD_HASHER; md5 takes hashing '
+                                 'out of the measurement to show the rest of the request.')
+
+    def handle(self, *args, logins=200, signups=20, hasher=None, **options):
+        hashers = list(settings.PASSWORD_HASHERS)
+        if hasher == 'md5':
+            hashers.insert(0, FAST_HASHER)
+        elif hasher:
+            hashers.sort(key=lambda path: not path.lower().split('.')[-1].startswith(hasher))
+
+        tag = uuid.uuid4().hex[:8]
+        password = uuid.uuid4().hex
+        client = Client()
+        with override_settings(PASSWORD_HASHERS=hashers):
+            owner = User.objects.create_user(email=f'bench-{tag}@example.com', password=password, is_shop_owner=True)
+            Shop.objects.create(name=f'bench-{tag}', myjamly_domain=f'bench-{tag}', owner=owner)
+            body = json.dumps({'email': owner.email, 'password': password})
+            created = [owner.id]
+            try:
+                with CaptureQueriesContext(connection) as ctx:
+                    response = client.post(reverse('user_login'), body, content_type='application/json')
+                assert response.status_code == 200, response.content
+                login_rate = self.rate(logins, lambda i: client.post(reverse('user_login'), body, content_type='application/json'))
+
+                def sign_up(i):
+                    response = client.post(reverse('shop-owner-sign-up'), json.dumps({
+                        'email': f'bench-{tag}-{i}@example.com', 'password': password, 'is_shop_owner': True,
+                        'shop': {'name': f'bench-{tag}-{i}', 'myjamly_domain': f'bench-{tag}-{i}'},
+                    }), content_type='application/json')
+                    created.append(response.json()['id'])
+                signup_rate = self.rate(signups, sign_up)
+            finally:
+                User.objects.filter(id__in=created).delete()
+
+        self.stdout.write(f'hasher: {hashers[0]}')
+        self.stdout.write(f'logins: {login_rate:.1f}/s ({1000 / login_rate:.2f}ms each), '
+                          f'{len(ctx.captured_queries)} queries per login')
+        self.stdout.write(f'sign-ups: {signup_rate:.1f}/s ({1000 / signup_rate:.2f}ms each)')
+
+    def rate(self, count, request):
+        started = time.perf_counter()
+        for i in range(count):
+            request(i)
+        return count / (time.perf_counter() - started)
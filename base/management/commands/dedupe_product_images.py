@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from django.utils import timezone
+
+from base.images import content_hash, delete_renditions
+from base.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Hashes stored product images and points images with the same content at one stored file.'
+
+    def handle(self, *args, **options):
+        hashed = repointed = freed = 0
+        kept = dict(ProductImage.objects.exclude(content_hash=None).exclude(image='')
+                    .values_list('content_hash', 'image').order_by('-id'))
+        rows = ProductImage.objects.filter(content_hash=None).exclude(image='').exclude(image__isnull=True)
+        for image in rows.order_by('id').iterator():
+            storage = image.image.storage
+            try:
+                with image.image.open('rb') as stored:
+                    digest = content_hash(stored)
+            except OSError:
+                self.stderr.write(f'ProductImage {image.id}: {image.image.name} is missing')
+                continue
+            hashed += 1
+            if digest not in kept:
+                kept[digest] = image.image.name
+                ProductImage.objects.filter(id=image.id).update(content_hash=digest)
+                continue
+
+            # Same bytes as a file already kept: share it and its renditions.
+            original = ProductImage.objects.filter(image=kept[digest]).values_list('renditions', flat=True).first()
+            old_name, old_renditions = image.image.name, image.renditions
+            ProductImage.objects.filter(id=image.id).update(
+                content_hash=digest, image=kept[digest], renditions=original or {}, updated_at=timezone.now(),
+            )
+            repointed += 1
+            if old_name != kept[digest] and not ProductImage.objects.filter(image=old_name).exists():
+                storage.delete(old_name)
+                delete_renditions(storage, old_renditions)
+                freed += 1
+        self.stdout.write(f'{hashed} hashed, {repointed} repointed, {freed} files freed')
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from base.images import delete_renditions, refresh_renditions
+from base.models import Collection, Product, ProductImage
+
+
+IMAGE_FIELDS = [
+    (ProductImage, 'image', 'renditions'),
+    (Product, 'thumbnail', 'thumbnail_renditions'),
+    (Collection, 'image', 'image_renditions'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Generates missing or stale image renditions for stored product and collection images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate renditions that look current.')
+
+    def handle(self, *args, force=False, **options):
+        for model, field_name, renditions_field in IMAGE_FIELDS:
+            done = 0
+            regenerated = {}
+            rows = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+            for instance in rows.iterator():
+                before = getattr(instance, renditions_field)
+                name = getattr(instance, field_name).name
+                if force and name in regenerated:
+                    # Rows sharing a stored file share its renditions too.
+                    setattr(instance, renditions_field, regenerated[name])
+                elif force:
+                    # Other rows sharing these renditions pick up the new ones in the branch above.
+                    delete_renditions(getattr(instance, field_name).storage, before)
+                    setattr(instance, renditions_field, {})
+                    refresh_renditions(instance, field_name, renditions_field, {})
+                    regenerated[name] = getattr(instance, renditions_field)
+                else:
+                    refresh_renditions(instance, field_name, renditions_field, {})
+                if getattr(instance, renditions_field) != before:
+                    # Bumping updated_at lets conditional GETs and the storefront cache see the new URLs.
+                    instance.save(update_fields=[renditions_field, 'updated_at'])
+                    done += 1
+            self.stdout.write(f'{model.__name__}.{field_name}: {done} updated')
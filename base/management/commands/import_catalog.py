@@ -0,0 +1,40 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from base.importers import READERS, import_catalog
+from base.models import Shop
+
+
+class Command(BaseCommand):
+    help = 'Streams products from a CSV or JSONL file into a shop with batched bulk inserts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('shop_id', type=int)
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(READERS),
+                            help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, shop_id, path, format=None, batch_size=500, **options):
+        try:
+            shop = Shop.objects.get(id=shop_id)
+        except Shop.DoesNotExist:
+            raise CommandError(f'Shop {shop_id} does not exist.')
+        format = format or os.path.splitext(path)[1].lstrip('.').lower()
+        if format not in READERS:
+            raise CommandError(f'Cannot tell the format of {path}; pass --format.')
+
+        def progress(stats):
+            self.stdout.write(f"{stats['rows']} rows, {stats['products_created']} products, {stats['error_count']} errors")
+
+        with open(path, 'rb') as stream:
+            stats = import_catalog(shop, stream, format, batch_size=batch_size, progress=progress)
+
+        for error in stats['errors']:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['products_created']} products and {stats['variants_created']} variants "
+            f"from {stats['rows']} rows in {stats['seconds']}s ({stats['rows_per_second']} rows/s), "
+            f"{stats['error_count']} errors."
+        ))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from base.importers import import_customers
+from base.models import Shop
+
+
+class Command(BaseCommand):
+    help = ('Streams customers from a CSV file into a shop with batched bulk inserts. Columns: email, '
+            'first_name, last_name, accepts_marketing, password_hash, street_address, city, state, '
+            'country, zip_code. Customers without a password_hash must reset their password; '
+            'emails that already have an account are reported and skipped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('shop_id', type=int)
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, shop_id, path, batch_size=500, **options):
+        try:
+            shop = Shop.objects.get(id=shop_id)
+        except Shop.DoesNotExist:
+            raise CommandError(f'Shop {shop_id} does not exist.')
+
+        def progress(stats):
+            self.stdout.write(f"{stats['rows']} rows, {stats['customers_created']} customers, {stats['error_count']} errors")
+
+        with open(path, 'rb') as stream:
+            stats = import_customers(shop, stream, batch_size=batch_size, progress=progress)
+
+        for error in stats['errors']:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['customers_created']} customers and {stats['addresses_created']} addresses "
+            f"from {stats['rows']} rows in {stats['seconds']}s ({stats['rows_per_second']} rows/s), {stats['error_count']} errors."
+        ))
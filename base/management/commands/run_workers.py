@@ -0,0 +1,77 @@
+import multiprocessing
+import signal
+import time
+import traceback
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connections
+
+from base.jobs import claim, requeue_stale, run, run_pending
+
+
+class Command(BaseCommand):
+    help = 'Runs background jobs from the job table in a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=settings.JOB_WORKERS)
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds to sleep when the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Run the due jobs in this process, then exit.')
+
+    def handle(self, *args, processes, poll=1.0, once=False, **options):
+        requeue_stale()
+        if once:
+            self.stdout.write(f'Ran {run_pending()} jobs.')
+            return
+
+        # Children must open their own connections, not share the parent's socket.
+        connections.close_all()
+        stopping = multiprocessing.Event()
+        workers = [multiprocessing.Process(target=work, args=(stopping, poll), daemon=True) for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f'Started {processes} workers.')
+
+        # Only note the signal here: setting the shared event from a handler
+        # can deadlock with a wait() that holds its lock.
+        signalled = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: signalled.append(signum))
+        signal.signal(signal.SIGINT, lambda signum, frame: signalled.append(signum))
+
+        requeued_at = time.monotonic()
+        while not signalled:
+            time.sleep(poll)
+            if time.monotonic() - requeued_at > 60:
+                requeue_stale()
+                connections.close_all()
+                requeued_at = time.monotonic()
+            for i, worker in enumerate(workers):
+                if not worker.is_alive():
+                    workers[i] = multiprocessing.Process(target=work, args=(stopping, poll), daemon=True)
+                    workers[i].start()
+
+        stopping.set()
+        # Let running jobs finish.
+        for worker in workers:
+            worker.join()
+        self.stdout.write('Workers stopped.')
+
+
+def work(stopping, poll):
+    # The parent decides when to stop, so a signal sent to the whole process
+    # group does not cut a job short.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    while not stopping.is_set():
+        close_old_connections()
+        try:
+            job = claim()
+            if job is not None:
+                run(job)
+        except DatabaseError:
+            # A lost connection or lock timeout; a claimed job is requeued once stale.
+            traceback.print_exc()
+            connections.close_all()
+            job = None
+        if job is None:
+            stopping.wait(poll)
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.18 on 2026-10-18 08:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0003_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopDailySales',
+            fields=[
+                ('id', models.BigIntegerField(editable=False, primary_key=True, serialize=False)),
+                ('date', models.DateField()),
+                ('order_count', models.IntegerField(default=0)),
+                ('gross_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('units', models.IntegerField(default=0)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='base.shop')),
+            ],
+            options={
+                'ordering': ('date',),
+                'unique_together': {('shop', 'date')},
+            },
+        ),
+    ]
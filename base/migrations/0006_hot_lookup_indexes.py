@@ -0,0 +1,33 @@
+# Generated by Django 3.2.18 on 2026-10-18 08:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0005_catalog_import'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='optionvalue',
+            index=models.Index(fields=['option', 'name'], name='optionvalue_option_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['shop', 'created_at', 'id'], name='order_shop_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('fulfilled', False)), fields=['shop', 'created_at', 'id'], name='order_shop_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['product', 'created_at'], name='orderitem_product_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['shop', 'name'], name='product_shop_name_idx'),
+        ),
+    ]
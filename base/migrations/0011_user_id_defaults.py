@@ -0,0 +1,24 @@
+# Generated by Django 3.2.18 on 2026-10-18 08:38
+
+import base.ids
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0010_order_totals'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customer',
+            name='customer_id',
+            field=models.BigIntegerField(default=base.ids.new_id, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='id',
+            field=models.BigIntegerField(default=base.ids.new_id, editable=False, primary_key=True, serialize=False),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.18 on 2026-10-18 08:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0011_user_id_defaults'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='password_reset_required',
+            field=models.BooleanField(default=False, help_text='Designates whether the user must choose a password before logging in, e.g. after an import without one.'),
+        ),
+        migrations.CreateModel(
+            name='CustomerImport',
+            fields=[
+                ('id', models.BigIntegerField(editable=False, primary_key=True, serialize=False)),
+                ('file', models.FileField(upload_to='customer_imports')),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('DONE', 'Done'), ('FAILED', 'Failed')], default='PENDING', max_length=20)),
+                ('rows', models.IntegerField(default=0)),
+                ('customers_created', models.IntegerField(default=0)),
+                ('customers_linked', models.IntegerField(default=0)),
+                ('addresses_created', models.IntegerField(default=0)),
+                ('error_count', models.IntegerField(default=0)),
+                ('errors', models.JSONField(blank=True, default=list)),
+                ('rows_per_second', models.FloatField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='customer_imports', to='base.shop')),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.18 on 2026-10-18 08:43
+
+import base.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0012_customer_import'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='customer',
+            managers=[
+                ('objects', base.models.CustomerManager()),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.18 on 2026-10-18 08:55
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0014_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='customerimport',
+            name='customers_linked',
+        ),
+    ]
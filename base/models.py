@@ -1,15 +1,17 @@
-from random import randint
+import os
 import uuid
-from django.db import models
+from decimal import Decimal
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Max, Prefetch, Sum
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractUser, BaseUserManager
+from django.utils import timezone
 from django.utils.functional import cached_property
 from ckeditor.fields import RichTextField
 
+from .ids import new_id
+from .images import content_hash, refresh_renditions
 
-def randomWithN(n):
-    range_start = 10**(n-1)
-    range_end = (10**n)-1
-    return randint(range_start, range_end)
 
 #####USER#####
 class UserManager(BaseUserManager):
@@ -43,7 +45,8 @@ class UserManager(BaseUserManager):
 
 
 class User(AbstractUser):
-    id = models.BigIntegerField(primary_key=True, editable=False)
+    # With a default, saving a new user is a plain INSERT rather than an UPDATE that finds nothing first.
+    id = models.BigIntegerField(primary_key=True, default=new_id, editable=False)
     username = None
     email = models.EmailField(unique=True)
     accepts_marketing = models.BooleanField(default=False)
@@ -54,6 +57,7 @@ class User(AbstractUser):
     shops = models.ManyToManyField('Shop', related_name='customers', blank=True)
     is_active = models.BooleanField(default=True, help_text=('Designates whether the user is active.'))
     is_shop_owner = models.BooleanField(default=False, help_text=('Designates whether the user is a shop owner and can log into a shop admin site.'))
+    password_reset_required = models.BooleanField(default=False, help_text=('Designates whether the user must choose a password before logging in, e.g. after an import without one.'))
 
 
     USERNAME_FIELD = 'email'
@@ -61,11 +65,16 @@ class User(AbstractUser):
     
     objects = UserManager()
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['date_joined', 'id'], name='user_date_joined_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if self.is_superuser:
             self.is_staff = True
         if not self.id: 
-            self.id = randomWithN(10)
+            self.id = new_id()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -78,21 +87,48 @@ class User(AbstractUser):
         return self.first_name
 
 
-class CustomerManager(models.Manager):
-    def get_queryset(self):
-        qs = super().get_queryset()
-        qs.prefetch_related('customeraddress_set').select_related('default_address')
-        return qs
+class CustomerQuerySet(models.QuerySet):
+    def with_addresses(self):
+        """
+        Prefetches the addresses `addresses` and `default_address` read.
+        """
+        return self.prefetch_related(
+            Prefetch('customeraddress_set', queryset=CustomerAddress.objects.order_by('id')),
+        )
+
+    def with_order_stats(self, shop=None):
+        """
+        Annotates orders_count, total_spent and last_order_at from each
+        customer's orders, leaving out cancelled ones and, given a shop,
+        those placed elsewhere. One subquery each, so they neither multiply
+        rows nor need a GROUP BY.
+        """
+        orders = Order.objects.filter(customer=models.OuterRef('pk')).exclude(status='CANCELLED')
+        if shop is not None:
+            orders = orders.filter(shop=shop)
+        per_customer = orders.order_by().values('customer')
+        return self.annotate(
+            orders_count=Coalesce(models.Subquery(per_customer.annotate(n=Count('id')).values('n')), 0),
+            total_spent=Coalesce(
+                models.Subquery(per_customer.annotate(total=Sum('total_price')).values('total')),
+                Decimal('0'), output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+            last_order_at=models.Subquery(per_customer.annotate(latest=Max('created_at')).values('latest')),
+        )
+
+
+class CustomerManager(UserManager.from_queryset(CustomerQuerySet)):
+    pass
 
 
 class Customer(User):
 
-    #objects = CustomerManager()
-    customer_id = models.BigIntegerField(primary_key=True, editable=False)
+    objects = CustomerManager()
+    customer_id = models.BigIntegerField(primary_key=True, default=new_id, editable=False)
 
     def save(self, *args, **kwargs):
         if not self.customer_id:  
-            self.customer_id = randomWithN(10)
+            self.customer_id = new_id()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -116,8 +152,12 @@ class Customer(User):
     @cached_property
     def default_address(self):
         """
-        Returns the default customer_address.
+        Returns the default customer_address, or the first one if none was
+        chosen.
         """
+        for address in self.addresses:
+            if address.id == self.default_address_id:
+                return address
         if self.addresses:
             return self.addresses[0]
 
@@ -130,31 +170,44 @@ class Customer(User):
         """
         return True
 
+    def placed_orders(self):
+        """
+        The customer's orders, newest first, without cancelled ones.
+        """
+        return self.order_set.exclude(status='CANCELLED').order_by('-created_at', '-id')
+
     @cached_property
     def last_order(self):
         """
-        Returns the last order placed by the customer, not including test
-        orders.
+        Returns the last order placed by the customer, not including
+        cancelled orders.
         """
-        #if self.orders_count:
-            #return self.orders[0]
+        return self.placed_orders().first()
 
     @cached_property
     def last_order_id(self):
         """
         The id of the customer's last order.
         """
-        #if self.last_order:
-            #return self.last_order.pk
+        if self.last_order:
+            return self.last_order.pk
+
+    @cached_property
+    def last_order_at(self):
+        """
+        When the customer's last order was placed. Annotated by
+        with_order_stats.
+        """
+        if self.last_order:
+            return self.last_order.created_at
 
     @cached_property
     def last_order_name(self):
         """
-        The name of the customer's last order. This is directly related to the
-        Order's name field.
+        The name of the customer's last order.
         """
-        #if self.last_order:
-            #return self.last_order.name
+        if self.last_order_id:
+            return f'#{self.last_order_id}'
 
     @cached_property
     def name(self):
@@ -166,23 +219,25 @@ class Customer(User):
     @cached_property
     def orders(self):
         """
-        Returns an array of all orders placed by the customer.
+        Returns an array of all orders placed by the customer, newest first.
         """
-        #return list(self.order_set.all())
+        return list(self.placed_orders())
 
     @cached_property
     def orders_count(self):
         """
-        Returns the total number of orders a customer has placed.
+        Returns the total number of orders a customer has placed. Annotated
+        by with_order_stats.
         """
-        #return len(self.orders)
+        return self.placed_orders().count()
 
     @cached_property
     def total_spent(self):
         """
-        Returns the total amount spent on all orders.
+        Returns the total amount spent on all orders. Annotated by
+        with_order_stats.
         """
-        raise NotImplemented
+        return self.placed_orders().aggregate(total=Sum('total_price'))['total'] or Decimal('0')
 
 
 class CustomerAddress(models.Model):
@@ -196,7 +251,7 @@ class CustomerAddress(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.id:  
-            self.id = randomWithN(10)
+            self.id = new_id()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -229,7 +284,7 @@ class Shop(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.id:  
-            self.id = randomWithN(10)
+            self.id = new_id()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -237,23 +292,65 @@ class Shop(models.Model):
 
 
 #####PRODUCT, COLLECTION, AND ORDER#####
+class ProductQuerySet(models.QuerySet):
+    def with_details(self):
+        """
+        Prefetches everything ProductSerializer renders, so serializing any
+        number of products costs a fixed number of queries.
+        """
+        return self.prefetch_related(
+            Prefetch('images', queryset=ProductImage.objects.all()),
+            Prefetch('options', queryset=ProductOption.objects.prefetch_related('values')),
+            Prefetch('variants', queryset=ProductVariant.objects.prefetch_related('values')),
+            Prefetch('collections', queryset=Collection.objects.only('id')),
+        )
+
+    def with_summary(self):
+        """
+        Prefetches the relations SimpleProductSerializer renders.
+        """
+        return self.prefetch_related(
+            Prefetch('images', queryset=ProductImage.objects.all()),
+            Prefetch('variants', queryset=ProductVariant.objects.prefetch_related('values')),
+        )
+
+
+class CollectionQuerySet(models.QuerySet):
+    def with_products(self):
+        """
+        Prefetches the products of each collection along with the relations
+        CollectionSerializer renders for them.
+        """
+        return self.prefetch_related(
+            Prefetch('products', queryset=Product.objects.with_summary()),
+        )
+
+
 class Collection(models.Model):
     id = models.BigIntegerField(primary_key=True, editable=False)
     shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
     image = models.ImageField(upload_to='collection', blank=True, null=True)
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     handle = models.CharField(max_length=255, blank=True, null=True)
     is_active = models.BooleanField(default=False)
     #products = models.ManyToManyField('Product', blank=True)
     created_at = models.DateTimeField(auto_now_add=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = CollectionQuerySet.as_manager()
 
     class Meta:
         unique_together = ('shop', 'handle',)
+        indexes = [
+            models.Index(fields=['shop', 'created_at', 'id'], name='collection_shop_created_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.id:  
-            self.id = randomWithN(10)
+            self.id = new_id()
+        refresh_renditions(self, 'image', 'image_renditions', kwargs)
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -273,6 +370,7 @@ class Product(models.Model):
     handle = models.CharField(max_length=255, blank=True, null=True)
     status = models.CharField(max_length=20, choices=PRODUCT_STATUS, default='PUBLISHED')
     thumbnail = models.ImageField(upload_to='product_thumbnail', blank=True, null=True)
+    thumbnail_renditions = models.JSONField(default=dict, blank=True, editable=False)
     weight = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     length = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     height = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
@@ -281,30 +379,66 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         unique_together = ('shop', 'handle',)
+        indexes = [
+            models.Index(fields=['shop', 'created_at', 'id'], name='product_shop_created_idx'),
+            models.Index(fields=['shop', 'name'], name='product_shop_name_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.id:  
-            self.id = randomWithN(10)
+            self.id = new_id()
+        refresh_renditions(self, 'thumbnail', 'thumbnail_renditions', kwargs)
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
 
+def product_image_path(instance, filename):
+    # Content-addressed: the same bytes always map to the same name.
+    if not instance.content_hash:
+        return os.path.join('product_images', filename)
+    extension = os.path.splitext(filename)[1].lower()
+    return f'product_images/{instance.content_hash[:2]}/{instance.content_hash}{extension}'
+
+
 class ProductImage(models.Model):
     id = models.BigIntegerField(primary_key=True, editable=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to='product_images', blank=True, null=True)
+    image = models.ImageField(upload_to=product_image_path, blank=True, null=True)
+    content_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True, editable=False)
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
         if not self.id:  
-            self.id = randomWithN(10)
+            self.id = new_id()
+        if self.image and not self.image._committed and kwargs.get('update_fields') is None:
+            self.reuse_stored_file()
+        refresh_renditions(self, 'image', 'renditions', kwargs)
         super().save(*args, **kwargs)
 
+    def reuse_stored_file(self):
+        """
+        Hashes a new upload and, when the same bytes are already stored,
+        points at that file and its renditions instead of writing a copy.
+        """
+        self.content_hash = content_hash(self.image)
+        stored = (ProductImage.objects.filter(content_hash=self.content_hash).exclude(id=self.id)
+                  .values_list('image', 'renditions').first())
+        if stored:
+            self.image, self.renditions = stored
+            return
+        name = self.image.field.generate_filename(self, self.image.name)
+        if self.image.storage.exists(name):
+            # Left behind by a deleted row.
+            self.image = name
+
 
 class ProductOption(models.Model):
     id = models.BigIntegerField(primary_key=True, editable=False)
@@ -314,7 +448,7 @@ class ProductOption(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.id:  
-            self.id = randomWithN(10)
+            self.id = new_id()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -326,9 +460,14 @@ class OptionValue(models.Model):
     name = models.CharField(max_length=255)
     option = models.ForeignKey(ProductOption, related_name="values", on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['option', 'name'], name='optionvalue_option_name_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.id:  
-            self.id = randomWithN(10)
+            self.id = new_id()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -346,7 +485,7 @@ class ProductVariant(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.id:  
-            self.id = randomWithN(10)
+            self.id = new_id()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -361,26 +500,47 @@ class Order(models.Model):
         ('DELIVERED', 'Delivered'),
         ('CANCELLED', 'Cancelled'),
     )
+    LINE_TOTAL_FIELDS = ('subtotal', 'item_count')
+
     id = models.BigIntegerField(primary_key=True, editable=False)
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
     shipping_address = models.ForeignKey(CustomerAddress, on_delete=models.CASCADE, null=True)
     status = models.CharField(max_length=20, choices=ORDER_STATUS, default='PENDING')
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Sums of the lines, kept current as they are written so lists never re-add them.
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    item_count = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     fulfilled = models.BooleanField(default=False)
     products = models.ManyToManyField(Product, through='OrderItem')
     shop = models.ForeignKey(Shop, on_delete=models.CASCADE, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'created_at', 'id'], name='order_customer_created_idx'),
+            models.Index(fields=['shop', 'created_at', 'id'], name='order_shop_created_idx'),
+            # Open orders are a small, hot slice of the table.
+            models.Index(fields=['shop', 'created_at', 'id'], condition=models.Q(fulfilled=False),
+                         name='order_shop_open_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.id:  
-            self.id = randomWithN(10)
+            self.id = new_id()
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # The totals move with the lines; a copy loaded before they
+            # changed must not write its stale values back.
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.LINE_TOTAL_FIELDS
+            ]
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Order #{self.id} - {self.customer.first_name}"
     
     def get_total_cost(self):
-        return sum(item.get_total_price() for item in self.products.all())
+        return self.subtotal
 
 
 class OrderItem(models.Model):
@@ -390,15 +550,179 @@ class OrderItem(models.Model):
     variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, null=True)
     quantity = models.PositiveIntegerField(default=1)
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    line_total = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'created_at'], name='orderitem_product_created_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.id:  
-            self.id = randomWithN(10)
+            self.id = new_id()
+        self.line_total = self.quantity * self.price
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = list(kwargs['update_fields']) + ['line_total']
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.quantity} x {self.product.name} ({self.variant}) for Order #{self.order.id}"
     
     def get_total_price(self):
-        return self.quantity * self.variant.price
\ No newline at end of file
+        return self.line_total
+
+#####ANALYTICS#####
+class ShopDailySales(models.Model):
+    """
+    Per-shop, per-day sales totals, kept current as orders are written so
+    dashboards read a handful of rows instead of scanning every order.
+    Cancelled orders are left out.
+    """
+    id = models.BigIntegerField(primary_key=True, editable=False)
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='daily_sales')
+    date = models.DateField()
+    order_count = models.IntegerField(default=0)
+    gross_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('shop', 'date',)
+        ordering = ('date',)
+
+    def save(self, *args, **kwargs):
+        if not self.id:  
+            self.id = new_id()
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.shop_id} {self.date}: {self.order_count} orders, {self.gross_revenue}"
+
+    @classmethod
+    def record(cls, shop_id, date, order_count=0, gross_revenue=0, units=0):
+        """
+        Adds the given deltas to a shop's row for the day, creating it if
+        needed. Safe under concurrent writers. Removals never create a row:
+        with none to take from, the orders are going with their shop, whose
+        rollup was deleted first.
+        """
+        deltas = {
+            'order_count': F('order_count') + order_count,
+            'gross_revenue': F('gross_revenue') + gross_revenue,
+            'units': F('units') + units,
+        }
+        if cls.objects.filter(shop_id=shop_id, date=date).update(**deltas):
+            return
+        if min(order_count, gross_revenue, units) < 0:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(shop_id=shop_id, date=date, order_count=order_count,
+                                   gross_revenue=gross_revenue, units=units)
+        except IntegrityError:
+            cls.objects.filter(shop_id=shop_id, date=date).update(**deltas)
+
+
+#####IMPORTS#####
+class CatalogImport(models.Model):
+    IMPORT_STATUS = (
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    )
+    IMPORT_FORMAT = (
+        ('csv', 'CSV'),
+        ('jsonl', 'JSON Lines'),
+    )
+    id = models.BigIntegerField(primary_key=True, editable=False)
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='catalog_imports')
+    file = models.FileField(upload_to='catalog_imports')
+    format = models.CharField(max_length=10, choices=IMPORT_FORMAT)
+    status = models.CharField(max_length=20, choices=IMPORT_STATUS, default='PENDING')
+    rows = models.IntegerField(default=0)
+    products_created = models.IntegerField(default=0)
+    variants_created = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    rows_per_second = models.FloatField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def save(self, *args, **kwargs):
+        if not self.id:  
+            self.id = new_id()
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Import #{self.id} for {self.shop_id} ({self.status})"
+
+
+class CustomerImport(models.Model):
+    """
+    A customer CSV uploaded to a shop. The file is deleted once imported,
+    since it may carry password hashes.
+    """
+    id = models.BigIntegerField(primary_key=True, editable=False)
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='customer_imports')
+    file = models.FileField(upload_to='customer_imports')
+    status = models.CharField(max_length=20, choices=CatalogImport.IMPORT_STATUS, default='PENDING')
+    rows = models.IntegerField(default=0)
+    customers_created = models.IntegerField(default=0)
+    addresses_created = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    rows_per_second = models.FloatField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def save(self, *args, **kwargs):
+        if not self.id:  
+            self.id = new_id()
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Customer import #{self.id} for {self.shop_id} ({self.status})"
+
+
+#####JOBS#####
+class Job(models.Model):
+    """
+    A unit of background work, run by `manage.py run_workers`. `kind` names
+    a handler registered with base.jobs.task.
+    """
+    JOB_STATUS = (
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    )
+    id = models.BigIntegerField(primary_key=True, editable=False)
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='jobs', blank=True, null=True)
+    kind = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=JOB_STATUS, default='PENDING')
+    result = models.JSONField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=255, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    # Renewed by the worker while it runs the job; see base.jobs.requeue_stale.
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.id:  
+            self.id = new_id()
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.status})"
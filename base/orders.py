@@ -0,0 +1,98 @@
+from collections import Counter
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Case, Exists, F, OuterRef, When
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .caching import invalidate_storefront_for_shop
+from .ids import new_id
+from .models import Order, OrderItem, Product, ProductVariant, ShopDailySales
+from .signals import counts_as_sale
+
+
+def place_order(customer, shop, items_data, **order_fields):
+    """
+    Places an order in one transaction: locks the ordered variants (in id
+    order, so concurrent checkouts of the same SKUs queue rather than
+    deadlock), checks and reserves their stock with a single UPDATE,
+    bulk-inserts the lines and prices everything from the catalogue, not
+    the client.
+
+    `items_data` holds dicts with a `variant_id` or, for products without
+    variants, a `product_id`, and a `quantity`. Raises ValidationError,
+    leaving nothing written, when a line is not a published product of
+    `shop`, names a product that has variants, or is out of stock.
+    """
+    wanted = Counter()
+    for item in items_data:
+        if item.get('variant_id') is not None:
+            wanted['variant', item['variant_id']] += item.get('quantity', 1)
+        elif item.get('product_id') is not None:
+            wanted['product', item['product_id']] += item.get('quantity', 1)
+        else:
+            raise ValidationError({'items': 'Each item needs a product or a variant.'})
+
+    with transaction.atomic():
+        # Only the variant rows are locked, not the products joined in to check the shop.
+        of = ('self',) if connection.features.has_select_for_update_of else ()
+        variant_ids = sorted(key for kind, key in wanted if kind == 'variant')
+        variants = {
+            variant.id: variant
+            for variant in ProductVariant.objects.select_for_update(of=of)
+            .filter(id__in=variant_ids, product__shop=shop, product__status='PUBLISHED').order_by('id')
+        }
+        products = Product.objects.annotate(
+            has_variants=Exists(ProductVariant.objects.filter(product=OuterRef('pk'))),
+        ).in_bulk([key for kind, key in wanted if kind == 'product'])
+
+        lines, errors = [], {}
+        for (kind, key), quantity in wanted.items():
+            if kind == 'variant':
+                variant = variants.get(key)
+                if variant is None:
+                    errors[str(key)] = 'Not for sale in this shop.'
+                elif variant.inventory < quantity:
+                    errors[str(key)] = f'Only {variant.inventory} left in stock.'
+                else:
+                    lines.append((variant.product_id, variant, quantity, variant.price))
+            else:
+                product = products.get(key)
+                if product is None or product.shop_id != shop.id or product.status != 'PUBLISHED' or product.price is None:
+                    errors[str(key)] = 'Not for sale in this shop.'
+                elif product.has_variants:
+                    # Stock is kept per variant; ordering the product would skip it.
+                    errors[str(key)] = 'Choose a variant of this product.'
+                else:
+                    lines.append((product.id, None, quantity, product.price))
+        if errors:
+            raise ValidationError({'items': errors})
+
+        reserved = {variant.id: quantity for _, variant, quantity, _ in lines if variant is not None}
+        if reserved:
+            ProductVariant.objects.filter(id__in=reserved).update(inventory=Case(
+                *[When(id=variant_id, then=F('inventory') - quantity) for variant_id, quantity in reserved.items()]
+            ))
+
+        total = sum((price * quantity for _, _, quantity, price in lines), Decimal('0'))
+        units = sum(quantity for _, _, quantity, _ in lines)
+        # bulk_create skips the signals that keep the order's totals and the
+        # day's units current, so they are written here.
+        order = Order.objects.create(customer=customer, shop=shop, total_price=total, subtotal=total,
+                                     item_count=units, **order_fields)
+        OrderItem.objects.bulk_create([
+            OrderItem(id=new_id(), order=order, product_id=product_id, variant=variant,
+                      quantity=quantity, price=price, line_total=price * quantity)
+            for product_id, variant, quantity, price in lines
+        ])
+        if counts_as_sale(order.status):
+            ShopDailySales.record(shop.id, timezone.localdate(order.created_at), units=units)
+        if reserved:
+            Product.objects.filter(variants__in=reserved).update(updated_at=timezone.now())
+        # The cached storefront may show stock counts a little behind, which
+        # is what keeps it cached through a busy sale; it is only dropped when
+        # a variant sells out. Checkout itself always reads live stock.
+        if any(variant is not None and variant.inventory == quantity for _, variant, quantity, _ in lines):
+            invalidate_storefront_for_shop(shop.id)
+    return order
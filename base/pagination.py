@@ -0,0 +1,121 @@
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Newest-first pagination keyed on (timestamp, id). Each page is an index
+    range scan that starts where the previous one stopped, so fetching page
+    1000 costs the same as fetching page 1, unlike OFFSET. The ordering
+    fields need a composite index in that order.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('created_at', 'id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        time_field, id_field = self.ordering
+
+        position, self.reverse = self.decode_cursor(request)
+        if self.reverse:
+            queryset = queryset.order_by(time_field, id_field)
+        else:
+            queryset = queryset.order_by('-' + time_field, '-' + id_field)
+
+        if position is not None:
+            timestamp, pk = position
+            after, bound = ('__gt', '__gte') if self.reverse else ('__lt', '__lte')
+            # The OR alone is not an index bound; the redundant range on the
+            # timestamp lets the scan start at the cursor.
+            queryset = queryset.filter(
+                Q(**{time_field + after: timestamp})
+                | Q(**{time_field: timestamp, id_field + after: pk}),
+                **{time_field + bound: timestamp},
+            )
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if self.reverse:
+            results.reverse()
+
+        # Going backwards, there is always a newer page to return to, and
+        # "more" rows means more rows in the backward direction.
+        self.has_next = (position is not None) if self.reverse else has_more
+        self.has_previous = has_more if self.reverse else (position is not None)
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            timestamp, pk, reverse = json.loads(b64decode(encoded.encode('ascii')))
+            timestamp = parse_datetime(timestamp)
+            if timestamp is None:
+                raise ValueError
+            return (timestamp, int(pk)), bool(reverse)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, instance, reverse):
+        time_field, id_field = self.ordering
+        position = [getattr(instance, time_field).isoformat(), getattr(instance, id_field), reverse]
+        encoded = b64encode(json.dumps(position).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class CustomerPagination(KeysetPagination):
+    # Both on the user table, so one index covers them.
+    ordering = ('date_joined', 'id')
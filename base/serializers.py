@@ -1,11 +1,16 @@
 from django.core.files.uploadedfile import InMemoryUploadedFile
 from urllib.request import urlopen
 from django.core.files import File
-from rest_framework import serializers
-from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework import exceptions, serializers
+from rest_framework_simplejwt.serializers import TokenObtainSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from django.contrib.auth import get_user_model
-from .models import Customer, OptionValue, Order, OrderItem, Product, Collection, ProductImage, ProductOption, ProductVariant, Shop
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError as DjangoValidationError
+from .authentication import ShopRefreshToken, issue_tokens, owned_shop, password_reset_user, send_password_reset
+from .catalog import create_options, create_variants, stage_product_images, sync_collections, sync_images, sync_options, sync_variants
+from .models import CatalogImport, Customer, CustomerAddress, CustomerImport, Job, OptionValue, Order, OrderItem, Product, Collection, ProductImage, ProductOption, ProductVariant, Shop
+from .orders import place_order
 from django.core.files.base import ContentFile
 
 User = get_user_model()
@@ -24,37 +29,118 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ['id', 'email', 'is_shop_owner', 'shop']
 
+class CustomerAddressSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomerAddress
+        fields = ['id', 'street_address', 'city', 'state', 'country', 'zip_code']
+
 class CustomerSerializer(serializers.ModelSerializer):
+    addresses = CustomerAddressSerializer(many=True, read_only=True)
+    default_address = CustomerAddressSerializer(read_only=True)
+    orders_count = serializers.IntegerField(read_only=True)
+    total_spent = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    last_order_at = serializers.DateTimeField(read_only=True)
+
     class Meta:
         model = Customer
-        fields = ['customer_id', 'email', 'first_name', 'last_name', 'is_shop_owner', 'addresses', 'accepts_marketing']
+        fields = ['customer_id', 'email', 'first_name', 'last_name', 'is_shop_owner', 'addresses', 'default_address',
+                  'accepts_marketing', 'orders_count', 'total_spent', 'last_order_at']
+
+class TokenField(serializers.Field):
+    """
+    The access token for the user being serialized, minted with its refresh
+    token by issue_tokens unless the view already did.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(source='*', read_only=True, **kwargs)
+
+    def to_representation(self, user):
+        tokens = self.context.get('tokens') or issue_tokens(user)
+        return tokens['access']
 
 class UserSerializerWithToken(serializers.ModelSerializer):
-    token = serializers.SerializerMethodField(read_only=True)
+    token = TokenField()
     shop = ShopSignUpSerializer(read_only=True)
 
     class Meta:
         model = User
         fields = ['id', 'email', 'is_shop_owner', 'shop', 'token']
 
-    def get_token(self, obj):
-        token = RefreshToken.for_user(obj)
-        return str(token.access_token)
+class MyTokenObtainPairSerializer(TokenObtainSerializer):
+    token_class = ShopRefreshToken
 
-class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
     def validate(self, attrs):
-        data = super().validate(attrs)
+        # Authenticates and sets self.user; tokens are minted once, below.
+        try:
+            super().validate(attrs)
+        except exceptions.AuthenticationFailed:
+            # Imported accounts have no password until their holder picks one.
+            email = User.objects.normalize_email(attrs.get(self.username_field) or '')
+            if User.objects.filter(email=email, password_reset_required=True, is_active=True).exists():
+                # The code is in the body, as simplejwt's token errors have it, for clients to act on.
+                raise exceptions.AuthenticationFailed({
+                    'detail': 'This account needs a new password; request a password reset.',
+                    'code': 'password_reset_required',
+                })
+            raise
+        owned_shop(self.user)
+        tokens = issue_tokens(self.user)
+        data = dict(tokens)
+        data.update(UserSerializerWithToken(self.user, context={'tokens': tokens}).data)
+        return data
 
-        serializer = UserSerializerWithToken(self.user).data
-        for k, v in serializer.items():
-            data[k] = v
+class ShopTokenRefreshSerializer(serializers.Serializer):
+    """
+    Swaps a refresh token for a new pair minted from the user's current
+    row, so a deactivated account is refused and changed claims are
+    picked up. Copying the old token's claims would keep them forever.
+    """
+    refresh = serializers.CharField()
+    access = serializers.CharField(read_only=True)
 
-        return data
+    def validate(self, attrs):
+        # Raises TokenError, which the view turns into a 401.
+        refresh = ShopRefreshToken(attrs['refresh'])
+        user = User.objects.filter(**{jwt_settings.USER_ID_FIELD: refresh[jwt_settings.USER_ID_CLAIM]}).first()
+        if user is None or not jwt_settings.USER_AUTHENTICATION_RULE(user):
+            raise exceptions.AuthenticationFailed('No active account found for this token.', code='no_active_account')
+        return issue_tokens(user)
+
+class PasswordResetSerializer(serializers.Serializer):
+    email = serializers.EmailField()
+
+    def save(self):
+        user = User.objects.filter(email=User.objects.normalize_email(self.validated_data['email']), is_active=True).first()
+        # Nothing tells the caller whether the email has an account.
+        if user is not None:
+            send_password_reset(user)
+
+class PasswordResetConfirmSerializer(serializers.Serializer):
+    uid = serializers.CharField()
+    token = serializers.CharField()
+    password = serializers.CharField(max_length=128, write_only=True)
+
+    def validate(self, attrs):
+        attrs['user'] = password_reset_user(attrs['uid'], attrs['token'])
+        if attrs['user'] is None:
+            raise serializers.ValidationError({'token': 'This link is invalid or has expired.'})
+        try:
+            validate_password(attrs['password'], attrs['user'])
+        except DjangoValidationError as e:
+            raise serializers.ValidationError({'password': list(e.messages)})
+        return attrs
+
+    def save(self):
+        user = self.validated_data['user']
+        user.set_password(self.validated_data['password'])
+        user.password_reset_required = False
+        user.save(update_fields=['password', 'password_reset_required'])
+        return user
 
 class ShopOwnerSignUpSerializer(serializers.ModelSerializer):
     password = serializers.CharField(max_length=128, write_only=True)
     shop = ShopSignUpSerializer(required=True)
-    token = serializers.SerializerMethodField(read_only=True)
+    token = TokenField()
 
     class Meta:
         model = User
@@ -65,31 +151,28 @@ class ShopOwnerSignUpSerializer(serializers.ModelSerializer):
             'email': {'required': True},
         }
     
-    def get_token(self, obj):
-        token = RefreshToken.for_user(obj)
-        return str(token.access_token)
-
     def create(self, validated_data):
         shop_data = validated_data.pop('shop')
-        user = User.objects.create(
+        # Hashed before the one INSERT.
+        user = User.objects.create_user(
             email=validated_data['email'],
+            password=validated_data['password'],
             is_shop_owner=True,
             is_staff = True,
         )
-        user.set_password(validated_data['password'])
         Shop.objects.create(
             name = shop_data['name'],
             myjamly_domain = shop_data['myjamly_domain'],
             owner = user
         )
-        #user.shops.add(shop)
-        user.save()
         return user
 
 class CustomerSignUpSerializer(serializers.ModelSerializer):
     password = serializers.CharField(max_length=128, write_only=True)
-    shop = serializers.PrimaryKeyRelatedField(queryset=Shop.objects.all())
-    token = serializers.SerializerMethodField(read_only=True)
+    # Customers belong to shops through `shops`; User.shop is the shop a user owns.
+    shop = serializers.PrimaryKeyRelatedField(queryset=Shop.objects.all(), source='signup_shop')
+    token = TokenField()
+    addresses = CustomerAddressSerializer(many=True, read_only=True)
 
     class Meta:
         model = Customer
@@ -101,20 +184,16 @@ class CustomerSignUpSerializer(serializers.ModelSerializer):
             'email': {'required': True},
         }
     
-    def get_token(self, obj):
-        token = RefreshToken.for_user(obj)
-        return str(token.access_token)
-
     def create(self, validated_data):
-        shop = validated_data['shop']
-        user = Customer.objects.create(
+        shop = validated_data['signup_shop']
+        # Hashed before the one INSERT.
+        user = Customer.objects.create_user(
             email=validated_data['email'],
+            password=validated_data['password'],
             is_shop_owner=False,
-            shop=shop,
         )
-        user.set_password(validated_data['password'])
+        user.signup_shop = shop
         user.shops.add(shop)
-        user.save()
         return user
 
 class ShopSerializer(serializers.ModelSerializer):
@@ -146,6 +225,8 @@ class OptionValueSerializer(serializers.ModelSerializer):
         fields = ('name',)
 
 class ProductOptionSerializer(serializers.ModelSerializer):
+    # Writable so nested updates can match stored options by id; the key itself is never changed.
+    id = serializers.IntegerField(required=False)
     values = OptionValueSerializer(many=True)
 
     class Meta:
@@ -157,6 +238,7 @@ class ProductOptionSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         values_data = validated_data.pop('values')
+        validated_data.pop('id', None)
         option = ProductOption.objects.create(**validated_data)
         for value_data in values_data:
             OptionValue.objects.create(option=option, **value_data)
@@ -180,6 +262,8 @@ class ProductOptionSerializer(serializers.ModelSerializer):
         return instance
 
 class ProductVariantSerializer(serializers.ModelSerializer):
+    # Writable so nested updates can match stored variants by id; the key itself is never changed.
+    id = serializers.IntegerField(required=False)
     values = OptionValueSerializer(many=True)
 
     class Meta:
@@ -188,9 +272,10 @@ class ProductVariantSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         values_data = validated_data.pop('values')
+        validated_data.pop('id', None)
         variant = ProductVariant.objects.create(**validated_data)
         for value_data in values_data:
-            value = OptionValue.objects.get(name=value_data['name'])
+            value = OptionValue.objects.get(option__product_id=variant.product_id, name=value_data['name'])
             variant.values.add(value)
         return variant
 
@@ -205,20 +290,45 @@ class ProductVariantSerializer(serializers.ModelSerializer):
         instance.values.clear()
         for value_data in values_data:
             if 'name' in value_data:
-                value = OptionValue.objects.get(name=value_data['name'])
+                value = OptionValue.objects.get(option__product_id=instance.product_id, name=value_data['name'])
                 instance.values.add(value)
         return instance
 
+class RenditionsField(serializers.ReadOnlyField):
+    """
+    Stored rendition names as URLs: {'thumb': {'webp': url, 'jpeg': url}, ...}.
+    """
+
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        super().__init__(**kwargs)
+
+    def to_representation(self, renditions):
+        storage = self.parent.Meta.model._meta.get_field(self.image_field).storage
+        request = self.context.get('request')
+        urls = {}
+        for size, names in renditions.items():
+            if size == 'source':
+                continue
+            urls[size] = {}
+            for image_format, name in names.items():
+                url = storage.url(name)
+                urls[size][image_format] = request.build_absolute_uri(url) if request else url
+        return urls
+
 class ProductImageSerializer(serializers.ModelSerializer):
+    renditions = RenditionsField('image')
+
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'renditions']
 
 class ProductSerializer(serializers.ModelSerializer):
     collections = serializers.PrimaryKeyRelatedField(queryset=Collection.objects.all(), many=True, required=False)
     options = ProductOptionSerializer(many=True, required=False)
     variants = ProductVariantSerializer(many=True, required=False)
     images = ProductImageSerializer(many=True, read_only=True)
+    thumbnail_renditions = RenditionsField('thumbnail')
     uploaded_images = serializers.ListField(
         child = serializers.ImageField(max_length=1000000, allow_empty_file=False),
         write_only = True,
@@ -228,7 +338,7 @@ class ProductSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Product
-        fields = ['id', 'shop', 'name', 'handle', 'description', 'price', 'status', 'thumbnail', 'weight', 'length', 'height', 'width', 'collections', 'options', 'variants', 'images', 'uploaded_images',]
+        fields = ['id', 'shop', 'name', 'handle', 'description', 'price', 'status', 'thumbnail', 'thumbnail_renditions', 'weight', 'length', 'height', 'width', 'collections', 'options', 'variants', 'images', 'uploaded_images',]
 
     def create(self, validated_data):
         images_data = validated_data.pop('uploaded_images', [])
@@ -236,70 +346,51 @@ class ProductSerializer(serializers.ModelSerializer):
         options_data = validated_data.pop('options', [])
         variants_data = validated_data.pop('variants', [])
         product = Product.objects.create(**validated_data)
+        product.image_jobs = stage_product_images(product, images_data)
         
-        for image_data in images_data:
-            #image = ContentFile(image_data.read())
-            ProductImage.objects.create(product=product, image=image_data)
-        
-        for collection_data in collections_data:
-            product.collections.add(collection_data)
-        
-        for option_data in options_data:
-            values_data = option_data.pop('values', [])
-            option = ProductOption.objects.create(product=product, **option_data)
-            for value_data in values_data:
-                OptionValue.objects.create(option=option, **value_data)
-
-        for variant_data in variants_data:
-            values_data = validated_data.pop('values', [])
-            variant = ProductVariant.objects.create(product=product, **validated_data)
-            for value_data in values_data:
-                value = OptionValue.objects.get(name=value_data['name'])
-                variant.values.add(value)
+        if collections_data:
+            product.collections.add(*collections_data)
         
+        values = create_options(product, options_data)
+        create_variants(product, variants_data, values)
         
         return product
     
     def update(self, instance, validated_data):
-        collections_data = validated_data.pop('collections')
-        images_data = validated_data.pop('uploaded_images')
-        options_data = validated_data.pop('options', [])
-        variants_data = validated_data.pop('variants', [])
-
-        instance.name = validated_data.get('name', instance.name)
-        instance.price = validated_data.get('price', instance.price)
-        instance.description = validated_data.get('description', instance.description)
-        instance.handle = validated_data.get('handle', instance.handle)
-        instance.status = validated_data.get('status', instance.status)
-        instance.thumbnail = validated_data.get('thumbnail', instance.thumbnail)
-        instance.weight = validated_data.get('weight', instance.weight)
-        instance.length = validated_data.get('length', instance.length)
-        instance.height = validated_data.get('height', instance.height)
-        instance.width = validated_data.get('width', instance.width)
-        instance.save()
-
-        instance.collections.clear()
-        for collection_data in collections_data:
-            instance.collections.add(collection_data)
-
-        instance.images.all().delete()
-        for image_data in images_data:
-            ProductImage.objects.create(product=instance, image=image_data)
-
-        instance.options.all().delete()
-        for option_data in options_data:
-            values_data = option_data.pop('values', [])
-            option = ProductOption.objects.create(product=instance, **option_data)
-            for value_data in values_data:
-                OptionValue.objects.create(option=option, **value_data)
-
-        instance.variants.all().delete()
-        for variant_data in variants_data:
-            values_data = validated_data.pop('values', [])
-            variant = ProductVariant.objects.create(product=instance, **validated_data)
-            for value_data in values_data:
-                value = OptionValue.objects.get(name=value_data['name'])
-                variant.values.add(value)        
+        """
+        Reconciles the product with the incoming data, touching only the rows
+        that changed. Relations left out of the data are left alone; pass
+        `retained_images` (ids) to drop the images not listed. New uploads
+        are stored in the background.
+        """
+        collections_data = validated_data.pop('collections', None)
+        images_data = validated_data.pop('uploaded_images', [])
+        retained_images = validated_data.pop('retained_images', None)
+        options_data = validated_data.pop('options', None)
+        variants_data = validated_data.pop('variants', None)
+
+        changed_fields = []
+        for field in ('name', 'price', 'description', 'handle', 'status', 'thumbnail', 'weight', 'length', 'height', 'width'):
+            if field in validated_data and validated_data[field] != getattr(instance, field):
+                setattr(instance, field, validated_data[field])
+                changed_fields.append(field)
+
+        children_changed = False
+        if collections_data is not None:
+            children_changed |= sync_collections(instance, collections_data)
+        children_changed |= sync_images(instance, retained_images)
+        instance.image_jobs = stage_product_images(instance, images_data)
+        values = None
+        if options_data is not None:
+            options_changed, values = sync_options(instance, options_data)
+            children_changed |= options_changed
+        if variants_data is not None:
+            children_changed |= sync_variants(instance, variants_data, values)
+
+        # Bulk writes skip signals; saving the product bumps updated_at and
+        # invalidates the storefront for all of them at once.
+        if changed_fields or children_changed:
+            instance.save(update_fields=changed_fields + ['updated_at'])
 
         return instance
 
@@ -352,14 +443,16 @@ class ProductOptionSerializer(serializers.ModelSerializer):
 class SimpleProductSerializer(serializers.ModelSerializer):
     variants = ProductVariantSerializer(many=True, required=False)
     images = ProductImageSerializer(many=True, read_only=True)
+    thumbnail_renditions = RenditionsField('thumbnail')
     class Meta:
         model = Product
-        fields = ['id', 'name', 'handle', 'price', 'thumbnail', 'images', 'variants']
+        fields = ['id', 'name', 'handle', 'price', 'thumbnail', 'thumbnail_renditions', 'images', 'variants']
         read_only_fields = ['id', 'thumbnail']
 
 class CollectionSerializer(serializers.ModelSerializer):
     products = SimpleProductSerializer(many=True, required=False)
     image = serializers.ImageField(required=False)
+    image_renditions = RenditionsField('image')
 
     class Meta:
         model = Collection
@@ -369,7 +462,7 @@ class CollectionSerializer(serializers.ModelSerializer):
         products_data = validated_data.pop('products', [])
         collection = Collection.objects.create(**validated_data)
         for product_data in products_data:
-            product = Product.objects.get(name=product_data['name'])
+            product = Product.objects.get(shop_id=collection.shop_id, name=product_data['name'])
             collection.products.add(product)
         return collection
 
@@ -385,26 +478,73 @@ class CollectionSerializer(serializers.ModelSerializer):
         print(products_data)
         for product_data in products_data:
             #print(product_data)
-            product = Product.objects.get(name=product_data['name'])
+            product = Product.objects.get(shop_id=instance.shop_id, name=product_data['name'])
             instance.products.add(product)
         return instance
     
 class OrderItemSerializer(serializers.ModelSerializer):
+    # Plain ids: place_order checks them all in one query instead of one lookup per line.
+    product = serializers.IntegerField(source='product_id', required=False)
+    variant = serializers.IntegerField(source='variant_id', required=False, allow_null=True)
+
     class Meta:
         model = OrderItem
-        fields = ('product', 'variant', 'quantity', 'price')
+        fields = ('product', 'variant', 'quantity', 'price', 'line_total')
+        # Prices come from the catalogue when the order is placed.
+        read_only_fields = ('price', 'line_total')
+        extra_kwargs = {'quantity': {'min_value': 1}}
 
 class OrderSerializer(serializers.ModelSerializer):
-    items = OrderItemSerializer(many=True)
+    items = OrderItemSerializer(many=True, allow_empty=False)
     
     class Meta:
         model = Order
-        fields = ('id', 'customer', 'status', 'created_at', 'fulfilled', 'items', 'get_total_cost')
-        read_only_fields = ('id', 'created_at')
+        fields = ('id', 'customer', 'shop', 'shipping_address', 'status', 'created_at', 'fulfilled', 'items',
+                  'item_count', 'subtotal', 'total_price', 'get_total_cost')
+        read_only_fields = ('id', 'created_at', 'status', 'fulfilled', 'item_count', 'subtotal', 'total_price')
+        extra_kwargs = {'shop': {'required': True, 'allow_null': False}}
 
     def create(self, validated_data):
         items_data = validated_data.pop('items')
-        order = Order.objects.create(**validated_data)
-        for item_data in items_data:
-            OrderItem.objects.create(order=order, **item_data)
-        return order
\ No newline at end of file
+        order = place_order(validated_data.pop('customer'), validated_data.pop('shop'), items_data, **validated_data)
+        return Order.objects.prefetch_related('items').get(id=order.id)
+
+class CatalogImportSerializer(serializers.ModelSerializer):
+    format = serializers.ChoiceField(choices=CatalogImport.IMPORT_FORMAT, required=False)
+
+    class Meta:
+        model = CatalogImport
+        fields = '__all__'
+        read_only_fields = ('id', 'shop', 'status', 'rows', 'products_created', 'variants_created',
+                            'error_count', 'errors', 'rows_per_second', 'created_at', 'finished_at')
+
+    def validate(self, attrs):
+        if not attrs.get('format'):
+            extension = attrs['file'].name.rsplit('.', 1)[-1].lower()
+            if extension not in dict(CatalogImport.IMPORT_FORMAT):
+                raise serializers.ValidationError({'format': 'Cannot tell the format from the file name.'})
+            attrs['format'] = extension
+        return attrs
+
+class CustomerImportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomerImport
+        fields = '__all__'
+        read_only_fields = ('id', 'shop', 'status', 'rows', 'customers_created', 'addresses_created',
+                            'error_count', 'errors', 'rows_per_second', 'created_at', 'finished_at')
+
+    def validate_file(self, file):
+        if not file.name.lower().endswith('.csv'):
+            raise serializers.ValidationError('Upload a CSV file.')
+        return file
+
+class JobSerializer(serializers.ModelSerializer):
+    error = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = ('id', 'kind', 'status', 'attempts', 'result', 'error', 'created_at', 'started_at', 'finished_at')
+
+    def get_error(self, obj):
+        # The last line of the traceback; the rest stays in the admin.
+        return obj.error.strip().splitlines()[-1] if obj.error else None
@@ -0,0 +1,183 @@
+from django.db.models import F, Sum
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .caching import invalidate_storefront, invalidate_storefront_for_shop
+from .models import Collection, OptionValue, Order, OrderItem, Product, ProductImage, ProductOption, ProductVariant, Shop, ShopDailySales
+
+
+#####CATALOG CHANGES#####
+# Edits to a product's parts touch the product's updated_at so conditional
+# GETs see them, and every catalog edit drops the shop's cached storefront.
+@receiver(pre_save, sender=Shop)
+def shop_saving(sender, instance, **kwargs):
+    # A renamed domain must drop the storefront cached under the old name.
+    instance._old_domain = Shop.objects.filter(id=instance.id).values_list('myjamly_domain', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=Shop)
+def shop_changed(sender, instance, **kwargs):
+    old_domain = instance.__dict__.pop('_old_domain', None)
+    if old_domain != instance.myjamly_domain:
+        invalidate_storefront(old_domain)
+    invalidate_storefront(instance.myjamly_domain)
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Collection)
+def catalog_changed(sender, instance, **kwargs):
+    invalidate_storefront_for_shop(instance.shop_id)
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=ProductOption)
+@receiver([post_save, post_delete], sender=ProductVariant)
+def product_part_changed(sender, instance, **kwargs):
+    Product.objects.filter(id=instance.product_id).update(updated_at=timezone.now())
+    invalidate_storefront_for_shop(
+        Product.objects.filter(id=instance.product_id).values('shop_id')[:1]
+    )
+
+
+@receiver([post_save, post_delete], sender=OptionValue)
+def option_value_changed(sender, instance, **kwargs):
+    Product.objects.filter(options=instance.option_id).update(updated_at=timezone.now())
+    invalidate_storefront_for_shop(
+        ProductOption.objects.filter(id=instance.option_id).values('product__shop_id')[:1]
+    )
+
+
+@receiver(pre_delete, sender=Collection)
+def collection_deleting(sender, instance, **kwargs):
+    # The cascade to the membership rows sends no m2m_changed.
+    Product.objects.filter(collections=instance).update(updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=Product.collections.through)
+def collection_membership_changed(sender, instance, action, model, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    now = timezone.now()
+    type(instance).objects.filter(id=instance.id).update(updated_at=now)
+    if pk_set:
+        model.objects.filter(id__in=pk_set).update(updated_at=now)
+    invalidate_storefront_for_shop(instance.shop_id)
+
+
+@receiver(m2m_changed, sender=ProductVariant.values.through)
+def variant_values_changed(sender, instance, action, reverse, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        option_value_changed(sender, instance)
+    else:
+        product_part_changed(sender, instance)
+
+
+#####SALES ROLLUP#####
+# ShopDailySales is adjusted by deltas as orders and their lines are written.
+# The values an instance was loaded with are stashed on it so changes can be
+# diffed without re-reading the row.
+def counts_as_sale(status):
+    return status != 'CANCELLED'
+
+
+def record_order(order, sign=1, units=None):
+    if units is None:
+        units = order.items.aggregate(units=Sum('quantity'))['units'] or 0
+    ShopDailySales.record(
+        order.shop_id, timezone.localdate(order.created_at),
+        order_count=sign, gross_revenue=sign * order.total_price, units=sign * units,
+    )
+
+
+@receiver(post_init, sender=Order)
+def order_loaded(sender, instance, **kwargs):
+    instance._sales_state = (instance.__dict__.get('status'), instance.__dict__.get('total_price'))
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, **kwargs):
+    old_status, old_total = instance._sales_state
+    instance._sales_state = (instance.status, instance.total_price)
+    if created:
+        if counts_as_sale(instance.status):
+            record_order(instance, units=0)
+        return
+
+    was_sale, is_sale = counts_as_sale(old_status), counts_as_sale(instance.status)
+    if was_sale and not is_sale:
+        ShopDailySales.record(
+            instance.shop_id, timezone.localdate(instance.created_at),
+            order_count=-1, gross_revenue=-old_total,
+            units=-(instance.items.aggregate(units=Sum('quantity'))['units'] or 0),
+        )
+    elif is_sale and not was_sale:
+        record_order(instance)
+    elif is_sale and instance.total_price != old_total:
+        ShopDailySales.record(
+            instance.shop_id, timezone.localdate(instance.created_at),
+            gross_revenue=instance.total_price - old_total,
+        )
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    # The lines are deleted first and take their units with them.
+    old_status, old_total = instance._sales_state
+    if counts_as_sale(old_status):
+        ShopDailySales.record(
+            instance.shop_id, timezone.localdate(instance.created_at),
+            order_count=-1, gross_revenue=-old_total,
+        )
+
+
+@receiver(post_init, sender=OrderItem)
+def order_item_loaded(sender, instance, **kwargs):
+    instance._sales_quantity = instance.__dict__.get('quantity')
+
+
+def record_units(item, units):
+    order = Order.objects.filter(id=item.order_id).values('shop_id', 'status', 'created_at').first()
+    if units and order and counts_as_sale(order['status']):
+        ShopDailySales.record(order['shop_id'], timezone.localdate(order['created_at']), units=units)
+
+
+@receiver(post_save, sender=OrderItem)
+def order_item_saved(sender, instance, created, **kwargs):
+    old_quantity = 0 if created else instance._sales_quantity
+    instance._sales_quantity = instance.quantity
+    record_units(instance, instance.quantity - old_quantity)
+
+
+@receiver(post_delete, sender=OrderItem)
+def order_item_deleted(sender, instance, **kwargs):
+    record_units(instance, -instance._sales_quantity)
+
+
+#####ORDER TOTALS#####
+# Order.subtotal and item_count follow their lines by the same kind of deltas.
+@receiver(post_init, sender=OrderItem)
+def order_item_line_loaded(sender, instance, **kwargs):
+    instance._line_state = (instance.__dict__.get('quantity') or 0, instance.__dict__.get('line_total') or 0)
+
+
+def add_to_order(order_id, quantity, amount):
+    if quantity or amount:
+        Order.objects.filter(id=order_id).update(
+            item_count=F('item_count') + quantity, subtotal=F('subtotal') + amount,
+        )
+
+
+@receiver(post_save, sender=OrderItem)
+def order_item_line_saved(sender, instance, created, **kwargs):
+    old_quantity, old_total = (0, 0) if created else instance._line_state
+    instance._line_state = (instance.quantity, instance.line_total)
+    add_to_order(instance.order_id, instance.quantity - old_quantity, instance.line_total - old_total)
+
+
+@receiver(post_delete, sender=OrderItem)
+def order_item_line_deleted(sender, instance, **kwargs):
+    old_quantity, old_total = instance._line_state
+    add_to_order(instance.order_id, -old_quantity, -old_total)
@@ -1,3 +1,1293 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+import asyncio
+import io
+import itertools
+import json
+import os
+import re
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.hashers import make_password
+from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache import cache
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import cached_user
+from .caching import storefront_cache_stats
+from .catalog import sync_options
+from .checks import check_shared_cache
+from .db import database_sync_to_async
+from .ids import SnowflakeGenerator, id_timestamp
+from .images import RENDITION_FORMATS, RENDITION_SIZES
+from .importers import import_catalog, import_customers, run_customer_import
+from .jobs import TASKS, claim, enqueue, requeue_stale, run, run_pending, task
+from .models import CatalogImport, Collection, Customer, CustomerAddress, CustomerImport, Job, Order, OrderItem, OptionValue, Product, ProductImage, ProductOption, ProductVariant, Shop, ShopDailySales, User
+from .serializers import JobSerializer, ProductSerializer
+
+
+def create_shop(domain='teststore'):
+    owner = User.objects.create_user(email=f'owner@{domain}.com', password='secret', is_shop_owner=True)
+    return Shop.objects.create(name=domain, myjamly_domain=domain, owner=owner)
+
+
+def create_product(shop, name, collections=(), variants=2):
+    product = Product.objects.create(shop=shop, name=name, handle=name, price=10)
+    ProductImage.objects.create(product=product)
+    option = ProductOption.objects.create(product=product, name='Size')
+    values = [OptionValue.objects.create(option=option, name=f'S{i}') for i in range(variants)]
+    for value in values:
+        variant = ProductVariant.objects.create(product=product, name=f'{name} {value.name}', price=10, inventory=5)
+        variant.values.add(value)
+    product.collections.add(*collections)
+    return product
+
+
+@override_settings(ASYNC_CONCURRENT_QUERIES=False)
+class StorefrontQueryCountTest(TestCase):
+    # 13 to render the page plus 3 for the ETag/Last-Modified validators.
+    MAX_QUERIES = 16
+
+    def setUp(self):
+        cache.clear()
+
+    def storefront_queries(self, shop):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('storefront', args=[shop.myjamly_domain]))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_is_bounded(self):
+        shop = create_shop()
+        collection = Collection.objects.create(shop=shop, name='All', handle='all')
+        create_product(shop, 'first', collections=[collection])
+        small = self.storefront_queries(shop)
+
+        for i in range(3):
+            extra = Collection.objects.create(shop=shop, name=f'c{i}', handle=f'c{i}')
+            for j in range(4):
+                create_product(shop, f'p{i}-{j}', collections=[collection, extra], variants=4)
+        large = self.storefront_queries(shop)
+
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, self.MAX_QUERIES)
+
+
+@override_settings(ASYNC_CONCURRENT_QUERIES=False)
+class StorefrontCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shop = create_shop()
+        self.product = create_product(self.shop, 'shirt')
+        self.url = reverse('storefront', args=[self.shop.myjamly_domain])
+
+    def test_second_request_is_served_from_cache(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(storefront_cache_stats()['hits'], 1)
+        self.assertEqual(storefront_cache_stats()['misses'], 1)
+
+    def test_catalog_writes_invalidate(self):
+        self.client.get(self.url)
+        variant = self.product.variants.first()
+        variant.price = 99
+        variant.save()
+        self.assertIn(b'99.00', self.client.get(self.url).content)
+
+        OptionValue.objects.filter(option__product=self.product).first().delete()
+        Collection.objects.create(shop=self.shop, name='Sale', handle='sale')
+        self.assertIn(b'Sale', self.client.get(self.url).content)
+        self.assertEqual(storefront_cache_stats()['hits'], 0)
+
+    def test_changing_the_domain_invalidates_the_old_one(self):
+        self.client.get(self.url)
+        self.shop.myjamly_domain = 'renamed'
+        self.shop.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_deploy_requires_a_shared_cache(self):
+        self.assertEqual([e.id for e in check_shared_cache(None)], ['base.E001'])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+@override_settings(ASYNC_CONCURRENT_QUERIES=False)
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shop = create_shop()
+        self.product = create_product(self.shop, 'shirt')
+
+    def assertRevalidates(self, url, touch, queries=1):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with self.assertNumQueries(queries):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+
+        touch()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def touch_variant(self):
+        variant = self.product.variants.first()
+        variant.price = 42
+        variant.save()
+
+    def test_product_list(self):
+        url = reverse('product-list', args=[self.shop.id])
+        self.assertRevalidates(url, self.touch_variant)
+
+    def test_product_detail(self):
+        url = reverse('product-detail', args=[self.shop.id, self.product.handle])
+        self.assertRevalidates(url, self.touch_variant)
+
+    def test_deleting_a_collection_changes_its_products(self):
+        for url in (reverse('product-list', args=[self.shop.id]),
+                    reverse('product-detail', args=[self.shop.id, self.product.handle])):
+            collection = Collection.objects.create(shop=self.shop, name='All', handle='all')
+            self.product.collections.add(collection)
+            self.assertRevalidates(url, collection.delete)
+
+    def test_collection_list(self):
+        collection = Collection.objects.create(shop=self.shop, name='All', handle='all')
+        url = reverse('collection-list', args=[self.shop.id])
+        self.assertRevalidates(url, lambda: self.product.collections.add(collection), queries=2)
+
+    def test_storefront(self):
+        url = reverse('storefront', args=[self.shop.myjamly_domain])
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.product.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class KeysetPaginationTest(TestCase):
+    def test_walks_products_newest_first_and_back(self):
+        shop = create_shop()
+        products = [Product.objects.create(shop=shop, name=f'p{i}', handle=f'p{i}') for i in range(5)]
+        # Identical timestamps must still page on id without gaps or repeats.
+        Product.objects.filter(id__in=[p.id for p in products[:3]]).update(created_at=products[0].created_at)
+        expected = list(Product.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+        url = reverse('product-list', args=[shop.id]) + '?page_size=2'
+        seen, pages = [], []
+        while url:
+            page = self.client.get(url).json()
+            pages.append(page)
+            seen += [p['id'] for p in page['results']]
+            url = page['next']
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(pages), 3)
+
+        previous = self.client.get(pages[-1]['previous']).json()
+        self.assertEqual(previous['results'], pages[1]['results'])
+        junk = reverse('product-list', args=[shop.id]) + '?cursor=junk'
+        self.assertEqual(self.client.get(junk).status_code, 404)
+
+
+def place_order(shop, customer, variant, quantity=1):
+    order = Order.objects.create(shop=shop, customer=customer, total_price=variant.price * quantity)
+    OrderItem.objects.create(order=order, product=variant.product, variant=variant, quantity=quantity, price=variant.price)
+    return order
+
+
+class ShopDashboardTest(TestCase):
+    def test_kpis_use_constant_queries(self):
+        shop = create_shop()
+        customer = Customer.objects.create(email='buyer@example.com')
+        customer.shops.add(shop)
+        url = reverse('get_store', args=[shop.owner_id])
+        self.client = APIClient()
+        self.client.force_authenticate(shop.owner)
+
+        def dashboard():
+            with CaptureQueriesContext(connection) as ctx:
+                data = self.client.get(url).json()
+            return data, len(ctx.captured_queries)
+
+        product = create_product(shop, 'shirt')
+        place_order(shop, customer, product.variants.first(), quantity=2)
+        small, small_queries = dashboard()
+
+        for i in range(5):
+            product = create_product(shop, f'p{i}')
+            place_order(shop, customer, product.variants.first())
+        large, large_queries = dashboard()
+
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(large['num_orders'], 6)
+        self.assertEqual(large['num_open_orders'], 6)
+        self.assertEqual(large['num_customers'], 1)
+        self.assertEqual(large['num_products'], 6)
+        self.assertEqual(large['top_orders'][0]['name'], 'shirt')
+        self.assertEqual(large['top_orders'][0]['num_buys'], 2)
+        self.assertEqual(len(large['orders']['results']), 6)
+        self.assertEqual(sum(float(x) for x in large['thirty_day_sales']), 70)
+
+    def test_dashboard_and_orders_are_for_the_shop_owner(self):
+        shop = create_shop()
+        client = APIClient()
+        self.assertEqual(client.get(reverse('get_store', args=[shop.owner_id])).status_code, 401)
+        client.force_authenticate(create_shop('othershop').owner)
+        self.assertEqual(client.get(reverse('get_store', args=[shop.owner_id])).status_code, 403)
+        self.assertEqual(client.get(reverse('shop-orders', args=[shop.id])).status_code, 403)
+
+
+class ShopDailySalesTest(TestCase):
+    def rollup(self):
+        return list(ShopDailySales.objects.values_list('order_count', 'gross_revenue', 'units'))
+
+    def test_rollup_tracks_orders_and_matches_backfill(self):
+        shop = create_shop()
+        customer = Customer.objects.create(email='buyer@example.com')
+        variant = create_product(shop, 'shirt').variants.first()
+        place_order(shop, customer, variant, quantity=3)
+        cancelled = place_order(shop, customer, variant, quantity=2)
+        self.assertEqual(self.rollup(), [(2, 50, 5)])
+
+        cancelled.status = 'CANCELLED'
+        cancelled.save()
+        item = OrderItem.objects.get(order__status='PENDING')
+        item.quantity = 4
+        item.save()
+        self.assertEqual(self.rollup(), [(1, 30, 4)])
+
+        incremental = self.rollup()
+        call_command('backfill_daily_sales', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.rollup(), incremental)
+
+        Order.objects.all().delete()
+        self.assertEqual(self.rollup(), [(0, 0, 0)])
+
+    def test_shops_and_owners_with_orders_can_be_deleted(self):
+        customer = Customer.objects.create(email='buyer@example.com')
+        for domain in ('teststore', 'otherstore'):
+            shop = create_shop(domain)
+            place_order(shop, customer, create_product(shop, 'shirt').variants.first(), quantity=2)
+
+        Shop.objects.get(myjamly_domain='teststore').delete()
+        User.objects.get(email='owner@otherstore.com').delete()
+        self.assertFalse(Shop.objects.exists())
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.rollup(), [])
+
+
+class OrderTotalsTest(TestCase):
+    def test_totals_follow_lines_and_lists_skip_them(self):
+        shop = create_shop()
+        customer = Customer.objects.create(email='buyer@example.com')
+        variant = create_product(shop, 'shirt').variants.first()
+        order = place_order(shop, customer, variant, quantity=2)
+        extra = OrderItem.objects.create(order=order, product=variant.product, variant=variant, quantity=1, price=7)
+        extra.quantity = 3
+        extra.save()
+        order.status = 'PAID'
+        order.save()
+        order.refresh_from_db()
+        self.assertEqual((order.item_count, order.subtotal, order.get_total_cost()), (5, 41, 41))
+
+        extra.delete()
+        order.refresh_from_db()
+        self.assertEqual((order.item_count, order.subtotal), (2, 20))
+
+        Order.objects.update(subtotal=0, item_count=0)
+        OrderItem.objects.update(line_total=0)
+        call_command('backfill_order_totals', stdout=open(os.devnull, 'w'))
+        order.refresh_from_db()
+        self.assertEqual((order.item_count, order.subtotal), (2, 20))
+
+        url = reverse('shop-orders', args=[shop.id])
+        self.client = APIClient()
+        self.client.force_authenticate(shop.owner)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        for _ in range(5):
+            place_order(shop, customer, variant)
+        with CaptureQueriesContext(connection) as many:
+            data = self.client.get(url).json()
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(sorted(Decimal(row['get_total_cost']) for row in data['results']), [10] * 5 + [20])
+
+
+class OrderPlacementTest(TestCase):
+    def setUp(self):
+        self.shop = create_shop()
+        self.customer = Customer.objects.create(email='buyer@example.com')
+        self.url = reverse('place_order', args=[self.customer.pk])
+        self.client = APIClient()
+
+    def place(self, items):
+        return self.client.post(self.url, {'shop': self.shop.id, 'items': items}, format='json')
+
+    def test_order_is_priced_and_stock_reserved_in_constant_queries(self):
+        def checkout(variants):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.place([{'variant': variant.id, 'quantity': 2, 'price': '0.01'} for variant in variants])
+            self.assertEqual(response.status_code, 201, response.data)
+            return response.data, len(ctx.captured_queries)
+
+        product = create_product(self.shop, 'shirt', variants=1)
+        checkout(product.variants.all())  # Creates the day's sales row.
+        small, small_queries = checkout(product.variants.all())
+        products = [create_product(self.shop, f'p{i}', variants=3) for i in range(2)]
+        large, large_queries = checkout(ProductVariant.objects.filter(product__in=products))
+
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(Decimal(large['total_price']), 6 * 2 * 10)
+        self.assertEqual({item['price'] for item in large['items']}, {'10.00'})
+        self.assertEqual(set(ProductVariant.objects.filter(product__in=products).values_list('inventory', flat=True)), {3})
+        self.assertEqual(list(ShopDailySales.objects.values_list('order_count', 'gross_revenue', 'units')), [(3, 160, 16)])
+
+    def test_out_of_stock_order_writes_nothing(self):
+        first, second = create_product(self.shop, 'shirt').variants.all()
+        response = self.place([{'variant': first.id, 'quantity': 1}, {'variant': second.id, 'quantity': 6}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(second.id), response.data['items'])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(ProductVariant.objects.get(id=first.id).inventory, 5)
+
+        # Repeated lines for one variant count together.
+        response = self.place([{'variant': first.id, 'quantity': 3}, {'variant': first.id, 'quantity': 3}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.place([{'variant': first.id, 'quantity': 5}]).status_code, 201)
+        self.assertEqual(ProductVariant.objects.get(id=first.id).inventory, 0)
+
+    @override_settings(ASYNC_CONCURRENT_QUERIES=False)
+    def test_storefront_cache_is_kept_until_a_variant_sells_out(self):
+        variant = create_product(self.shop, 'shirt').variants.first()
+        url = reverse('storefront', args=[self.shop.myjamly_domain])
+        cache.clear()
+        self.client.get(url)
+        self.assertEqual(self.place([{'variant': variant.id, 'quantity': 3}]).status_code, 201)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        self.assertEqual(self.place([{'variant': variant.id, 'quantity': 2}]).status_code, 201)
+        self.assertIn(b'"inventory":0', self.client.get(url).content)
+
+    def test_products_with_variants_or_unpublished_are_rejected(self):
+        shirt = create_product(self.shop, 'shirt')
+        draft = create_product(self.shop, 'draft')
+        Product.objects.filter(id=draft.id).update(status='DRAFT')
+        poster = Product.objects.create(shop=self.shop, name='poster', handle='poster', price=4)
+
+        for items in ([{'product': shirt.id, 'quantity': 50}], [{'variant': draft.variants.first().id, 'quantity': 1}]):
+            response = self.place(items)
+            self.assertEqual(response.status_code, 400, items)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(set(shirt.variants.values_list('inventory', flat=True)), {5})
+
+        response = self.place([{'product': poster.id, 'quantity': 2}])
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Decimal(response.data['total_price']), 8)
+
+    def test_other_shops_variants_are_rejected(self):
+        variant = create_product(create_shop('other'), 'hat').variants.first()
+        response = self.place([{'variant': variant.id, 'quantity': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+
+class TokenClaimsTest(TestCase):
+    def setUp(self):
+        self.shop = create_shop()
+        response = self.client.post(reverse('user_login'), {'email': self.shop.owner.email, 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        self.auth = {'HTTP_AUTHORIZATION': f"Bearer {response.json()['access']}"}
+        self.refresh = response.json()['refresh']
+
+    def test_access_token_carries_claims(self):
+        token = AccessToken(self.auth['HTTP_AUTHORIZATION'].split()[1])
+        self.assertEqual(token['user_id'], self.shop.owner.id)
+        self.assertEqual(token['shop_id'], self.shop.id)
+        self.assertEqual((token['is_shop_owner'], token['is_customer']), (True, False))
+
+    def test_requests_authenticate_without_loading_the_user(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('job-list', args=[self.shop.id]), **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in ctx.captured_queries if 'base_user' in query['sql']])
+
+        other = create_shop('other')
+        self.assertEqual(self.client.get(reverse('customers', args=[self.shop.id]), **self.auth).status_code, 200)
+        self.assertEqual(self.client.get(reverse('customers', args=[other.id]), **self.auth).status_code, 403)
+
+    def test_refresh_reloads_the_user(self):
+        owner = self.shop.owner
+        owner.is_staff = True
+        owner.save()
+        response = self.client.post(reverse('token_refresh'), {'refresh': self.refresh})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(AccessToken(response.json()['access'])['is_staff'])
+
+        owner.is_active = False
+        owner.save()
+        response = self.client.post(reverse('token_refresh'), {'refresh': response.json()['refresh']})
+        self.assertEqual(response.status_code, 401)
+
+    def test_login_mints_one_token_pair(self):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.post(reverse('user_login'), {'email': self.shop.owner.email, 'password': 'secret'}).json()
+        self.assertEqual(data['token'], data['access'])
+        self.assertEqual(data['shop']['id'], self.shop.id)
+        # The user, their shop and the customer check.
+        self.assertEqual(len(ctx.captured_queries), 3)
+
+    def test_sign_ups_issue_claims(self):
+        data = self.client.post(reverse('shop-owner-sign-up'), {
+            'email': 'new@owner.com', 'password': 'secret', 'is_shop_owner': True,
+            'shop': {'name': 'New', 'myjamly_domain': 'new'},
+        }, content_type='application/json').json()
+        self.assertEqual(AccessToken(data['token'])['shop_id'], data['shop']['id'])
+
+        data = self.client.post(reverse('customer-sign-up'), {
+            'email': 'buyer@example.com', 'password': 'secret', 'shop': self.shop.id,
+        }, content_type='application/json').json()
+        self.assertEqual(data['shop'], self.shop.id)
+        token = AccessToken(data['token'])
+        self.assertEqual((token['shop_id'], token['is_customer']), (None, True))
+        self.assertEqual(list(Customer.objects.get(email='buyer@example.com').shops.all()), [self.shop])
+
+    def test_user_rows_are_cached_briefly(self):
+        with override_settings(AUTH_USER_CACHE_SECONDS=0), self.assertNumQueries(2):
+            cached_user(self.shop.owner.id)
+            cached_user(self.shop.owner.id)
+        cached_user(self.shop.owner.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_user(self.shop.owner.id).email, self.shop.owner.email)
+
+
+SCRYPT_FIRST = ['base.hashers.ScryptPasswordHasher', 'base.hashers.PBKDF2PasswordHasher']
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=1000, PASSWORD_SCRYPT_WORK_FACTOR=2 ** 10)
+class PasswordHashingTest(TestCase):
+    def login(self, email):
+        response = self.client.post(reverse('user_login'), {'email': email, 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        return User.objects.get(email=email).password
+
+    def test_sign_up_hashes_before_a_single_insert(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('shop-owner-sign-up'), {
+                'email': 'new@owner.com', 'password': 'secret', 'is_shop_owner': True,
+                'shop': {'name': 'New', 'myjamly_domain': 'new'},
+            }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        writes = [query['sql'] for query in ctx.captured_queries if query['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(sum('"base_user"' in sql for sql in writes), 1)
+        self.assertTrue(User.objects.get(email='new@owner.com').password.startswith('pbkdf2_sha256$1000$'))
+
+    def test_login_rehashes_at_the_configured_cost_and_algorithm(self):
+        owner = create_shop().owner
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.assertTrue(self.login(owner.email).startswith('pbkdf2_sha256$2000$'))
+        with override_settings(PASSWORD_HASHERS=SCRYPT_FIRST):
+            self.assertTrue(self.login(owner.email).startswith('scrypt$1024$'))
+            with override_settings(PASSWORD_SCRYPT_WORK_FACTOR=2 ** 11):
+                self.assertTrue(self.login(owner.email).startswith('scrypt$2048$'))
+
+
+class CheckoutBenchmarkTest(TransactionTestCase):
+    def test_benchmark_records_run_and_cleans_up(self):
+        output = os.path.join(tempfile.mkdtemp(), 'checkout.json')
+        for _ in range(2):
+            call_command('benchmark_checkout', clients=3, orders=2, stock=4, output=output, stdout=open(os.devnull, 'w'))
+        with open(output) as f:
+            runs = json.load(f)
+        self.assertEqual(len(runs), 2)
+        self.assertEqual(runs[0]['requests'], 6)
+        self.assertLessEqual(runs[0]['sold'], 4)
+        self.assertEqual((runs[0]['oversold'], runs[0]['inventory_drift']), (0, 0))
+        self.assertFalse(Shop.objects.exists() or User.objects.exists() or Order.objects.exists())
+
+
+class BulkProductCreateTest(TestCase):
+    def post_product(self, shop, name, sizes):
+        options = [
+            {'name': 'Size', 'values': [{'name': s} for s in sizes]},
+            {'name': 'Colour', 'values': [{'name': 'Red'}, {'name': 'Blue'}]},
+        ]
+        variants = [
+            {'name': f'{size}/{colour}', 'price': '5.00', 'inventory': 3, 'values': [{'name': size}, {'name': colour}]}
+            for size, colour in itertools.product(sizes, ['Red', 'Blue'])
+        ]
+        data = {'name': name, 'handle': name, 'price': '5.00', 'collections': [], 'options': options, 'variants': variants}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('product-list', args=[shop.id]), data, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json(), len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_variants(self):
+        shop = create_shop()
+        _, small = self.post_product(shop, 'small', ['S'])
+        product, large = self.post_product(shop, 'large', ['S', 'M', 'L', 'XL', 'XXL'])
+        self.assertEqual(small, large)
+
+        self.assertEqual(len(product['variants']), 10)
+        variant = ProductVariant.objects.get(product_id=product['id'], name='XL/Blue')
+        self.assertEqual(sorted(variant.values.values_list('name', flat=True)), ['Blue', 'XL'])
+
+    def test_unknown_value_rolls_back(self):
+        shop = create_shop()
+        data = {'name': 'bad', 'handle': 'bad', 'collections': [], 'options': [{'name': 'Size', 'values': [{'name': 'S'}]}],
+                'variants': [{'name': 'M', 'price': '1.00', 'values': [{'name': 'M'}]}]}
+        response = self.client.post(reverse('product-list', args=[shop.id]), data, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Product.objects.filter(handle='bad').exists())
+
+
+class ProductReconcileTest(TestCase):
+    def setUp(self):
+        self.shop = create_shop()
+        self.product = create_product(self.shop, 'shirt', variants=3)
+        self.url = reverse('product-detail', args=[self.shop.id, self.product.id])
+
+    def put(self, **data):
+        data = dict({'shop': self.shop.id, 'name': 'shirt', 'handle': 'shirt', 'collections': []}, **data)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.put(self.url, data, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        writes = [q['sql'].split(' ')[0] + ' ' + q['sql'].split('"')[1] for q in ctx.captured_queries
+                  if q['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        return response.json(), writes
+
+    def variants_payload(self):
+        return [{'id': v.id, 'name': v.name, 'price': str(v.price), 'inventory': v.inventory,
+                 'values': [{'name': value.name} for value in v.values.all()]}
+                for v in self.product.variants.order_by('name')]
+
+    def test_editing_one_price_updates_one_row(self):
+        variants = self.variants_payload()
+        variants[0]['price'] = '12.50'
+        ids_before = set(ProductVariant.objects.values_list('id', flat=True))
+
+        product, writes = self.put(variants=variants)
+        self.assertEqual(writes, ['UPDATE base_productvariant', 'UPDATE base_product'])
+        self.assertEqual(set(ProductVariant.objects.values_list('id', flat=True)), ids_before)
+        self.assertEqual(ProductVariant.objects.get(id=variants[0]['id']).price, Decimal('12.50'))
+
+    def test_unchanged_put_writes_nothing(self):
+        _, writes = self.put(variants=self.variants_payload())
+        self.assertEqual(writes, [])
+
+    def test_options_and_variants_reconcile(self):
+        option = self.product.options.get()
+        options = [{'id': option.id, 'name': 'Size', 'values': [{'name': 'S0'}, {'name': 'S1'}, {'name': 'XL'}]}]
+        variants = self.variants_payload()[:2] + [{'name': 'shirt XL', 'price': '9.00', 'values': [{'name': 'XL'}]}]
+
+        self.put(options=options, variants=variants)
+        self.assertEqual(sorted(option.values.values_list('name', flat=True)), ['S0', 'S1', 'XL'])
+        self.assertEqual(sorted(self.product.variants.values_list('name', flat=True)), ['shirt S0', 'shirt S1', 'shirt XL'])
+        self.assertEqual(list(self.product.variants.get(name='shirt XL').values.values_list('name', flat=True)), ['XL'])
+
+    def test_renaming_a_variant_keeps_its_orders(self):
+        customer = Customer.objects.create(email='buyer@example.com')
+        variant = self.product.variants.order_by('name').first()
+        place_order(self.shop, customer, variant)
+        option = self.product.options.get()
+
+        variants = self.variants_payload()
+        variants[0]['name'] = 'Crimson'
+        response = self.client.patch(self.url, {'variants': variants, 'options': [{'id': option.id, 'name': 'Fit'}]},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(ProductVariant.objects.get(id=variant.id).name, 'Crimson')
+        self.assertEqual(ProductOption.objects.get(id=option.id).name, 'Fit')
+        self.assertEqual(OrderItem.objects.filter(variant_id=variant.id).count(), 1)
+
+    def test_ids_from_another_product_are_rejected(self):
+        other = create_product(self.shop, 'hat').variants.first()
+        variants = self.variants_payload()
+        variants[0]['id'] = other.id
+        response = self.client.patch(self.url, {'variants': variants}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('variants', response.json())
+        self.assertEqual(self.product.variants.count(), 3)
+        self.assertEqual(ProductVariant.objects.get(id=other.id).product.name, 'hat')
+
+    def test_ids_that_are_not_numbers_are_rejected(self):
+        for payload in ({'variants': [dict(self.variants_payload()[0], id='abc')]},
+                        {'options': [{'id': 'abc', 'name': 'Size', 'values': [{'name': 'S0'}]}]}):
+            response = self.client.patch(self.url, payload, content_type='application/json')
+            self.assertEqual(response.status_code, 400, payload)
+        with self.assertRaises(ValidationError):
+            sync_options(self.product, [{'id': 'abc', 'name': 'Size', 'values': []}])
+        self.assertEqual(self.product.variants.count(), 3)
+
+
+CATALOG_CSV = """handle,name,price,collections,option1_name,option1_value,option2_name,option2_value,sku,variant_price,inventory
+tee,Tee,10.00,summer;basics,Size,S,Colour,Red,TEE-S-R,,4
+tee,,,,,M,,Red,TEE-M-R,12.00,2
+tee,,,,,M,,Blue,TEE-M-B,12.00,0
+cap,Cap,5.00,summer,,,,,CAP,,9
+bad,Bad,not-a-price,,,,,,,,
+tee,Tee again,1.00,,,,,,,,
+"""
+
+
+class CatalogImportTest(TestCase):
+    def test_csv_import(self):
+        shop = create_shop()
+        stats = import_catalog(shop, io.BytesIO(CATALOG_CSV.encode()), 'csv', batch_size=2)
+
+        self.assertEqual(stats['rows'], 6)
+        self.assertEqual(stats['products_created'], 2)
+        self.assertEqual(stats['variants_created'], 4)
+        self.assertEqual([e['line'] for e in stats['errors']], [6, 7])
+
+        tee = Product.objects.get(shop=shop, handle='tee')
+        self.assertEqual(sorted(tee.collections.values_list('handle', flat=True)), ['basics', 'summer'])
+        self.assertEqual(list(tee.options.order_by('name').values_list('name', flat=True)), ['Colour', 'Size'])
+        variant = tee.variants.get(sku='TEE-M-B')
+        self.assertEqual(variant.price, 12)
+        self.assertEqual(sorted(variant.values.values_list('name', flat=True)), ['Blue', 'M'])
+        self.assertEqual(Collection.objects.get(handle='summer').products.count(), 2)
+
+    def test_csv_without_handles_groups_by_name(self):
+        shop = create_shop()
+        stats = import_catalog(shop, io.BytesIO(b'name,price\nShirt,10\nHat,5\nShoes,30\nShoes,30\n'), 'csv')
+        self.assertEqual((stats['rows'], stats['products_created'], stats['error_count']), (4, 3, 0))
+        self.assertEqual(sorted(Product.objects.values_list('handle', flat=True)), ['hat', 'shirt', 'shoes'])
+
+    def test_jsonl_import_reports_bad_lines(self):
+        shop = create_shop()
+        lines = [
+            '{"handle": "mug", "name": "Mug", "options": [{"name": "Size", "values": [{"name": "L"}]}],'
+            ' "variants": [{"name": "L", "price": "3.00", "values": [{"name": "L"}]}]}',
+            '{not json',
+            '{"handle": "jug", "name": "Jug", "variants": [{"name": "XL", "values": [{"name": "XL"}]}]}',
+        ]
+        stats = import_catalog(shop, io.BytesIO('\n'.join(lines).encode()), 'jsonl')
+        self.assertEqual(stats['products_created'], 1)
+        self.assertEqual([e['line'] for e in stats['errors']], [2, 3])
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_api_accepts_upload(self):
+        shop = create_shop()
+        client = APIClient()
+        client.force_authenticate(shop.owner)
+        upload = SimpleUploadedFile('catalog.csv', CATALOG_CSV.encode(), content_type='text/csv')
+        response = client.post(reverse('catalog-import-list', args=[shop.id]), {'file': upload})
+        self.assertEqual(response.status_code, 202, response.content)
+        self.assertEqual(response.json()['format'], 'csv')
+        self.assertEqual(CatalogImport.objects.get().status, 'PENDING')
+
+    def test_api_is_for_the_shop_owner(self):
+        shop = create_shop()
+        catalog_import = CatalogImport.objects.create(shop=shop, file='catalog_imports/x.csv', format='csv')
+        client = APIClient()
+        client.force_authenticate(create_shop('othershop').owner)
+        upload = SimpleUploadedFile('catalog.csv', CATALOG_CSV.encode(), content_type='text/csv')
+        self.assertEqual(client.post(reverse('catalog-import-list', args=[shop.id]), {'file': upload}).status_code, 403)
+        self.assertEqual(client.get(reverse('catalog-import-list', args=[shop.id])).status_code, 403)
+        self.assertEqual(client.get(reverse('catalog-import-detail', args=[shop.id, catalog_import.id])).status_code, 403)
+
+
+CUSTOMER_CSV_HEADER = 'email,first_name,last_name,accepts_marketing,password_hash,street_address,city,state,country,zip_code\n'
+
+
+def customer_csv(*rows):
+    return io.BytesIO((CUSTOMER_CSV_HEADER + ''.join(row + '\n' for row in rows)).encode())
+
+
+class CustomerImportTest(TestCase):
+    def setUp(self):
+        self.shop = create_shop()
+
+    def test_csv_import(self):
+        other_shop = create_shop('othershop')
+        existing = Customer.objects.create_user(email='known@example.com', password='secret')
+        existing.shops.add(other_shop)
+        hashed = make_password('hunter22')
+
+        stats = import_customers(self.shop, customer_csv(
+            f'ann@example.com,Ann,Lee,yes,{hashed},1 Main St,Springfield,IL,US,62701',
+            'bob@example.com,Bob,,,,,,,,',
+            'known@example.com,Known,,,,,,,,',
+            'not-an-email,,,,,,,,,',
+            'ann@example.com,Ann again,,,,,,,,',
+            'carl@example.com,Carl,,,hunter22,,,,,',
+            'dee@example.com,Dee,,,,1 High St,,,,',
+            f'{self.shop.owner.email},Owner,,,,,,,,',
+        ), batch_size=3)
+
+        self.assertEqual(stats['rows'], 8)
+        self.assertEqual(stats['customers_created'], 2)
+        self.assertEqual(stats['addresses_created'], 1)
+        self.assertEqual([e['line'] for e in stats['errors']], [4, 5, 6, 7, 8, 9])
+
+        ann = Customer.objects.get(email='ann@example.com')
+        self.assertTrue(ann.check_password('hunter22'))
+        self.assertFalse(ann.password_reset_required)
+        self.assertTrue(ann.accepts_marketing)
+        self.assertEqual(ann.default_address.city, 'Springfield')
+        self.assertEqual(ann.default_address.customer_id, ann.customer_id)
+
+        bob = Customer.objects.get(email='bob@example.com')
+        self.assertFalse(bob.has_usable_password())
+        self.assertTrue(bob.password_reset_required)
+        self.assertIsNone(bob.default_address)
+
+        # Accounts that already exist are not added to the importing shop.
+        self.assertEqual(sorted(Customer.objects.filter(shops=self.shop).values_list('email', flat=True)),
+                         ['ann@example.com', 'bob@example.com'])
+        self.assertEqual(list(existing.shops.all()), [other_shop])
+
+    def test_queries_do_not_grow_with_rows(self):
+        def queries(count, offset):
+            rows = [f'c{offset + i}@example.com,C,,,,{i} Main St,Springfield,IL,US,62701' for i in range(count)]
+            with CaptureQueriesContext(connection) as ctx:
+                stats = import_customers(self.shop, customer_csv(*rows))
+            self.assertEqual(stats['customers_created'], count)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(queries(2, 0), queries(20, 100))
+
+    def test_reimport_reports_instead_of_duplicating(self):
+        import_customers(self.shop, customer_csv('ann@example.com,Ann,,,,,,,,'))
+        stats = import_customers(self.shop, customer_csv('ann@example.com,Ann,,,,,,,,'))
+        self.assertEqual((stats['customers_created'], stats['error_count']), (0, 1))
+        self.assertEqual(self.shop.customers.count(), 1)
+
+    @override_settings(PASSWORD_RESET_URL='https://shop.test/reset/{uid}/{token}/')
+    def test_imported_customers_choose_a_password_by_reset(self):
+        import_customers(self.shop, customer_csv('bob@example.com,Bob,,,,,,,,'))
+        login = {'email': 'bob@example.com', 'password': 'new-secret'}
+        response = self.client.post(reverse('user_login'), login)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['code'], 'password_reset_required')
+
+        self.assertEqual(self.client.post(reverse('password-reset'), {'email': 'bob@example.com'}).status_code, 204)
+        self.assertEqual(self.client.post(reverse('password-reset'), {'email': 'nobody@example.com'}).status_code, 204)
+        self.assertEqual(len(mail.outbox), 1)
+        uid, token = re.search(r'/reset/([^/]+)/([^/]+)/', mail.outbox[0].body).groups()
+
+        weak = {'uid': uid, 'token': token, 'password': '12345678'}
+        response = self.client.post(reverse('password-reset-confirm'), weak)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.json())
+
+        confirm = {'uid': uid, 'token': token, 'password': 'new-secret'}
+        self.assertEqual(self.client.post(reverse('password-reset-confirm'), confirm).status_code, 204)
+        self.assertFalse(Customer.objects.get(email='bob@example.com').password_reset_required)
+        self.assertEqual(self.client.post(reverse('user_login'), login).status_code, 200)
+        # The token dies with the password it was issued against.
+        self.assertEqual(self.client.post(reverse('password-reset-confirm'), confirm).status_code, 400)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_api_queues_import_and_deletes_file(self):
+        client = APIClient()
+        client.force_authenticate(self.shop.owner)
+        upload = SimpleUploadedFile('customers.csv', customer_csv('ann@example.com,Ann,,,,,,,,').read(), content_type='text/csv')
+        response = client.post(reverse('customer-import-list', args=[self.shop.id]), {'file': upload})
+        self.assertEqual(response.status_code, 202, response.content)
+        self.assertEqual(Job.objects.get().kind, 'customer_import')
+
+        customer_import = CustomerImport.objects.get()
+        path = customer_import.file.path
+        run_customer_import(customer_import.id)
+        customer_import.refresh_from_db()
+        self.assertEqual((customer_import.status, customer_import.customers_created), ('DONE', 1))
+        self.assertFalse(customer_import.file)
+        self.assertFalse(os.path.exists(path))
+
+    def test_api_is_for_the_shop_owner(self):
+        client = APIClient()
+        client.force_authenticate(create_shop('othershop').owner)
+        upload = SimpleUploadedFile('customers.csv', b'email\n', content_type='text/csv')
+        response = client.post(reverse('customer-import-list', args=[self.shop.id]), {'file': upload})
+        self.assertEqual(response.status_code, 403)
+
+
+class CustomerListTest(TestCase):
+    def setUp(self):
+        self.shop = create_shop()
+        self.variant = create_product(self.shop, 'shirt').variants.first()
+        self.client = APIClient()
+        self.client.force_authenticate(self.shop.owner)
+
+    def add_customer(self, i, orders=2):
+        customer = Customer.objects.create(email=f'c{i}@example.com')
+        customer.shops.add(self.shop)
+        CustomerAddress.objects.create(customer=customer, street_address=f'{i} Main St', city='Springfield',
+                                       state='IL', country='US', zip_code='62701')
+        for _ in range(orders):
+            place_order(self.shop, customer, self.variant)
+        return customer
+
+    def customers(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('customers', args=[self.shop.id]))
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['results'], len(ctx.captured_queries)
+
+    def test_queries_do_not_grow_with_customers(self):
+        self.add_customer(0)
+        _, few = self.customers()
+        for i in range(1, 6):
+            self.add_customer(i)
+        results, many = self.customers()
+        self.assertEqual(len(results), 6)
+        # The caller's shop, the customers with their order stats, and their addresses.
+        self.assertEqual(few, 3)
+        self.assertEqual(few, many)
+
+    def test_pages_walk_customers_from_an_index_bound(self):
+        customers = [self.add_customer(i, orders=0) for i in range(5)]
+        User.objects.filter(id__in=[c.id for c in customers[:3]]).update(date_joined=customers[0].date_joined)
+        expected = list(Customer.objects.order_by('-date_joined', '-id').values_list('email', flat=True))
+
+        url, seen = reverse('customers', args=[self.shop.id]) + '?page_size=2', []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                page = self.client.get(url).json()
+            seen += [c['email'] for c in page['results']]
+            url = page['next']
+        self.assertEqual(seen, expected)
+        self.assertTrue(any('"date_joined" <=' in q['sql'] for q in ctx.captured_queries))
+
+    def test_stats_count_this_shops_placed_orders(self):
+        customer = self.add_customer(0, orders=3)
+        Order.objects.filter(customer=customer).order_by('id').first().delete()
+        cancelled = place_order(self.shop, customer, self.variant, quantity=4)
+        cancelled.status = 'CANCELLED'
+        cancelled.save()
+        other = create_shop('othershop')
+        Order.objects.create(shop=other, customer=customer, total_price=99)
+        latest = place_order(self.shop, customer, self.variant)
+
+        [data], _ = self.customers()
+        self.assertEqual(data['orders_count'], 3)
+        self.assertEqual(Decimal(data['total_spent']), 3 * self.variant.price)
+        self.assertEqual(data['last_order_at'][:19], latest.created_at.isoformat()[:19])
+        self.assertEqual(data['default_address']['street_address'], '0 Main St')
+        self.assertEqual([a['city'] for a in data['addresses']], ['Springfield'])
+
+        # Without the annotations the same figures cost a query each, across all shops.
+        customer = Customer.objects.get(pk=customer.pk)
+        self.assertEqual((customer.orders_count, customer.last_order), (4, latest))
+        self.assertEqual(customer.total_spent, 3 * self.variant.price + 99)
+
+    def test_customer_without_orders(self):
+        Customer.objects.create(email='new@example.com').shops.add(self.shop)
+        [data], _ = self.customers()
+        self.assertEqual((data['orders_count'], Decimal(data['total_spent']), data['last_order_at']), (0, 0, None))
+        self.assertEqual((data['addresses'], data['default_address']), ([], None))
+
+
+class ExportTest(TestCase):
+    def export(self, shop, kind, file_format):
+        client = APIClient()
+        client.force_authenticate(shop.owner)
+        response = client.get(reverse('shop-export', args=[shop.id, kind, file_format]))
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_product_csv_round_trips_through_import(self):
+        shop = create_shop()
+        import_catalog(shop, io.BytesIO(CATALOG_CSV.encode()), 'csv')
+        exported = self.export(shop, 'products', 'csv')
+
+        copy = create_shop('copystore')
+        stats = import_catalog(copy, io.BytesIO(exported), 'csv')
+        self.assertEqual((stats['products_created'], stats['variants_created'], stats['error_count']), (2, 4, 0))
+
+        def records(shop):
+            records = [json.loads(line) for line in self.export(shop, 'products', 'jsonl').splitlines()]
+            for record in records:
+                record['variants'].sort(key=lambda variant: variant['sku'])
+            return sorted(records, key=lambda record: record['handle'])
+        self.assertEqual(records(copy), records(shop))
+
+    def test_order_export_queries_are_batched(self):
+        shop = create_shop()
+        customer = Customer.objects.create(email='buyer@example.com')
+        variant = create_product(shop, 'shirt').variants.first()
+
+        def export_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                lines = self.export(shop, 'orders', 'jsonl').splitlines()
+            return lines, len(ctx.captured_queries)
+
+        place_order(shop, customer, variant)
+        _, few = export_queries()
+        for _ in range(5):
+            place_order(shop, customer, variant, quantity=2)
+        lines, many = export_queries()
+        self.assertEqual(few, many)
+        self.assertEqual(len(lines), 6)
+
+    def test_only_the_owner_can_export(self):
+        shop = create_shop()
+        client = APIClient()
+        client.force_authenticate(Customer.objects.create(email='buyer@example.com'))
+        self.assertEqual(client.get(reverse('shop-export', args=[shop.id, 'orders', 'csv'])).status_code, 403)
+
+
+class IdGenerationTest(TestCase):
+    def test_ids_are_unique_increasing_and_json_safe(self):
+        generate = SnowflakeGenerator(worker_id=3)
+        ids = [generate() for _ in range(2000)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertLess(ids[-1], 2 ** 53)
+        self.assertAlmostEqual(id_timestamp(ids[0]) / 1000, time.time(), delta=5)
+
+    def test_each_process_locks_its_own_worker_id(self):
+        lock_dir = tempfile.mkdtemp()
+        first = SnowflakeGenerator(worker_ids=range(2), lock_dir=lock_dir)
+        second = SnowflakeGenerator(worker_ids=range(2), lock_dir=lock_dir)
+        first(), second()
+        self.assertEqual((first.worker, second.worker), (0, 1))
+        with self.assertRaises(ImproperlyConfigured):
+            SnowflakeGenerator(worker_ids=range(2), lock_dir=lock_dir)()
+
+        with override_settings(ID_WORKER_ID=1):
+            with self.assertRaises(ImproperlyConfigured):
+                SnowflakeGenerator(lock_dir=lock_dir)()
+        with override_settings(ID_WORKER_ID=32):
+            with self.assertRaises(ImproperlyConfigured):
+                SnowflakeGenerator(lock_dir=tempfile.mkdtemp())()
+
+    def test_a_forked_process_takes_another_worker_id(self):
+        lock_dir = tempfile.mkdtemp()
+        generate = SnowflakeGenerator(worker_ids=range(4), lock_dir=lock_dir)
+        generate()
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                generate()
+                os.write(write, str(generate.worker).encode())
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual((generate.worker, int(os.read(read, 8))), (0, 1))
+
+    def test_models_get_time_ordered_ids(self):
+        shop = create_shop()
+        first = Product.objects.create(shop=shop, name='first', handle='first', price=1)
+        second = Product.objects.create(shop=shop, name='second', handle='second', price=1)
+        self.assertLess(first.id, second.id)
+
+
+class HotQueryPlanTest(TestCase):
+    """
+    Runs EXPLAIN on the hot lookups and fails on a full table scan.
+    """
+
+    def setUp(self):
+        self.shop = create_shop()
+        for shop in (self.shop, create_shop('otherstore')):
+            customer = Customer.objects.create(email=f'buyer@{shop.myjamly_domain}.com')
+            for i in range(5):
+                product = create_product(shop, f'product-{i}')
+                Collection.objects.create(shop=shop, name=f'collection-{i}', handle=f'collection-{i}')
+                place_order(shop, customer, product.variants.first())
+        self.product = Product.objects.filter(shop=self.shop).first()
+
+    def hot_queries(self):
+        # name: (queryset, index expected in the plan, or None for any index)
+        shop, product = self.shop, self.product
+        return {
+            'product by handle': (Product.objects.filter(shop_id=shop.id, handle=product.handle), None),
+            'product by name': (Product.objects.filter(shop_id=shop.id, name=product.name), 'product_shop_name_idx'),
+            'collection by handle': (Collection.objects.filter(shop_id=shop.id, handle='collection-1'), None),
+            'option value by name': (
+                OptionValue.objects.filter(option__product_id=product.id, name='S1'), 'optionvalue_option_name_idx'),
+            'open orders': (
+                Order.objects.filter(shop=shop, fulfilled=False).order_by('-created_at', '-id')[:50],
+                'order_shop_open_idx'),
+            'shop orders': (Order.objects.filter(shop=shop).order_by('-created_at', '-id')[:50], 'order_shop_created_idx'),
+            'best sellers': (
+                OrderItem.objects.filter(product__shop=shop, created_at__gte=timezone.now() - timedelta(days=7))
+                .values('product').annotate(num_buys=Sum('quantity')).order_by('-num_buys')[:10],
+                'orderitem_product_created_idx'),
+        }
+
+    def full_scans(self, plan):
+        if connection.vendor == 'postgresql':
+            return [line for line in plan.splitlines() if 'Seq Scan' in line]
+        return [line for line in plan.splitlines() if re.search(r'\bSCAN (TABLE )?base_', line)
+                and 'USING' not in line]
+
+    def test_hot_queries_use_indexes(self):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # The seeded tables are tiny; make the planner show its index choice.
+                cursor.execute('SET enable_seqscan = off')
+            elif connection.vendor == 'sqlite':
+                cursor.execute('ANALYZE')
+        for name, (queryset, index) in self.hot_queries().items():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertEqual(self.full_scans(plan), [], plan)
+                if index:
+                    self.assertIn(index, plan)
+
+
+@override_settings(ASYNC_CONCURRENT_QUERIES=False)
+class StorefrontAsyncTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shop = create_shop()
+        self.collection = Collection.objects.create(shop=self.shop, name='All', handle='all')
+        self.product = create_product(self.shop, 'shirt', collections=[self.collection])
+
+    async def test_product_and_collection_by_handle(self):
+        client = AsyncClient()
+        domain = self.shop.myjamly_domain
+        response = await client.get(reverse('storefront-product', args=[domain, 'shirt']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)['variants']), 2)
+
+        response = await client.get(reverse('storefront-collection', args=[domain, 'all']))
+        self.assertEqual([p['handle'] for p in json.loads(response.content)['products']], ['shirt'])
+        response = await client.get(reverse('storefront-product', args=['otherstore', 'shirt']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_conditional_get(self):
+        url = reverse('storefront-collection', args=[self.shop.myjamly_domain, 'all'])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        variant = self.product.variants.first()
+        variant.price = 42
+        variant.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_writes_are_not_allowed(self):
+        response = self.client.post(reverse('storefront', args=[self.shop.myjamly_domain]))
+        self.assertEqual(response.status_code, 405)
+
+
+class StorefrontConcurrentQueriesTest(TransactionTestCase):
+    def test_storefront_queries_run_on_pool_threads(self):
+        shop = create_shop()
+        create_product(shop, 'shirt')
+        response = self.client.get(reverse('storefront', args=[shop.myjamly_domain]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['shop']['id'], shop.id)
+
+    @override_settings(ASYNC_CONCURRENT_QUERIES=2)
+    def test_pool_is_capped_at_the_setting(self):
+        def query():
+            time.sleep(0.05)
+            list(Shop.objects.all())
+            return threading.get_ident(), id(connection.connection)
+
+        async def run_many():
+            return await asyncio.gather(*(database_sync_to_async(query)() for _ in range(6)))
+
+        threads, connections = zip(*async_to_sync(run_many)())
+        self.assertEqual(len(set(threads)), 2)
+        self.assertEqual(len(set(connections)), 2)
+
+
+def image_upload(name='photo.jpg', size=(1600, 1200), image_format='JPEG', mode='RGB', color='red', orientation=None):
+    image = Image.new(mode, size, color)
+    exif = Image.Exif()
+    exif[0x010F] = 'CameraMaker'
+    exif[0x8825] = {2: (51.0, 30.0, 0.0)}
+    if orientation:
+        exif[0x0112] = orientation
+    output = io.BytesIO()
+    image.save(output, image_format, exif=exif)
+    return SimpleUploadedFile(name, output.getvalue(), content_type=f'image/{image_format.lower()}')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImageRenditionTest(TestCase):
+    def setUp(self):
+        self.shop = create_shop()
+        self.product = Product.objects.create(shop=self.shop, name='shirt', handle='shirt', price=10)
+
+    def test_upload_generates_stripped_renditions(self):
+        image = ProductImage.objects.create(product=self.product, image=image_upload())
+        self.assertEqual(image.renditions['source'], image.image.name)
+        for size_name, size in RENDITION_SIZES.items():
+            for image_format in RENDITION_FORMATS:
+                with image.image.storage.open(image.renditions[size_name][image_format]) as stored:
+                    rendition = Image.open(stored)
+                    self.assertEqual(rendition.format, image_format.upper())
+                    self.assertEqual(max(rendition.size), size)
+                    self.assertEqual(len(rendition.getexif()), 0)
+
+    def test_stored_originals_are_stripped_and_upright(self):
+        image = ProductImage.objects.create(product=self.product, image=image_upload())
+        self.product.thumbnail = image_upload('thumb.jpg', size=(300, 100), orientation=6)
+        self.product.save()
+        for field_file in (image.image, self.product.thumbnail):
+            with field_file.storage.open(field_file.name) as stored:
+                original = Image.open(stored)
+                self.assertEqual(original.format, 'JPEG')
+                self.assertEqual(len(original.getexif()), 0)
+        with self.product.thumbnail.storage.open(self.product.thumbnail.name) as stored:
+            self.assertEqual(Image.open(stored).size, (100, 300))
+
+    def test_small_and_transparent_images_are_not_upscaled(self):
+        image = ProductImage.objects.create(
+            product=self.product, image=image_upload('logo.png', (100, 50), 'PNG', 'RGBA'))
+        with image.image.storage.open(image.renditions['large']['jpeg']) as stored:
+            self.assertEqual(Image.open(stored).size, (100, 50))
+
+    def test_serializer_exposes_rendition_urls_and_thumbnail_changes_regenerate(self):
+        self.product.thumbnail = image_upload('thumb.jpg')
+        self.product.save()
+        first = self.product.thumbnail_renditions['thumb']['webp']
+
+        self.product.thumbnail = image_upload('other.jpg')
+        self.product.save(update_fields=['thumbnail', 'updated_at'])
+        self.product.refresh_from_db()
+        self.assertNotEqual(self.product.thumbnail_renditions['thumb']['webp'], first)
+        self.assertFalse(self.product.thumbnail.storage.exists(first))
+
+        data = ProductSerializer(self.product).data
+        self.assertTrue(data['thumbnail_renditions']['medium']['jpeg'].endswith('other-medium.jpeg'))
+        self.assertEqual(data['images'], [])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), JOB_STAGING_ROOT=tempfile.mkdtemp())
+class ImageDedupTest(TestCase):
+    def setUp(self):
+        self.shop = create_shop()
+        self.product = Product.objects.create(shop=self.shop, name='shirt', handle='shirt', price=10)
+        self.client = APIClient()
+        self.client.force_authenticate(self.shop.owner)
+
+    def test_same_bytes_are_stored_once(self):
+        other = Product.objects.create(shop=self.shop, name='hat', handle='hat', price=5)
+        first = ProductImage.objects.create(product=self.product, image=image_upload('front.jpg'))
+        second = ProductImage.objects.create(product=other, image=image_upload('copy.jpg'))
+        self.assertEqual(first.content_hash, second.content_hash)
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(second.renditions, first.renditions)
+        directory = os.path.join(settings.MEDIA_ROOT, os.path.dirname(first.image.name))
+        self.assertEqual(os.listdir(directory), [os.path.basename(first.image.name)])
+
+        # Shared renditions outlive one of their images being replaced.
+        first.image = image_upload('front.jpg', color='blue')
+        first.save()
+        self.assertTrue(second.image.storage.exists(second.renditions['thumb']['webp']))
+
+    def test_reuploading_an_image_keeps_it(self):
+        image = ProductImage.objects.create(product=self.product, image=image_upload('front.jpg'))
+        response = self.client.put(reverse('product-detail', args=[self.shop.id, self.product.id]), {
+            'name': 'shirt', 'handle': 'shirt', 'price': '10', 'shop': self.shop.id,
+            'uploaded_images': [image_upload('front-again.jpg'), image_upload('front-again.jpg')],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['image_jobs'], [])
+        self.assertEqual(list(self.product.images.values_list('id', flat=True)), [image.id])
+        self.assertFalse(Job.objects.exists())
+
+    def test_duplicate_uploads_queue_one_job(self):
+        response = self.client.put(reverse('product-detail', args=[self.shop.id, self.product.id]), {
+            'name': 'shirt', 'handle': 'shirt', 'price': '10', 'shop': self.shop.id,
+            'uploaded_images': [image_upload('a.jpg'), image_upload('b.jpg')],
+        }, format='multipart')
+        self.assertEqual(len(response.data['image_jobs']), 1)
+        run_pending()
+        self.assertEqual(self.product.images.count(), 1)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), JOB_STAGING_ROOT=tempfile.mkdtemp())
+class JobQueueTest(TestCase):
+    def setUp(self):
+        self.shop = create_shop()
+        self.client = APIClient()
+        self.client.force_authenticate(self.shop.owner)
+
+    def test_product_images_are_stored_in_the_background(self):
+        response = self.client.post(reverse('product-list', args=[self.shop.id]), {
+            'name': 'shirt', 'handle': 'shirt', 'price': '10', 'shop': self.shop.id,
+            'uploaded_images': [image_upload('front.jpg'), image_upload('back.jpg', color='blue')],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['images'], [])
+        self.assertEqual([job['status'] for job in response.data['image_jobs']], ['PENDING', 'PENDING'])
+        self.assertFalse(ProductImage.objects.exists())
+
+        self.assertEqual(run_pending(), 2)
+        product = Product.objects.get(handle='shirt')
+        self.assertEqual(product.images.count(), 2)
+        self.assertTrue(all(image.renditions for image in product.images.all()))
+
+        job = self.client.get(reverse('job-detail', args=[self.shop.id, response.data['image_jobs'][0]['id']])).data
+        self.assertEqual(job['status'], 'DONE')
+        self.assertIn(job['result']['image_id'], [image.id for image in product.images.all()])
+
+        self.client.force_authenticate(create_shop('othershop').owner)
+        self.assertEqual(self.client.get(reverse('job-list', args=[self.shop.id])).status_code, 403)
+        self.assertEqual(self.client.get(reverse('job-detail', args=[self.shop.id, job['id']])).status_code, 403)
+
+    def test_failures_are_retried_then_marked_failed(self):
+        calls = []
+
+        @task('test_flaky')
+        def flaky():
+            calls.append(1)
+            raise RuntimeError('boom')
+
+        self.addCleanup(TASKS.pop, 'test_flaky')
+        job = enqueue('test_flaky', shop_id=self.shop.id, max_attempts=2)
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('PENDING', 1))
+        self.assertGreater(job.run_at, timezone.now())
+
+        Job.objects.filter(id=job.id).update(run_at=timezone.now())
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, len(calls)), ('FAILED', 2, 2))
+        self.assertEqual(JobSerializer(job).data['error'], 'RuntimeError: boom')
+
+    def test_only_jobs_that_stopped_heartbeating_are_requeued(self):
+        long_ago = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT * 10)
+        busy = enqueue('catalog_import', import_id=0)
+        lost = enqueue('catalog_import', import_id=0)
+        last_try = enqueue('catalog_import', max_attempts=1, import_id=0)
+        for job in (busy, lost, last_try):
+            claim('worker')
+        Job.objects.update(started_at=long_ago)
+        Job.objects.exclude(id=busy.id).update(heartbeat_at=long_ago)
+
+        self.assertEqual(requeue_stale(), 1)
+        statuses = dict(Job.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[job.id] for job in (busy, lost, last_try)], ['RUNNING', 'PENDING', 'FAILED'])
+        self.assertEqual(Job.objects.get(id=lost.id).attempts, 1)
+
+    def test_a_requeued_job_is_not_overwritten_by_its_old_worker(self):
+        enqueue('catalog_import', import_id=0)
+        job = claim('slow')
+        Job.objects.filter(id=job.id).update(status='PENDING', locked_by=None)
+        run(job)
+        self.assertEqual(Job.objects.get(id=job.id).status, 'PENDING')
+
+    def test_a_job_is_claimed_once(self):
+        enqueue('catalog_import', import_id=0)
+        self.assertIsNotNone(claim('one'))
+        self.assertIsNone(claim('two'))
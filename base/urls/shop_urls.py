@@ -1,6 +1,7 @@
 from django.urls import include, path
 
-from base.views.shop_views import CollectionListCreateAPIView, CollectionRetrieveUpdateDestroyAPIView, OptionDetail, OptionList, PlaceOrderView, ProductListCreateAPIView, ProductRetrieveUpdateDestroyAPIView, ShopListAPIView, ShopRetrieveUpdateDestroyAPIView, VariantDetail, VariantList, getShopData, CustomerList, storefront
+from base.views.shop_views import CatalogImportListCreateAPIView, CatalogImportRetrieveAPIView, CollectionListCreateAPIView, CustomerImportListCreateAPIView, CustomerImportRetrieveAPIView, CollectionRetrieveUpdateDestroyAPIView, JobList, JobRetrieveAPIView, OptionDetail, OptionList, PlaceOrderView, ProductListCreateAPIView, ProductRetrieveUpdateDestroyAPIView, ShopListAPIView, ShopOrderList, ShopRetrieveUpdateDestroyAPIView, VariantDetail, VariantList, exportShopData, getShopData, CustomerList, storefrontCacheStats
+from base.views.storefront_views import storefront, storefrontCollection, storefrontProduct
 
 
 urlpatterns = [
@@ -13,6 +14,12 @@ urlpatterns = [
     ## Shop product
     path('shop/<str:shop_id>/products/', ProductListCreateAPIView.as_view(), name='product-list'),
     path('shop/<str:shop_id>/products/<str:lookup>/', ProductRetrieveUpdateDestroyAPIView.as_view(), name='product-detail'),
+    path('shop/<str:shop_id>/imports/', CatalogImportListCreateAPIView.as_view(), name='catalog-import-list'),
+    path('shop/<str:shop_id>/imports/<int:pk>/', CatalogImportRetrieveAPIView.as_view(), name='catalog-import-detail'),
+    path('shop/<str:shop_id>/customer-imports/', CustomerImportListCreateAPIView.as_view(), name='customer-import-list'),
+    path('shop/<str:shop_id>/customer-imports/<int:pk>/', CustomerImportRetrieveAPIView.as_view(), name='customer-import-detail'),
+    path('shop/<str:shop_id>/jobs/', JobList.as_view(), name='job-list'),
+    path('shop/<str:shop_id>/jobs/<int:pk>/', JobRetrieveAPIView.as_view(), name='job-detail'),
     ## Product options
     path('options/', OptionList.as_view(), name='option-list'),
     path('options/<int:pk>/', OptionDetail.as_view(), name='option-detail'),
@@ -22,7 +29,12 @@ urlpatterns = [
     ## Admin
     path('getshop/<str:user_id>/', getShopData, name='get_store'),
     path('customers/<str:shop_id>/', CustomerList.as_view(), name='customers'),
+    path('shop/<str:shop_id>/orders/', ShopOrderList.as_view(), name='shop-orders'),
+    path('shop/<str:shop_id>/export/<str:kind>.<str:file_format>', exportShopData, name='shop-export'),
     ## StoreFront
     path('storefront/<str:domain_name>/', storefront, name='storefront'),
+    path('storefront/<str:domain_name>/products/<str:handle>/', storefrontProduct, name='storefront-product'),
+    path('storefront/<str:domain_name>/collections/<str:handle>/', storefrontCollection, name='storefront-collection'),
+    path('storefront-cache/stats/', storefrontCacheStats, name='storefront-cache-stats'),
 
 ]
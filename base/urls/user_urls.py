@@ -1,11 +1,12 @@
 from django.urls import path
-from rest_framework_simplejwt.views import TokenRefreshView
-from base.views.user_views import CustomerSignUpView, MyObtainTokenPairView, ShopOwnerSignUpView
+from base.views.user_views import CustomerSignUpView, MyObtainTokenPairView, MyTokenRefreshView, PasswordResetConfirmView, PasswordResetView, ShopOwnerSignUpView
 
 
 urlpatterns = [
     path('user/login/', MyObtainTokenPairView.as_view(), name='user_login'),
-    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('token/refresh/', MyTokenRefreshView.as_view(), name='token_refresh'),
+    path('user/password-reset/', PasswordResetView.as_view(), name='password-reset'),
+    path('user/password-reset/confirm/', PasswordResetConfirmView.as_view(), name='password-reset-confirm'),
     path('sign-up/shop-owner/', ShopOwnerSignUpView.as_view(), name='shop-owner-sign-up'),
     path('sign-up/customer/', CustomerSignUpView.as_view(), name='customer-sign-up'),
 ]
\ No newline at end of file
@@ -2,7 +2,8 @@ from rest_framework import viewsets
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from base.models import Product
+from base.authentication import shop_id_of
+from base.models import Product, Shop
 from base.serializers import ProductSerializer
 
 class ProductViewSet(viewsets.ModelViewSet):
@@ -11,12 +12,11 @@ class ProductViewSet(viewsets.ModelViewSet):
     permission_classes = [AllowAny]  #isAuthenticate
 
     def get_queryset(self):
-        return self.queryset.filter(shop__owner=2)
-        #return self.queryset.filter(shop__owner=[self.request.user])
+        return self.queryset.filter(shop_id=shop_id_of(self.request.user))
 
     def perform_create(self, serializer):
-        #serializer.save(shop=2)
-        serializer.save(shop=self.request.user.shop)
+        # The id from the token is all the product needs; no shop query.
+        serializer.save(shop=Shop(id=shop_id_of(self.request.user)))
 
 '''
 class CollectionListCreateAPIView(generics.ListCreateAPIView):
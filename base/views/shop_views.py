@@ -2,28 +2,48 @@ from datetime import datetime, timedelta
 import json
 
 import os
-from django.http import JsonResponse
+from urllib.parse import unquote, urlparse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
 from django.db.models.functions import  ExtractDay, ExtractMonth
 
 from rest_framework import generics
 from rest_framework.response import Response
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 from rest_framework import status
-from rest_framework.permissions import AllowAny,  IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.parsers import MultiPartParser, FormParser, FileUploadParser
 
-from base.models import Customer, Order, OrderItem, Product, ProductImage, ProductOption, OptionValue, ProductVariant, Shop, Collection
-from base.serializers import CollectionSerializer, CustomerSerializer, OrderSerializer, ProductOptionSerializer, ProductSerializer, ProductVariantSerializer, ShopSerializer
+from base.authentication import shop_id_of
+from base.caching import storefront_cache_stats
+from base.catalog import create_options, create_variants, match_uploaded_images, parse_json_list
+from base.conditional import collection_list_condition, product_condition, product_list_condition
+from base.exporters import EXPORTS, stream_export
+from base.importers import start_catalog_import, start_customer_import
+from base.models import CatalogImport, Customer, CustomerImport, Job, Order, OrderItem, Product, ProductImage, ProductOption, OptionValue, ProductVariant, Shop, ShopDailySales, Collection
+from base.pagination import CustomerPagination, KeysetPagination
+from base.serializers import CatalogImportSerializer, CollectionSerializer, CustomerImportSerializer, CustomerSerializer, JobSerializer, OrderSerializer, ProductOptionSerializer, ProductSerializer, ProductVariantSerializer, ShopSerializer
 
 User = get_user_model()
 
 
+def check_shop_access(request, shop_id):
+    """
+    Raises PermissionDenied unless the caller owns the shop or is a
+    superuser. Read from the token's claims; no user query.
+    """
+    if str(shop_id_of(request.user)) != str(shop_id) and not request.user.is_superuser:
+        raise PermissionDenied()
+
+
 ##########Shop##########
 class ShopListAPIView(generics.ListAPIView):
     serializer_class = ShopSerializer
@@ -49,13 +69,15 @@ class ShopRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
         return Response(serializer.data)
 
 ##########Collection##########
+@method_decorator(collection_list_condition, name='get')
 class CollectionListCreateAPIView(generics.ListCreateAPIView):
     serializer_class = CollectionSerializer
+    pagination_class = KeysetPagination
     #parser_classes = [MultiPartParser, FormParser, FileUploadParser]
 
     def get_queryset(self):
         shop_id = self.kwargs.get('shop_id')
-        return Collection.objects.filter(shop_id=shop_id)
+        return Collection.objects.filter(shop_id=shop_id).with_products()
 
     def post(self, request, *args, **kwargs):
         shop_id = self.kwargs.get('shop_id')
@@ -72,7 +94,7 @@ class CollectionListCreateAPIView(generics.ListCreateAPIView):
         for product_data in products_data:
             for product_data_dict in product_data:
                 name = product_data_dict.get('name')
-                product = Product.objects.get(name=name)
+                product = Product.objects.get(shop_id=shop_id, name=name)
                 instance.products.add(product)  # Add related products to the instance
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -84,9 +106,9 @@ class CollectionRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIVi
         lookup = self.kwargs['lookup']
         try:
             object_id = int(lookup)
-            return Collection.objects.get(id=object_id)
+            return self.get_queryset().get(id=object_id)
         except ValueError:
-            return Collection.objects.get(handle=lookup)
+            return self.get_queryset().get(handle=lookup)
 
     def get_queryset(self):
         shop_id = self.kwargs.get('shop_id')
@@ -116,76 +138,50 @@ class CollectionRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIVi
         for product_data in products_data:
             for product_data_dict in product_data:
                 name = product_data_dict.get('name')
-                product = Product.objects.get(name=name)
+                product = Product.objects.get(shop_id=instance.shop_id, name=name)
                 value.products.add(product)  # Add related products to the instance
         return Response(serializer.data)
 
 ##########Product##########
+@method_decorator(product_list_condition, name='get')
 class ProductListCreateAPIView(generics.ListCreateAPIView):
     serializer_class = ProductSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         shop_id = self.kwargs.get('shop_id')
-        return Product.objects.filter(shop_id=shop_id)
+        return Product.objects.filter(shop_id=shop_id).with_details()
 
     def post(self, request, *args, **kwargs):
         shop_id = self.kwargs.get('shop_id')
         data = request.data.copy()
         data['shop'] = shop_id
-        print(data)
 
-        options_data = data.pop('options', [])
-        if isinstance(options_data, str):
-            options_data = json.loads(options_data)  # Parse options data as JSON
-        # Convert string items to dictionaries
-        options_data = [json.loads(p) if isinstance(p, str) else p for p in options_data]
-
-        #variants
-        variants_data = data.pop('variants', [])
-        if isinstance(variants_data, str):
-            variants_data = json.loads(variants_data)  # Parse variants data as JSON
-        # Convert string items to dictionaries
-        variants_data = [json.loads(p) if isinstance(p, str) else p for p in variants_data]
+        options_data = parse_json_list(data.pop('options', []))
+        variants_data = parse_json_list(data.pop('variants', []))
 
         serializer = self.get_serializer(data=data)
         serializer.is_valid(raise_exception=True)
-        
-        product = self.perform_create(serializer)
-        
-        self.create_options(product, options_data)
-        self.create_variants(product, variants_data)
-        
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+        with transaction.atomic():
+            product = self.perform_create(serializer)
+            values = self.create_options(product, options_data)
+            self.create_variants(product, variants_data, values)
+
+        data = self.get_serializer(Product.objects.with_details().get(id=product.id)).data
+        data['image_jobs'] = JobSerializer(product.image_jobs, many=True).data
+        return Response(data, status=status.HTTP_201_CREATED)
 
     def perform_create(self, serializer):
         return serializer.save()
 
     def create_options(self, product, options_data):
-        for option_data in options_data:
-            values_data = option_data.pop('values', [])
-            option = ProductOption.objects.create(product=product, **option_data)
-            for value_data in values_data:
-                OptionValue.objects.create(option=option, **value_data)
-
-    def create_variants(self, product, variants_data):
-        for variant_data in variants_data:
-            values_data = variant_data.pop('values', [{}])
-            print(product)
-            variant = ProductVariant.objects.create(product=product, **variant_data)
-
-            if isinstance(values_data, str):
-                values_data = json.loads(values_data)  # Parse variants data as JSON
-            # Convert string items to dictionaries
-            values_data = [json.loads(p) if isinstance(p, str) else p for p in values_data]
-
-            for value_data in values_data:
-                print('1', type(value_data))
-                print(value_data)
-                name = value_data.get('name')
-                print('name:', name)
-                value = OptionValue.objects.get(option__product_id=product.id, name=name)
-                variant.values.add(value)
+        return create_options(product, options_data)
 
+    def create_variants(self, product, variants_data, values=None):
+        return create_variants(product, variants_data, values)
+
+@method_decorator(product_condition, name='get')
 class ProductRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = ProductSerializer
     #lookup_url_kwarg = 'product_id'
@@ -194,9 +190,9 @@ class ProductRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView)
         lookup = self.kwargs['lookup']
         try:
             object_id = int(lookup)
-            return Product.objects.get(id=object_id)
+            return self.get_queryset().get(id=object_id)
         except ValueError:
-            return Product.objects.get(handle=lookup)
+            return self.get_queryset().get(handle=lookup)
 
     def get_queryset(self):
         shop_id = self.kwargs.get('shop_id')
@@ -212,81 +208,122 @@ class ProductRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView)
             # Replace URL with existing file object
             data['thumbnail'] = instance.thumbnail
 
-        # Handle uploaded_images
+        # Handle uploaded_images: URLs keep existing images, files are added
         uploaded_images = data.pop('uploaded_images', None)
-        updated_uploaded_images = []
-        existing_images = instance.images.all()
+        retained_images = None
         if uploaded_images is not None:
+            existing_images = {os.path.basename(image.image.name): image.id for image in instance.images.all()}
+            retained_images, new_images = [], []
             for uploaded_image in uploaded_images:
-                print(uploaded_image)
                 if isinstance(uploaded_image, str):
                     # Extract file name from the URL
-                    file_name = os.path.basename(uploaded_image)
-                    # Replace URL with existing file object
-                    existing_image = existing_images.filter(image__contains=file_name).first()
-                    if existing_image:
-                        updated_uploaded_images.append(existing_image.image)
+                    file_name = unquote(os.path.basename(urlparse(uploaded_image).path))
+                    if file_name in existing_images:
+                        retained_images.append(existing_images[file_name])
                 else:
-                    updated_uploaded_images.append(uploaded_image)
+                    new_images.append(uploaded_image)
+            # Re-uploads of an image the product already has keep that image.
+            matched, new_images = match_uploaded_images(instance, new_images)
+            retained_images += [image_id for image_id in matched if image_id not in retained_images]
+            if hasattr(data, 'setlist'):
+                data.setlist('uploaded_images', new_images)
+            else:
+                data['uploaded_images'] = new_images
+
+        # Options and variants left out of the request are left untouched
+        options_data = data.pop('options', None)
+        if options_data is not None:
+            options_data = parse_json_list(options_data)
+        variants_data = data.pop('variants', None)
+        if variants_data is not None:
+            variants_data = parse_json_list(variants_data)
 
-            for i in range(0, len(updated_uploaded_images)):
-                data['uploaded_images'+str([i])] = updated_uploaded_images[i]
-        
-        print(data)
+        serializer = self.get_serializer(instance, data=data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            product = serializer.save(retained_images=retained_images, options=options_data, variants=variants_data)
 
-        # Update handling of options
-        options_data = data.pop('options', [])
-        if isinstance(options_data, str):
-            options_data = json.loads(options_data)  # Parse options data as JSON
-        # Convert string items to dictionaries
-        options_data = [json.loads(p) if isinstance(p, str) else p for p in options_data]
+        data = self.get_serializer(Product.objects.with_details().get(id=product.id)).data
+        data['image_jobs'] = JobSerializer(getattr(product, 'image_jobs', []), many=True).data
+        return Response(data)
 
-        # Update handling of variants
-        variants_data = data.pop('variants', [])
-        if isinstance(variants_data, str):
-            variants_data = json.loads(variants_data)  # Parse variants data as JSON
-        # Convert string items to dictionaries
-        variants_data = [json.loads(p) if isinstance(p, str) else p for p in variants_data]
-        
-        serializer = self.get_serializer(instance, data=data, partial=partial)
-        
-        try:
-            serializer.is_valid(raise_exception=True)
-            self.perform_update(serializer)
-            product = serializer.save()
-            self.update_options(product, options_data)
-            self.update_variants(product, variants_data)
-            return Response(serializer.data)
-        except ValidationError as e:
-            print(e)
-        print("weeee", serializer.errors)
-        return Response(serializer.errors)
-
-    def update_options(self, product, options_data):
-        for option_data in options_data:
-            values_data = option_data.pop('values', [])
-            option = ProductOption.objects.create(product=product, **option_data)
-            for value_data in values_data:
-                OptionValue.objects.create(option=option, **value_data)
-
-    def update_variants(self, product, variants_data):
-        print(variants_data)
-        for variant_data in variants_data:
-            print(variant_data)
-            values_data = variant_data.pop('values', [{}])
-            product_id = variant_data.pop('product', None)
-            print('wee', variant_data)
-            variant = ProductVariant.objects.create(product=product, **variant_data)
-
-            if isinstance(values_data, str):
-                values_data = json.loads(values_data)  # Parse variants data as JSON
-            # Convert string items to dictionaries
-            values_data = [json.loads(p) if isinstance(p, str) else p for p in values_data]
-
-            for value_data in values_data:
-                name = value_data.get('name')
-                value = OptionValue.objects.get(option__product_id=product.id, name=name)
-                variant.values.add(value)
+    def perform_update(self, serializer):
+        # PATCH: options and variants are reconciled across several statements.
+        with transaction.atomic():
+            serializer.save()
+
+class CatalogImportListCreateAPIView(generics.ListCreateAPIView):
+    serializer_class = CatalogImportSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        shop_id = self.kwargs.get('shop_id')
+        check_shop_access(self.request, shop_id)
+        return CatalogImport.objects.filter(shop_id=shop_id)
+
+    def create(self, request, *args, **kwargs):
+        check_shop_access(request, self.kwargs.get('shop_id'))
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        catalog_import = serializer.save(shop_id=self.kwargs.get('shop_id'))
+        start_catalog_import(catalog_import)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+class CatalogImportRetrieveAPIView(generics.RetrieveAPIView):
+    serializer_class = CatalogImportSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        shop_id = self.kwargs.get('shop_id')
+        check_shop_access(self.request, shop_id)
+        return CatalogImport.objects.filter(shop_id=shop_id)
+
+class CustomerImportListCreateAPIView(generics.ListCreateAPIView):
+    serializer_class = CustomerImportSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        shop_id = self.kwargs.get('shop_id')
+        check_shop_access(self.request, shop_id)
+        return CustomerImport.objects.filter(shop_id=shop_id)
+
+    def create(self, request, *args, **kwargs):
+        check_shop_access(request, self.kwargs.get('shop_id'))
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        customer_import = serializer.save(shop_id=self.kwargs.get('shop_id'))
+        start_customer_import(customer_import)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+class CustomerImportRetrieveAPIView(generics.RetrieveAPIView):
+    serializer_class = CustomerImportSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        shop_id = self.kwargs.get('shop_id')
+        check_shop_access(self.request, shop_id)
+        return CustomerImport.objects.filter(shop_id=shop_id)
+
+class JobList(generics.ListAPIView):
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        shop_id = self.kwargs.get('shop_id')
+        check_shop_access(self.request, shop_id)
+        return Job.objects.filter(shop_id=shop_id)
+
+class JobRetrieveAPIView(generics.RetrieveAPIView):
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        shop_id = self.kwargs.get('shop_id')
+        check_shop_access(self.request, shop_id)
+        return Job.objects.filter(shop_id=shop_id)
 
 class OptionList(generics.ListCreateAPIView):
     queryset = ProductOption.objects.all()
@@ -315,11 +352,12 @@ class VariantDetail(generics.RetrieveUpdateDestroyAPIView):
 
 class PlaceOrderView(generics.ListCreateAPIView):
     serializer_class = OrderSerializer
+    pagination_class = KeysetPagination
     #permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         customer_id = self.kwargs.get('customer_id')
-        return Order.objects.filter(customer_id=customer_id)
+        return Order.objects.filter(customer_id=customer_id).prefetch_related('items')
 
     def post(self, request, *args, **kwargs):
         customer_id = self.kwargs.get('customer_id')
@@ -332,108 +370,138 @@ class PlaceOrderView(generics.ListCreateAPIView):
 
 class CustomerList(generics.ListAPIView):
     serializer_class = CustomerSerializer
+    pagination_class = CustomerPagination
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         shop_id = self.kwargs.get('shop_id')
-        return Customer.objects.filter(shops=shop_id)
-
-############ADMIN###########
-@permission_classes(['IsAuthenticated'])
-@api_view(['GET'])
-def getShopData(request, user_id):
-    data=request.data
-
-    user = User.objects.get(id=user_id)
-    shop = Shop.objects.get(owner=user)
-    shop_serializer = ShopSerializer(shop, many=False)
-
-    products = Product.objects.filter(shop=shop)
-    product_serializer = ProductSerializer(products, many=True)
-    
-    orders = Order.objects.filter(shop=shop).order_by('-created_at')
-    order_serializer = OrderSerializer(orders, many=True)
-
-    new_orders = orders.filter(created_at=user.last_login).order_by('-created_at')
-    new_order_serializer = OrderSerializer(new_orders, many=True)
+        check_shop_access(self.request, shop_id)
+        return Customer.objects.filter(shops=shop_id).with_addresses().with_order_stats(shop=shop_id)
 
-    open_orders = orders.filter(fulfilled = False).order_by('-created_at')
-    open_order_serializer = OrderSerializer(open_orders, many=True)
+##########Export##########
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
 
-    #All time sales
-    all_sales = orders.aggregate(Sum('total_price'))
-
-    #Sales for the week day 
-    today_orders = orders.filter(created_at__gte=timezone.now().replace(hour=0, minute=0, second=0), created_at__lte=timezone.now().replace(hour=23, minute=59, second=59))
-    total_daily_sales = today_orders.aggregate(Sum('total_price'))
-
-    top_order = OrderItem.objects.filter(product__shop=shop, created_at__gte = datetime.now()-timedelta(days=7))
-    best_sellers = top_order.values('product').annotate(num_buys=Sum('quantity')).order_by('-num_buys')
-
-    
-    best_sellers_list = []
-
-    for x in best_sellers:
-        product = Product.objects.get(id = x['product'])
-        serializer = ProductSerializer(product)
-        best_sellers_list.append(serializer.data)
-
-    #daily sales for the current month 
-
-    '''first_present_month = datetime.today().replace(day=1, hour=0, minute=0, second=0)
-    first_next_month = first_present_month + relativedelta.relativedelta(months=1)
-
-    extracted_month_sales = orders.filter(
-        created_at__range = [first_present_month, first_next_month]).annotate(
-        created_at_day = ExtractDay('created_at')
-        ).values('created_at_day').order_by('created_at_day').annotate(total_sales = Sum('get_total_cost'))
-
-    thirty_day_sales = OrderAnalyticsSerializer(extracted_month_sales, many=True).data
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def exportShopData(request, shop_id, kind, file_format):
+    if kind not in EXPORTS or file_format not in EXPORT_CONTENT_TYPES:
+        raise NotFound()
+    check_shop_access(request, shop_id)
+    shop = get_object_or_404(Shop, id=shop_id)
+    response = StreamingHttpResponse(stream_export(kind, shop.id, file_format), content_type=EXPORT_CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = f'attachment; filename="{shop.myjamly_domain or shop.id}-{kind}.{file_format}"'
+    return response
 
-    last_30_day_sales = [0 for x in range(31)]
-    
-    for x in thirty_day_sales:
-        index = int(x['created_at_day']) - 1
-        last_30_day_sales[index] = x['total_sales']'''
 
-    #Number of customers in the store
-    customers = shop.customers.all()
-    num_customers = len(customers)
+############ADMIN###########
+def shop_orders(shop, order_filter=None):
+    orders = Order.objects.filter(shop=shop).prefetch_related('items')
+    if order_filter == 'open':
+        orders = orders.filter(fulfilled=False)
+    elif order_filter == 'new' and shop.owner.last_login:
+        orders = orders.filter(created_at__gt=shop.owner.last_login)
+    return orders
+
+class ShopOrderList(generics.ListAPIView):
+    serializer_class = OrderSerializer
+    pagination_class = KeysetPagination
+    permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        check_shop_access(self.request, self.kwargs.get('shop_id'))
+        shop = get_object_or_404(Shop.objects.select_related('owner'), id=self.kwargs.get('shop_id'))
+        return shop_orders(shop, self.request.query_params.get('filter'))
+
+def order_page(request, shop, order_filter=None):
+    """
+    First page of a shop's orders, with links into ShopOrderList for the rest.
+    """
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(shop_orders(shop, order_filter), request)
+    url = reverse('shop-orders', args=[shop.id])
+    if order_filter:
+        url += '?filter=' + order_filter
+    paginator.base_url = request.build_absolute_uri(url)
+    return paginator.get_paginated_response(OrderSerializer(page, many=True).data).data
 
-    #update_last_login(None, user)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def getShopData(request, user_id):
+    shop = get_object_or_404(Shop.objects.select_related('owner'), owner_id=user_id)
+    check_shop_access(request, shop.id)
+    shop_serializer = ShopSerializer(shop, many=False)
+    last_login = shop.owner.last_login
+
+    now = timezone.localtime()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    first_present_month = today.replace(day=1)
+    first_next_month = (first_present_month + timedelta(days=32)).replace(day=1)
+
+    #All time and today's sales from the daily rollup
+    daily_sales = ShopDailySales.objects.filter(shop=shop)
+    sales = daily_sales.aggregate(
+        all_sales=Sum('gross_revenue'),
+        daily_sales=Sum('gross_revenue', filter=Q(date=today.date())),
+    )
+
+    #Order counts in one pass
+    orders = Order.objects.filter(shop=shop)
+    summary = orders.aggregate(
+        num_orders=Count('id'),
+        num_open_orders=Count('id', filter=Q(fulfilled=False)),
+        num_new_orders=Count('id', filter=Q(created_at__gt=last_login) if last_login else Q(pk__isnull=False)),
+    )
+
+    #Best sellers over the last 7 days
+    best_sellers = OrderItem.objects.filter(
+        product__shop=shop, created_at__gte=now - timedelta(days=7)
+    ).values(
+        'product', 'product__name', 'product__handle', 'product__price', 'product__thumbnail'
+    ).annotate(
+        num_buys=Sum('quantity'), revenue=Sum(F('quantity') * F('price'))
+    ).order_by('-num_buys')[:10]
+    thumbnail_storage = Product._meta.get_field('thumbnail').storage
+    best_sellers_list = [{
+        'id': x['product'],
+        'name': x['product__name'],
+        'handle': x['product__handle'],
+        'price': x['product__price'],
+        'thumbnail': request.build_absolute_uri(thumbnail_storage.url(x['product__thumbnail'])) if x['product__thumbnail'] else None,
+        'num_buys': x['num_buys'],
+        'revenue': x['revenue'],
+    } for x in best_sellers]
+
+    #daily sales for the current month
+    month_sales = daily_sales.filter(
+        date__gte=first_present_month.date(), date__lt=first_next_month.date()
+    ).values_list('date', 'gross_revenue')
+
+    thirty_day_sales = [0 for x in range((first_next_month - first_present_month).days)]
+    for date, gross_revenue in month_sales:
+        thirty_day_sales[date.day - 1] = gross_revenue
 
     return Response({
             'shop': shop_serializer.data,
-            'products' : product_serializer.data,
-            'all_sales': all_sales,
-            'daily_sales': total_daily_sales,
-            'orders' : order_serializer.data,
-            'new_orders': new_order_serializer.data,
-            'open_orders': open_order_serializer.data,
+            'num_products': Product.objects.filter(shop=shop).count(),
+            'all_sales': {'total_price__sum': sales['all_sales']},
+            'daily_sales': {'total_price__sum': sales['daily_sales']},
+            'num_orders': summary['num_orders'],
+            'num_new_orders': summary['num_new_orders'],
+            'num_open_orders': summary['num_open_orders'],
+            'orders': order_page(request, shop),
+            'new_orders': order_page(request, shop, 'new'),
+            'open_orders': order_page(request, shop, 'open'),
             'top_orders': best_sellers_list,
-            #'thirty_day_sales': last_30_day_sales,
-            'num_customers': num_customers,
+            'thirty_day_sales': thirty_day_sales,
+            'num_customers': shop.customers.count(),
         })
 
 
 ####### StoreFront #######
 @api_view(['GET'])
-def storefront(request, domain_name):
-    shop = get_object_or_404(Shop, myjamly_domain=domain_name)
-
-    shop_serializer = ShopSerializer(shop)
-
-    products = Product.objects.filter(shop=shop)[:8]
-    product_serializer = ProductSerializer(products, many=True, context={'request':request})
-
-    collections = Collection.objects.filter(shop=shop)
-    collection_serializer = CollectionSerializer(collections, many=True, context={'request':request})
-
-    data = {
-        'shop': shop_serializer.data,
-        'products': product_serializer.data,
-        'collections': collection_serializer.data,
-    }
-
-    return Response(data)
\ No newline at end of file
+@permission_classes([IsAdminUser])
+def storefrontCacheStats(request):
+    return Response(storefront_cache_stats())
\ No newline at end of file
@@ -0,0 +1,100 @@
+import asyncio
+from functools import wraps
+
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed
+from rest_framework.renderers import JSONRenderer
+
+from base.caching import get_storefront, set_storefront
+from base.conditional import storefront_collection_condition, storefront_condition, storefront_product_condition
+from base.db import database_sync_to_async
+from base.models import Collection, Product, Shop
+from base.serializers import CollectionSerializer, ProductSerializer, ShopSerializer
+
+
+# Customer-facing reads are async so that, served through backend/asgi.py, a
+# worker waiting on the database can take other shoppers' requests. The ORM
+# is sync, so queries run through database_sync_to_async; independent ones
+# are awaited together.
+
+def require_safe(view):
+    @wraps(view)
+    async def inner(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        return await view(request, *args, **kwargs)
+    return inner
+
+
+def json_response(content):
+    return HttpResponse(content, content_type='application/json')
+
+
+##########StoreFront##########
+def _shop_data(domain_name):
+    shop = Shop.objects.select_related('owner').filter(myjamly_domain=domain_name).first()
+    return ShopSerializer(shop).data if shop else None
+
+
+def _products_data(request, domain_name):
+    products = Product.objects.filter(shop__myjamly_domain=domain_name).with_details()[:8]
+    return ProductSerializer(products, many=True, context={'request': request}).data
+
+
+def _collections_data(request, domain_name):
+    collections = Collection.objects.filter(shop__myjamly_domain=domain_name).with_products()
+    return CollectionSerializer(collections, many=True, context={'request': request}).data
+
+
+@require_safe
+@storefront_condition
+async def storefront(request, domain_name):
+    content = await database_sync_to_async(get_storefront)(domain_name)
+    if content is not None:
+        return json_response(content)
+
+    shop, products, collections = await asyncio.gather(
+        database_sync_to_async(_shop_data)(domain_name),
+        database_sync_to_async(_products_data)(request, domain_name),
+        database_sync_to_async(_collections_data)(request, domain_name),
+    )
+    if shop is None:
+        raise Http404('No shop matches the given query.')
+
+    content = JSONRenderer().render({
+        'shop': shop,
+        'products': products,
+        'collections': collections,
+    })
+    await database_sync_to_async(set_storefront)(domain_name, content)
+    return json_response(content)
+
+
+##########Product##########
+def _product_data(request, domain_name, handle):
+    product = Product.objects.filter(shop__myjamly_domain=domain_name, handle=handle).with_details().first()
+    return ProductSerializer(product, context={'request': request}).data if product else None
+
+
+@require_safe
+@storefront_product_condition
+async def storefrontProduct(request, domain_name, handle):
+    data = await database_sync_to_async(_product_data)(request, domain_name, handle)
+    if data is None:
+        raise Http404('No product matches the given query.')
+    return json_response(JSONRenderer().render(data))
+
+
+##########Collection##########
+def _collection_data(request, domain_name, handle):
+    collection = (Collection.objects.filter(shop__myjamly_domain=domain_name, handle=handle)
+                  .with_products().first())
+    return CollectionSerializer(collection, context={'request': request}).data if collection else None
+
+
+@require_safe
+@storefront_collection_condition
+async def storefrontCollection(request, domain_name, handle):
+    data = await database_sync_to_async(_collection_data)(request, domain_name, handle)
+    if data is None:
+        raise Http404('No collection matches the given query.')
+    return json_response(JSONRenderer().render(data))
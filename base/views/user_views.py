@@ -1,17 +1,40 @@
 from rest_framework import status, generics
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny
-from rest_framework_simplejwt.views import TokenObtainPairView
-from base.serializers import CustomerSignUpSerializer, MyTokenObtainPairSerializer, ShopOwnerSignUpSerializer
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from base.serializers import CustomerSignUpSerializer, MyTokenObtainPairSerializer, PasswordResetConfirmSerializer, PasswordResetSerializer, ShopOwnerSignUpSerializer, ShopTokenRefreshSerializer
 
 
 class MyObtainTokenPairView(TokenObtainPairView):
     permission_classes = (AllowAny,)
     serializer_class = MyTokenObtainPairSerializer
 
+class MyTokenRefreshView(TokenRefreshView):
+    serializer_class = ShopTokenRefreshSerializer
+
 class ShopOwnerSignUpView(generics.CreateAPIView):
     serializer_class = ShopOwnerSignUpSerializer
     permission_classes = [AllowAny]
 
 class CustomerSignUpView(generics.CreateAPIView):
     serializer_class = CustomerSignUpSerializer
-    permission_classes = [AllowAny]
\ No newline at end of file
+    permission_classes = [AllowAny]
+
+class PasswordResetView(APIView):
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        serializer = PasswordResetSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class PasswordResetConfirmView(APIView):
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        serializer = PasswordResetConfirmSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(status=status.HTTP_204_NO_CONTENT)